@@ -0,0 +1,116 @@
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt import authentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+from project.profiling import timed
+
+
+USER_CACHE_DEFAULTS = {
+    'MAX_SIZE': 1024,
+    # Seconds; also bounds how long another process can serve a stale user
+    'TIMEOUT': 60,
+}
+
+
+class UserCache:
+    # Bounded LRU of users by id with a per-entry TTL. Saves and deletes in
+    # this process evict the entry (accounts/signals.py); bulk
+    # QuerySet.update() calls do not, and are only picked up after TIMEOUT.
+    # Ids are keyed as strings, the way they appear in the token claims.
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._counters = {'hits': 0, 'misses': 0}
+
+
+    @property
+    def config(self):
+        return {**USER_CACHE_DEFAULTS, **getattr(settings, 'AUTH_USER_CACHE', {})}
+
+
+    def get(self, user_id):
+        user_id = str(user_id)
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and entry[0] <= time.monotonic():
+                del self._entries[user_id]
+                entry = None
+
+            if entry is None:
+                self._counters['misses'] += 1
+                return None
+
+            self._entries.move_to_end(user_id)
+            self._counters['hits'] += 1
+
+        # Each request gets its own instance, so nothing set on request.user leaks
+        return copy.copy(entry[1])
+
+
+    def set(self, user_id, user):
+        config = self.config
+        if config['TIMEOUT'] <= 0 or config['MAX_SIZE'] <= 0:
+            return
+
+        user_id = str(user_id)
+        with self._lock:
+            self._entries[user_id] = (time.monotonic() + config['TIMEOUT'], copy.copy(user))
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > config['MAX_SIZE']:
+                self._entries.popitem(last=False)
+
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(str(user_id), None)
+
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            for name in self._counters:
+                self._counters[name] = 0
+
+
+    def info(self):
+        with self._lock:
+            return {**self._counters, 'size': len(self._entries)}
+
+
+user_cache = UserCache()
+
+
+class JWTAuthentication(authentication.JWTAuthentication):
+    def authenticate(self, request):
+        with timed('auth'):
+            return super().authenticate(request)
+
+
+    def get_user(self, validated_token):
+        user_id = validated_token.get(api_settings.USER_ID_CLAIM)
+        user = user_cache.get(user_id) if user_id is not None else None
+        if user is None:
+            # Looks the user up and runs the active / revoked checks
+            user = super().get_user(validated_token)
+            user_cache.set(user_id, user)
+            return user
+
+        # Cached users were active when stored and are evicted on save, but
+        # the token itself still has to be checked against them
+        if api_settings.CHECK_USER_IS_ACTIVE and not user.is_active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+
+        if api_settings.CHECK_REVOKE_TOKEN:
+            if validated_token.get(api_settings.REVOKE_TOKEN_CLAIM) != get_md5_hash_password(user.password):
+                raise AuthenticationFailed(_("The user's password has been changed."), code="password_changed")
+
+        return user
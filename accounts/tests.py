@@ -1,3 +1,85 @@
-from django.test import TestCase
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import AccessToken
+
+from .authentication import user_cache
+
+
+User = get_user_model()
+
+
+class CachedJWTAuthenticationTests(TestCase):
+    def setUp(self):
+        user_cache.clear()
+        self.user = User.objects.create_user(email='owner@example.com', username='owner', password='password123')
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(self.user)}')
+
+    def get(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/stats/overview/')
+        user_queries = [query for query in queries.captured_queries if '"accounts_user"' in query['sql']]
+        return response, len(queries), len(user_queries)
+
+    def test_repeated_requests_skip_the_user_query(self):
+        response, first_total, first_user = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(first_user, 1)
+
+        response, second_total, second_user = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(second_user, 0)
+        self.assertEqual(second_total, first_total - 1)
+        self.assertEqual(user_cache.info()['hits'], 1)
+
+    def test_deactivation_takes_effect_immediately(self):
+        self.get()
+
+        self.user.is_active = False
+        self.user.save()
+
+        self.assertEqual(self.get()[0].status_code, 401)
+
+    def test_password_change_reloads_the_user(self):
+        self.get()
+
+        self.user.set_password('another-password')
+        self.user.save()
+
+        self.assertEqual(self.get()[2], 1)
+
+    @mock.patch.object(api_settings, 'CHECK_REVOKE_TOKEN', True)
+    def test_revoked_tokens_are_rejected_from_the_cache(self):
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(self.user)}')
+        self.assertEqual(self.get()[0].status_code, 200)
+
+        # A write that skips the signals leaves the cached user in place
+        User.objects.filter(pk=self.user.pk).update(password='changed')
+        self.assertEqual(self.get()[0].status_code, 200)
+
+        user_cache.invalidate(self.user.pk)
+        self.assertEqual(self.get()[0].status_code, 401)
+
+    def test_entries_expire_and_the_size_is_bounded(self):
+        with override_settings(AUTH_USER_CACHE={'MAX_SIZE': 2, 'TIMEOUT': 60}):
+            with mock.patch('accounts.authentication.time.monotonic', return_value=1000):
+                for pk in (1, 2, 3):
+                    user_cache.set(pk, self.user)
+                self.assertIsNone(user_cache.get(1))
+                self.assertIsNotNone(user_cache.get(2))
+
+            with mock.patch('accounts.authentication.time.monotonic', return_value=1061):
+                self.assertIsNone(user_cache.get(2))
+
+        self.assertEqual(user_cache.info()['size'], 1)
+
+    @override_settings(AUTH_USER_CACHE={'TIMEOUT': 0})
+    def test_disabled_cache(self):
+        self.get()
+        self.assertEqual(self.get()[2], 1)
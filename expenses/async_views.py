@@ -0,0 +1,137 @@
+from asgiref.sync import sync_to_async
+from django.utils.cache import get_conditional_response
+from django.views import View
+from rest_framework.response import Response
+
+from .cache import stats_cache
+from .conditional import get_validators, set_validators
+from .filters import DailyRollupFilter
+from .services.parallel import build_category_stats_concurrently, build_stats_concurrently, in_pool
+from .services.stats import build_stats, get_stats_backend, limit_stats
+from .views import StatsViewSet, TransactionViewSet, get_max_points
+
+
+class AsyncStatsView(View):
+    # Async twin of a stats action. Authentication, permissions, throttling,
+    # the conditional GET validators and the stats cache all go through the
+    # viewset on the sync side; only the aggregation runs from the event
+    # loop, split into date ranges that are queried concurrently on the
+    # bounded pool in services/parallel.py. Responses are byte-identical to
+    # the sync endpoint and share its ETags and cache entries. Subclasses
+    # implement compute(state), the coroutine that builds the payload.
+    viewset_class = None
+    action = None
+    endpoint = None
+    params = ()
+    filtered = False
+
+
+    async def get(self, request, *args, **kwargs):
+        view, response, state = await sync_to_async(self.start)(request, *args, **kwargs)
+        if response is None:
+            data = await self.compute(state)
+            response = await sync_to_async(self.finish)(view, data, state)
+        return response
+
+
+    def start(self, request, *args, **kwargs):
+        view = self.viewset_class()
+        view.action_map = {'get': self.action, 'head': self.action}
+        view.args, view.kwargs = args, kwargs
+        view.request = request = view.initialize_request(request, *args, **kwargs)
+        view.headers = view.default_response_headers
+
+        try:
+            view.initial(request, *args, **kwargs)
+            response, state = self.prepare(view, request)
+        except Exception as exc:
+            response, state = view.handle_exception(exc), None
+
+        if response is not None:
+            response = view.finalize_response(request, response, *args, **kwargs)
+        return view, response, state
+
+
+    def prepare(self, view, request):
+        # (response, None) when the request is answered without aggregating,
+        # otherwise (None, state) for compute() and finish()
+        etag, last_modified = get_validators(request, self.endpoint)
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is not None:
+            return set_validators(response, etag, last_modified), None
+
+        key = stats_cache.make_key(request, self.endpoint, self.params, self.filtered)
+        data = stats_cache.get(key) if key is not None else None
+        if data is not None:
+            return set_validators(Response(data), etag, last_modified), None
+
+        state = self.get_state(view, request)
+        if isinstance(state, Response):
+            return state, None
+
+        return None, {**state, 'key': key, 'etag': etag, 'last_modified': last_modified}
+
+
+    def finish(self, view, data, state):
+        data = self.finalize_data(data, state)
+        if state['key'] is not None:
+            stats_cache.set(state['key'], data)
+
+        response = view.finalize_response(view.request, Response(data), *view.args, **view.kwargs)
+        return set_validators(response, state['etag'], state['last_modified'])
+
+
+    def get_state(self, view, request):
+        # What compute(state) needs, built on the sync side, or a Response
+        # to answer with instead
+        return {'qs': view.get_rollups()}
+
+
+    def finalize_data(self, data, state):
+        return data
+
+
+class TransactionStatsView(AsyncStatsView):
+    viewset_class = TransactionViewSet
+    action = 'stats'
+    endpoint = 'transaction-stats'
+    params = ('max_points',)
+    filtered = True
+
+
+    def get_state(self, view, request):
+        try:
+            max_points = get_max_points(request)
+        except ValueError:
+            return Response({"error": "max_points must be an integer of at least 2"}, status=400)
+
+        if DailyRollupFilter.supports(request.query_params):
+            qs = view.get_rollups()
+        else:
+            qs = view.filter_queryset(view.get_queryset())
+
+        return {'qs': qs, 'max_points': max_points, 'backend': get_stats_backend()}
+
+
+    async def compute(self, state):
+        # Only the ORM builder works from rows that can be fetched per date
+        # range and concatenated; any other backend scans the whole queryset
+        if state['backend'] is build_stats:
+            return await build_stats_concurrently(state['qs'])
+        return await in_pool(state['backend'], state['qs'])
+
+
+    def finalize_data(self, data, state):
+        if state['max_points'] is not None:
+            data = limit_stats(data, state['max_points'])
+        return data
+
+
+class CategoryStatsView(AsyncStatsView):
+    viewset_class = StatsViewSet
+    action = 'categories'
+    endpoint = 'stats-categories'
+
+
+    async def compute(self, state):
+        return await build_category_stats_concurrently(state['qs'])
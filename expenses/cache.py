@@ -0,0 +1,164 @@
+import hashlib
+import pickle
+import threading
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from rest_framework.response import Response
+
+from .filters import TransactionFilter
+
+
+STATS_CACHE_DEFAULTS = {
+    'ALIAS': 'default',
+    'TIMEOUT': 300,
+    'MAX_ENTRY_SIZE': 256 * 1024,
+}
+
+
+class StatsCache:
+    # Per-user versioned cache for stats responses.
+    # Every Transaction or Category write bumps the owner's version once it
+    # has committed, which changes all of their keys, so stale entries are
+    # never read again and simply age out through the backend's MAX_ENTRIES
+    # culling. The versions are only seen by processes sharing the backend:
+    # with several workers STATS_CACHE['ALIAS'] must name a shared cache
+    # (Redis, Memcached, the database), see checks.py.
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {'hits': 0, 'misses': 0, 'stores': 0, 'oversized': 0}
+
+
+    @property
+    def config(self):
+        return {**STATS_CACHE_DEFAULTS, **getattr(settings, 'STATS_CACHE', {})}
+
+
+    @property
+    def cache(self):
+        return caches[self.config['ALIAS']]
+
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+
+    def info(self):
+        with self._lock:
+            counters = dict(self._counters)
+
+        lookups = counters['hits'] + counters['misses']
+        counters['hit_rate'] = counters['hits'] / lookups if lookups else 0.0
+        return counters
+
+
+    def reset_info(self):
+        with self._lock:
+            for name in self._counters:
+                self._counters[name] = 0
+
+
+    def version_key(self, user_id):
+        return f'stats:version:{user_id}'
+
+
+    def get_version(self, user_id):
+        version = self.cache.get(self.version_key(user_id))
+        if version is None:
+            # Seed from the clock so an evicted counter never restarts at a
+            # value that older entries were stored under
+            self.cache.add(self.version_key(user_id), time.time_ns(), timeout=None)
+            version = self.cache.get(self.version_key(user_id))
+        return version
+
+
+    def bump_version(self, user_id):
+        try:
+            self.cache.incr(self.version_key(user_id))
+        except ValueError:
+            self.cache.add(self.version_key(user_id), time.time_ns(), timeout=None)
+
+
+    def bump_version_on_commit(self, user_id, using=None):
+        # Bumping inside the write's transaction would let a concurrent reader
+        # store the old payload under the new version
+        transaction.on_commit(lambda: self.bump_version(user_id), using=using)
+
+
+    def normalize_params(self, query_params, extra=(), filtered=False):
+        # Only parameters that change the payload take part in the key, in
+        # their cleaned form, so ?type=income&start_date=2024-1-1 and
+        # ?start_date=2024-01-01&type=income&foo=1 share an entry
+        params = {}
+
+        if filtered:
+            filterset = TransactionFilter(query_params)
+            if not filterset.is_valid():
+                return None
+
+            params = {
+                name: value.pk if hasattr(value, 'pk') else value
+                for name, value in filterset.form.cleaned_data.items()
+                if value not in (None, '')
+            }
+
+        for name in extra:
+            value = query_params.get(name)
+            if value:
+                params[name] = value.strip().lower()
+
+        return sorted((name, str(value)) for name, value in params.items())
+
+
+    def make_key(self, request, endpoint, extra=(), filtered=False):
+        params = self.normalize_params(request.query_params, extra, filtered)
+        if params is None:
+            return None
+
+        digest = hashlib.sha1(repr(params).encode()).hexdigest()
+        return f'stats:{request.user.pk}:{self.get_version(request.user.pk)}:{endpoint}:{digest}'
+
+
+    def get(self, key):
+        payload = self.cache.get(key)
+        self._count('misses' if payload is None else 'hits')
+        return None if payload is None else pickle.loads(payload)
+
+
+    def set(self, key, data):
+        payload = pickle.dumps(data, pickle.HIGHEST_PROTOCOL)
+        if len(payload) > self.config['MAX_ENTRY_SIZE']:
+            self._count('oversized')
+            return
+
+        self.cache.set(key, payload, self.config['TIMEOUT'])
+        self._count('stores')
+
+
+stats_cache = StatsCache()
+
+
+def cached_stats(endpoint, params=(), filtered=False):
+    def decorator(view_method):
+        @wraps(view_method)
+        def wrapper(self, request, *args, **kwargs):
+            key = stats_cache.make_key(request, endpoint, params, filtered)
+            if key is None:
+                return view_method(self, request, *args, **kwargs)
+
+            data = stats_cache.get(key)
+            if data is not None:
+                return Response(data)
+
+            response = view_method(self, request, *args, **kwargs)
+            if response.status_code == 200:
+                stats_cache.set(key, response.data)
+
+            return response
+        return wrapper
+    return decorator
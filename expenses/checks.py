@@ -0,0 +1,30 @@
+from django.conf import settings
+from django.core.checks import Tags, Warning, register
+
+from .cache import stats_cache
+
+
+# Backends whose entries live in the memory of one process
+PROCESS_LOCAL_CACHES = {
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+}
+
+
+@register(Tags.caches, deploy=True)
+def check_stats_cache_is_shared(app_configs, **kwargs):
+    # The per-user stats versions are bumped by the worker that handled the
+    # write; the others keep serving entries stored under the old version
+    alias = stats_cache.config['ALIAS']
+    backend = settings.CACHES.get(alias, {}).get('BACKEND')
+    if backend not in PROCESS_LOCAL_CACHES:
+        return []
+
+    return [
+        Warning(
+            f"The stats cache '{alias}' uses {backend.rsplit('.', 1)[-1]}, which is not shared between processes.",
+            hint='Point STATS_CACHE["ALIAS"] at a shared backend such as Redis, Memcached or the database cache '
+                 'when running more than one worker.',
+            id='expenses.W001',
+        )
+    ]
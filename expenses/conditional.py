@@ -0,0 +1,46 @@
+import hashlib
+from calendar import timegm
+from functools import wraps
+
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date, quote_etag
+
+from .services.changes import get_marker
+
+
+def get_validators(request, endpoint):
+    # (etag, last_modified) for the owner's current change marker
+    version, modified_at = get_marker(request.user.pk)
+
+    # The query string and Accept header select the representation
+    variant = f"{endpoint}?{request.META.get('QUERY_STRING', '')};{request.META.get('HTTP_ACCEPT', '')}"
+    digest = hashlib.sha1(variant.encode()).hexdigest()[:16]
+    return quote_etag(f'{request.user.pk}-{version}-{digest}'), timegm(modified_at.utctimetuple())
+
+
+def set_validators(response, etag, last_modified):
+    response.headers.setdefault('ETag', etag)
+    response.headers.setdefault('Last-Modified', http_date(last_modified))
+    patch_cache_control(response, private=True, no_cache=True)
+    patch_vary_headers(response, ['Authorization'])
+    return response
+
+
+def conditional_get(endpoint):
+    # ETag / Last-Modified validators from the owner's change marker. A
+    # matching If-None-Match or If-Modified-Since is answered with 304 before
+    # the view (and the stats cache) runs.
+    def decorator(view_method):
+        @wraps(view_method)
+        def wrapper(self, request, *args, **kwargs):
+            etag, last_modified = get_validators(request, endpoint)
+
+            response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+            if response is None:
+                response = view_method(self, request, *args, **kwargs)
+                if response.status_code != 200:
+                    return response
+
+            return set_validators(response, etag, last_modified)
+        return wrapper
+    return decorator
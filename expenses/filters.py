@@ -1,5 +1,20 @@
+import re
+
 import django_filters
-from .models import Transaction
+from django.db import connections
+from django.db.models import F, FloatField, Value
+from rest_framework.filters import OrderingFilter
+from .models import DailyRollup, Transaction
+
+
+def fts_query(text):
+    # FTS5 query matching every word of text, the last one as a prefix so
+    # results show up while typing. Words are quoted, so FTS5 operators and
+    # punctuation in the input are searched for literally, never parsed.
+    words = re.findall(r'\w+', text)
+    if not words:
+        return None
+    return ' '.join(f'"{word}"' for word in words) + '*'
 
 
 class TransactionFilter(django_filters.FilterSet):
@@ -7,8 +22,48 @@ class TransactionFilter(django_filters.FilterSet):
     end_date = django_filters.DateFilter(field_name='date', lookup_expr='lte')
     min_amount = django_filters.NumberFilter(field_name='amount', lookup_expr='gte')
     max_amount = django_filters.NumberFilter(field_name='amount', lookup_expr='lte')
+    q = django_filters.CharFilter(method='search')
 
 
     class Meta:
         model = Transaction
-        fields = ['category', 'type', 'start_date', 'end_date', 'min_amount', 'max_amount']
\ No newline at end of file
+        fields = ['category', 'type', 'start_date', 'end_date', 'min_amount', 'max_amount', 'q']
+
+
+    def search(self, queryset, name, value):
+        # Description search through the FTS5 index, annotated with its
+        # relevance as search_rank (lower is better)
+        query = fts_query(value)
+        if query is None:
+            return queryset.none().annotate(search_rank=Value(0.0, output_field=FloatField()))
+
+        if connections[queryset.db].vendor != 'sqlite':
+            for word in re.findall(r'\w+', value):
+                queryset = queryset.filter(description__icontains=word)
+            return queryset.annotate(search_rank=Value(0.0, output_field=FloatField()))
+
+        return queryset.filter(search__description__match=query).annotate(search_rank=F('search__rank'))
+
+
+class DailyRollupFilter(django_filters.FilterSet):
+    # The TransactionFilter parameters that can be answered from daily rollups
+    start_date = django_filters.DateFilter(field_name='date', lookup_expr='gte')
+    end_date = django_filters.DateFilter(field_name='date', lookup_expr='lte')
+
+
+    class Meta:
+        model = DailyRollup
+        fields = ['category', 'type', 'start_date', 'end_date']
+
+
+    @classmethod
+    def supports(cls, params):
+        return not any(params.get(name) for name in TransactionFilter.base_filters if name not in cls.base_filters)
+
+
+class SearchOrderingFilter(OrderingFilter):
+    # Search results are ordered by relevance unless ?ordering= is given
+    def get_default_ordering(self, view):
+        if view.request.query_params.get('q', '').strip():
+            return ['search_rank']
+        return super().get_default_ordering(view)
@@ -0,0 +1,57 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from expenses.services.benchmark import ASYNC_ENDPOINTS, compare_async
+from expenses.services.parallel import shutdown_executor
+
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = 'Compare the sync stats actions with their async versions under concurrent ASGI requests'
+
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', required=True, help='Email of the user to compute stats for')
+        parser.add_argument('--concurrency', type=int, default=8, help='Simultaneous requests per round (default: 8)')
+        parser.add_argument('--rounds', type=int, default=5, help='Rounds per endpoint (default: 5)')
+        parser.add_argument('--endpoint', action='append', choices=list(ASYNC_ENDPOINTS), help='Only run these endpoints')
+        parser.add_argument(
+            '--source', choices=['transactions', 'rollups'], default='rollups',
+            help='Aggregate raw transactions or daily rollups; only transaction-stats can use raw rows (default: rollups)'
+        )
+
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(email=options['user'])
+        except User.DoesNotExist:
+            raise CommandError(f"User {options['user']} does not exist")
+
+        if options['concurrency'] < 1 or options['rounds'] < 1:
+            raise CommandError('--concurrency and --rounds must be at least 1')
+
+        # An amount filter that matches everything sends transaction-stats to the raw rows
+        params = {'min_amount': '0'} if options['source'] == 'transactions' else {}
+        try:
+            results = compare_async(
+                user, concurrency=options['concurrency'], rounds=options['rounds'], params=params,
+                endpoints=options['endpoint'],
+            )
+        finally:
+            shutdown_executor()
+
+        self.stdout.write(f"{'endpoint':<28} {'wall ms':>9} {'p50 ms':>9} {'p90 ms':>9} {'req/s':>8}")
+        for name, result in results.items():
+            latency = result['latency_ms']
+            self.stdout.write(
+                f"{name:<28} {result['wall_ms']:9.2f} {latency['p50']:9.2f} {latency['p90']:9.2f} "
+                f"{result['requests_per_second']:8.1f}"
+            )
+
+        different = [name for name in results if not results[name]['identical'] and name in ASYNC_ENDPOINTS]
+        if different:
+            raise CommandError(f"Async responses differ from the sync ones: {', '.join(different)}")
+
+        self.stdout.write(self.style.SUCCESS('Async responses are identical to the sync ones'))
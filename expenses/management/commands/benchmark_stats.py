@@ -0,0 +1,58 @@
+import statistics
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from expenses.models import DailyRollup, Transaction
+from expenses.routers import shard_for
+from expenses.services.stats import STATS_BACKENDS, get_stats_backend
+
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = 'Time every stats backend on one user and check that they return identical results'
+
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', required=True, help='Email of the user to compute stats for')
+        parser.add_argument('--repeat', type=int, default=5, help='Runs per backend (default: 5)')
+        parser.add_argument(
+            '--source', choices=['transactions', 'rollups'], default='transactions',
+            help='Feed the backends raw transactions or daily rollups (default: transactions)'
+        )
+        parser.add_argument('--backend', action='append', choices=list(STATS_BACKENDS), help='Backends to compare (default: all)')
+
+
+    def handle(self, *args, **options):
+        try:
+            owner = User.objects.get(email=options['user'])
+        except User.DoesNotExist:
+            raise CommandError(f"User {options['user']} does not exist")
+
+        model = DailyRollup if options['source'] == 'rollups' else Transaction
+        qs = model.objects.using(shard_for(owner.pk)).filter(owner=owner)
+
+        results = {}
+        for name in options['backend'] or list(STATS_BACKENDS):
+            build = get_stats_backend(name)
+
+            timings = []
+            for _ in range(options['repeat']):
+                start = time.perf_counter()
+                results[name] = build(qs)
+                timings.append((time.perf_counter() - start) * 1000)
+
+            self.stdout.write(
+                f'{name:>6}: median {statistics.median(timings):9.2f} ms, '
+                f'min {min(timings):9.2f} ms over {len(timings)} runs'
+            )
+
+        reference_name, reference = next(iter(results.items()))
+        for name, result in results.items():
+            if result != reference:
+                raise CommandError(f'{name} returned different stats than {reference_name}')
+
+        self.stdout.write(self.style.SUCCESS(f"{qs.count()} {options['source']}: all backends agree"))
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from expenses.services.synthetic import SCALES, generate_dataset
+
+
+class Command(BaseCommand):
+    help = 'Generate deterministic synthetic users, categories and transactions for benchmarking'
+
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', choices=list(SCALES), default='10k', help='Total number of transactions (default: 10k)')
+        parser.add_argument('--transactions', type=int, help='Exact number of transactions, overrides --scale')
+        parser.add_argument('--users', type=int, default=1, help='Number of users to spread the transactions over')
+        parser.add_argument('--categories', type=int, default=10, help='Categories per user')
+        parser.add_argument('--years', type=int, default=10, help='Length of the generated history')
+        parser.add_argument('--seed', type=int, default=42, help='Random seed; the same seed produces the same data')
+
+
+    def handle(self, *args, **options):
+        transactions = options['transactions'] or SCALES[options['scale']]
+        if transactions < 0 or options['users'] < 1 or options['categories'] < 1 or options['years'] < 1:
+            raise CommandError('Counts must be positive')
+
+        users = generate_dataset(
+            transactions,
+            users=options['users'],
+            categories=options['categories'],
+            seed=options['seed'],
+            years=options['years'],
+        )
+
+        for user in users:
+            self.stdout.write(f'{user.email}: {user.transaction_set.count()} transactions')
+        self.stdout.write(self.style.SUCCESS(f'Generated {transactions} transactions for {len(users)} users'))
@@ -0,0 +1,40 @@
+import datetime
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from expenses.routers import shards_of, use_shard
+from expenses.services.sync import prune_tombstones
+
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = 'Delete old sync tombstones; clients with older cursors are told to do a full sync'
+
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=90, help='Keep tombstones younger than this many days (default: 90)')
+        parser.add_argument('--user', help='Email of the user to process (default: everyone)')
+
+
+    def handle(self, *args, **options):
+        if options['days'] < 0:
+            raise CommandError('--days must not be negative')
+
+        owner = None
+        if options['user']:
+            try:
+                owner = User.objects.get(email=options['user'])
+            except User.DoesNotExist:
+                raise CommandError(f"User {options['user']} does not exist")
+
+        before = timezone.now() - datetime.timedelta(days=options['days'])
+        owner_id = owner.pk if owner else None
+        count = 0
+        for alias in shards_of(owner_id):
+            with use_shard(owner_id, alias):
+                count += prune_tombstones(before, owner)
+        self.stdout.write(self.style.SUCCESS(f'Pruned {count} tombstones'))
@@ -0,0 +1,54 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from expenses.routers import get_shards, shard_for
+from expenses.services.shards import ShardMoveError, move_owner, plan_rebalance, shard_loads
+
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = 'Even out the transactions across EXPENSES_SHARDS, or move one user to a given shard'
+
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', help='Email of a user to move; requires --to')
+        parser.add_argument('--to', help='Shard to move the user to')
+        parser.add_argument('--dry-run', action='store_true', help='Only print the moves')
+
+
+    def handle(self, *args, **options):
+        if bool(options['user']) != bool(options['to']):
+            raise CommandError('--user and --to go together')
+
+        if options['user']:
+            try:
+                owner = User.objects.get(email=options['user'])
+            except User.DoesNotExist:
+                raise CommandError(f"User {options['user']} does not exist")
+            if options['to'] not in get_shards():
+                raise CommandError(f"{options['to']} is not one of EXPENSES_SHARDS: {', '.join(get_shards())}")
+            moves = [(owner.pk, shard_for(owner.pk), options['to'], None)]
+        else:
+            loads = shard_loads()
+            for alias, owners in loads.items():
+                self.stdout.write(f'{alias}: {len(owners)} users, {sum(owners.values())} transactions')
+            moves = plan_rebalance(loads)
+
+        moved = 0
+        for owner_id, source, target, count in moves:
+            if source == target:
+                continue
+            if options['dry_run']:
+                self.stdout.write(f'Would move user {owner_id} from {source} to {target}')
+                continue
+
+            try:
+                count = move_owner(owner_id, target)
+            except ShardMoveError as exc:
+                raise CommandError(str(exc))
+            self.stdout.write(f'Moved user {owner_id} from {source} to {target} ({count} transactions)')
+            moved += 1
+
+        self.stdout.write(self.style.SUCCESS(f'{moved} users moved'))
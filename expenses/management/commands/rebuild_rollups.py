@@ -0,0 +1,56 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from expenses.routers import shards_of, use_shard
+from expenses.services.balances import rebuild_balances, verify_balances
+from expenses.services.rollups import rebuild_rollups, verify_rollups
+from expenses.services.sketches import rebuild_sketches, verify_sketches
+
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = (
+        'Rebuild the per-user daily rollups, monthly balance checkpoints and spend sketches from the Transaction table, '
+        'or verify them'
+    )
+
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', help='Email of the user to process (default: everyone)')
+        parser.add_argument('--verify', action='store_true', help='Only report rollups that drifted from the transactions')
+
+
+    def handle(self, *args, **options):
+        owner = None
+        if options['user']:
+            try:
+                owner = User.objects.get(email=options['user'])
+            except User.DoesNotExist:
+                raise CommandError(f"User {options['user']} does not exist")
+
+        owner_id = owner.pk if owner else None
+        if not options['verify']:
+            count = months = sketches = 0
+            for alias in shards_of(owner_id):
+                with use_shard(owner_id, alias):
+                    count += rebuild_rollups(owner)
+                    months += rebuild_balances(owner)
+                    sketches += rebuild_sketches(owner)
+            self.stdout.write(self.style.SUCCESS(
+                f'Rebuilt {count} daily rollups, {months} monthly balances and {sketches} spend sketches'
+            ))
+            return
+
+        mismatches = []
+        for alias in shards_of(owner_id):
+            with use_shard(owner_id, alias):
+                mismatches += verify_rollups(owner) + verify_balances(owner) + verify_sketches(owner)
+        for key, expected, actual in mismatches:
+            self.stdout.write(f'{key}: expected {expected}, stored {actual}')
+
+        if mismatches:
+            raise CommandError(f'{len(mismatches)} rollups are out of date, run without --verify to rebuild them')
+
+        self.stdout.write(self.style.SUCCESS('Daily rollups, monthly balances and spend sketches are up to date'))
@@ -0,0 +1,46 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from expenses.routers import shards_of, use_shard
+from expenses.services.budgets import repair_spend, verify_spend
+
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = 'Compare the per-category monthly spend counters with the Transaction table and repair the ones that drifted'
+
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', help='Email of the user to process (default: everyone)')
+        parser.add_argument('--dry-run', action='store_true', help='Only report the counters that drifted')
+
+
+    def handle(self, *args, **options):
+        owner = None
+        if options['user']:
+            try:
+                owner = User.objects.get(email=options['user'])
+            except User.DoesNotExist:
+                raise CommandError(f"User {options['user']} does not exist")
+
+        owner_id = owner.pk if owner else None
+        drifted = 0
+        for alias in shards_of(owner_id):
+            with use_shard(owner_id, alias):
+                mismatches = verify_spend(owner)
+                for key, expected, actual in mismatches:
+                    self.stdout.write(f'{key}: expected {expected}, stored {actual}')
+
+                drifted += len(mismatches)
+                if mismatches and not options['dry_run']:
+                    repair_spend(mismatches)
+
+        if drifted and options['dry_run']:
+            raise CommandError(f'{drifted} spend counters drifted, run without --dry-run to repair them')
+        if drifted:
+            self.stdout.write(self.style.SUCCESS(f'Repaired {drifted} spend counters'))
+            return
+
+        self.stdout.write(self.style.SUCCESS('Spend counters are up to date'))
@@ -0,0 +1,64 @@
+import json
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from expenses.services.benchmark import compare_with_baseline, discover_endpoints, load_results, run_benchmarks
+
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = 'Drive every expenses endpoint through the test client and report latency, SQL queries and peak memory'
+
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', required=True, help='Email of the user to benchmark (see generate_synthetic_data)')
+        parser.add_argument('--iterations', type=int, default=20, help='Timed requests per endpoint (default: 20)')
+        parser.add_argument('--endpoint', action='append', choices=discover_endpoints(), help='Only run these endpoints')
+        parser.add_argument('--warm-cache', action='store_true', help='Keep the stats cache between requests')
+        parser.add_argument('--auth', choices=['jwt', 'force'], default='jwt', help='Authenticate with a real JWT or bypass authentication')
+        parser.add_argument('--output', help='Write the results as JSON to this file')
+        parser.add_argument('--baseline', help='Compare against a previous --output file')
+        parser.add_argument('--threshold', type=float, default=0.2, help='Allowed slowdown against the baseline (default: 0.2)')
+
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(email=options['user'])
+        except User.DoesNotExist:
+            raise CommandError(f"User {options['user']} does not exist")
+
+        if options['iterations'] < 1:
+            raise CommandError('--iterations must be at least 1')
+
+        results = run_benchmarks(
+            user,
+            iterations=options['iterations'],
+            endpoints=options['endpoint'],
+            warm_cache=options['warm_cache'],
+            auth=options['auth'],
+        )
+
+        self.stdout.write(f"{'endpoint':<40} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'queries':>8} {'peak KiB':>9}")
+        for name, result in results['endpoints'].items():
+            latency = result['latency_ms']
+            self.stdout.write(
+                f"{name:<40} {latency['p50']:9.2f} {latency['p90']:9.2f} {latency['p99']:9.2f} "
+                f"{result['queries']:8d} {result['peak_memory_bytes'] / 1024:9.1f}"
+            )
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(results, f, indent=2)
+            self.stdout.write(f"Results written to {options['output']}")
+
+        if options['baseline']:
+            regressions = compare_with_baseline(results, load_results(options['baseline']), options['threshold'])
+            for name, metric, old, new, ratio in regressions:
+                self.stdout.write(self.style.WARNING(f'{name}: {metric} {old:.2f} -> {new:.2f} ({ratio:.2f}x)'))
+
+            if regressions:
+                raise CommandError(f'{len(regressions)} regressions against {options["baseline"]}')
+            self.stdout.write(self.style.SUCCESS(f"No regressions against {options['baseline']}"))
@@ -0,0 +1,54 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+
+from expenses.services.parallel import run_query
+from expenses.services.reports import expire_jobs, get_config, pending_jobs, requeue_stale, run_job
+
+
+class Command(BaseCommand):
+    help = 'Run queued report jobs; use with REPORT_JOBS RUNNER "command", or to drain jobs left by a restart'
+
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, help='Jobs run at the same time (default: REPORT_JOBS WORKERS)')
+        parser.add_argument('--poll', type=float, default=2.0, help='Seconds to wait when the queue is empty (default: 2)')
+        parser.add_argument('--once', action='store_true', help='Exit once the queue is empty')
+
+
+    def handle(self, *args, **options):
+        workers = options['workers'] or get_config()['WORKERS']
+        if workers < 1:
+            raise CommandError('--workers must be at least 1')
+
+        done = failed = 0
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='reports') as executor:
+            while True:
+                requeue_stale()
+                expired = expire_jobs()
+                if expired:
+                    self.stdout.write(f'Expired {expired} reports')
+
+                job_ids = pending_jobs(limit=workers)
+                if not job_ids:
+                    if options['once']:
+                        break
+                    time.sleep(options['poll'])
+                    continue
+
+                if workers == 1:
+                    jobs = map(run_job, job_ids)
+                else:
+                    jobs = executor.map(lambda job_id: run_query(run_job, job_id), job_ids)
+
+                for job in jobs:
+                    if job is None:
+                        continue
+                    self.stdout.write(f'{job.kind} report {job.pk}: {job.status}')
+                    if job.status == job.DONE:
+                        done += 1
+                    else:
+                        failed += 1
+
+        self.stdout.write(self.style.SUCCESS(f'{done} reports done, {failed} failed'))
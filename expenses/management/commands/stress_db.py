@@ -0,0 +1,86 @@
+import json
+import os
+import subprocess
+import sys
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from expenses.services.benchmark import stress
+
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = (
+        'Concurrent writes and reads against the API to measure throughput and "database is locked" errors; '
+        'compare SQLITE_PROFILES with --profile baseline --profile concurrent'
+    )
+
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=8, help='Concurrent clients (default: 8)')
+        parser.add_argument('--duration', type=float, default=10.0, help='Seconds per run (default: 10)')
+        parser.add_argument('--writes', type=float, default=0.5, help='Share of requests that are writes (default: 0.5)')
+        parser.add_argument('--users', type=int, default=4, help='Users the clients are spread over (default: 4)')
+        parser.add_argument(
+            '--profile', action='append', choices=list(getattr(settings, 'SQLITE_PROFILES', {})),
+            help='Database profile to run with, repeat to compare (default: the configured one)'
+        )
+        parser.add_argument('--json', action='store_true', help='Print the results as JSON')
+
+
+    def handle(self, *args, **options):
+        if options['threads'] < 1 or options['users'] < 1:
+            raise CommandError('--threads and --users must be at least 1')
+        if not 0 <= options['writes'] <= 1:
+            raise CommandError('--writes must be between 0 and 1')
+
+        current = getattr(settings, 'DATABASE_PROFILE', None)
+        results = [
+            self.run_here(options) if profile == current else self.run_with_profile(profile, options)
+            for profile in options['profile'] or [current]
+        ]
+
+        if options['json']:
+            self.stdout.write(json.dumps(results))
+            return
+
+        for result in results:
+            meta = result['meta']
+            self.stdout.write(
+                f"{meta['profile']} (journal {meta['journal_mode']}), {meta['threads']} threads for {meta['duration']:g} s:"
+            )
+            for kind in ('write', 'read'):
+                row = result[kind]
+                latency = row['latency_ms']
+                self.stdout.write(
+                    f"  {kind:>5}s: {row['per_second']:8.1f}/s, {row['error_rate']:6.1%} errors ({row['locked']} locked)"
+                    + (f", p50 {latency['p50']:.1f} ms, p95 {latency['p95']:.1f} ms" if latency else '')
+                )
+
+
+    def run_here(self, options):
+        emails = [f'stress-{index}@example.com' for index in range(options['users'])]
+        User.objects.filter(email__in=emails).delete()
+        users = [User.objects.create_user(email=email, username=email.split('@')[0], password='stress') for email in emails]
+        try:
+            return stress(users, options['threads'], options['duration'], options['writes'])
+        finally:
+            User.objects.filter(email__in=emails).delete()
+
+
+    def run_with_profile(self, profile, options):
+        # The profile is read when the settings load, so it runs in a fresh process
+        command = [
+            sys.executable, os.path.join(settings.BASE_DIR, 'manage.py'), 'stress_db', '--json',
+            '--threads', str(options['threads']), '--duration', str(options['duration']),
+            '--writes', str(options['writes']), '--users', str(options['users']),
+        ]
+        env = {**os.environ, 'EXPENSES_DATABASE_PROFILE': profile}
+        process = subprocess.run(command, env=env, capture_output=True, text=True)
+        if process.returncode:
+            raise CommandError(f'The {profile} run failed:\n{process.stderr}')
+        return json.loads(process.stdout.strip().splitlines()[-1])[0]
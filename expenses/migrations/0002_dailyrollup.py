@@ -0,0 +1,54 @@
+# Generated by Django 6.0 on 2026-10-17 05:53
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+def populate_rollups(apps, schema_editor):
+    Transaction = apps.get_model('expenses', 'Transaction')
+    DailyRollup = apps.get_model('expenses', 'DailyRollup')
+
+    db = schema_editor.connection.alias
+    rows = Transaction.objects.using(db).values('owner_id', 'date', 'category_id', 'type').annotate(
+        total=Sum('amount'), transactions=Count('id')
+    ).order_by()
+
+    DailyRollup.objects.using(db).bulk_create(
+        (
+            DailyRollup(
+                owner_id=row['owner_id'], date=row['date'], category_id=row['category_id'],
+                type=row['type'], amount=row['total'], count=row['transactions']
+            )
+            for row in rows.iterator()
+        ),
+        batch_size=1000
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('expenses', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('type', models.CharField(choices=[('income', 'Income'), ('expense', 'Expense')], max_length=10)),
+                ('amount', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('category', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='expenses.category')),
+                ('owner', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(condition=models.Q(('category__isnull', False)), fields=('owner', 'date', 'category', 'type'), name='unique_daily_rollup'), models.UniqueConstraint(condition=models.Q(('category__isnull', True)), fields=('owner', 'date', 'type'), name='unique_daily_rollup_uncategorized')],
+            },
+        ),
+        migrations.RunPython(populate_rollups, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 6.0 on 2026-10-17 06:11
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def create_markers(apps, schema_editor):
+    User = apps.get_model(settings.AUTH_USER_MODEL)
+    ChangeMarker = apps.get_model('expenses', 'ChangeMarker')
+
+    db = schema_editor.connection.alias
+    now = timezone.now()
+    ChangeMarker.objects.using(db).bulk_create(
+        (ChangeMarker(owner_id=pk, modified_at=now) for pk in User.objects.using(db).values_list('pk', flat=True).iterator()),
+        batch_size=1000
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0001_initial'),
+        ('expenses', '0003_transaction_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChangeMarker',
+            fields=[
+                ('owner', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='change_marker', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('version', models.PositiveBigIntegerField(default=0)),
+                ('modified_at', models.DateTimeField()),
+            ],
+        ),
+        migrations.RunPython(create_markers, migrations.RunPython.noop),
+    ]
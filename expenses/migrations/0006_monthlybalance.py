@@ -0,0 +1,53 @@
+# Generated by Django 6.0 on 2026-10-17 06:25
+
+import django.db.models.deletion
+from django.conf import settings
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import migrations, models
+from django.db.models import Sum
+
+
+def populate_balances(apps, schema_editor):
+    Transaction = apps.get_model('expenses', 'Transaction')
+    MonthlyBalance = apps.get_model('expenses', 'MonthlyBalance')
+
+    db = schema_editor.connection.alias
+    nets = defaultdict(Decimal)
+    rows = Transaction.objects.using(db).values('owner_id', 'date', 'type').annotate(total=Sum('amount')).order_by()
+    for row in rows.iterator():
+        nets[row['owner_id'], row['date'].replace(day=1)] += row['total'] if row['type'] == 'income' else -row['total']
+
+    balances = []
+    running = defaultdict(Decimal)
+    for (owner_id, month), net in sorted(nets.items()):
+        running[owner_id] += net
+        balances.append(MonthlyBalance(owner_id=owner_id, month=month, net=net, balance=running[owner_id]))
+
+    MonthlyBalance.objects.using(db).bulk_create(balances, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('expenses', '0005_sync'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MonthlyBalance',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField()),
+                ('net', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('balance', models.DecimalField(decimal_places=2, default=0, max_digits=16)),
+                ('owner', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('owner', 'month'), name='unique_monthly_balance')],
+            },
+        ),
+        migrations.RunPython(populate_balances, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,71 @@
+# Generated by Django 6.0 on 2026-10-17 06:56
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+# An external-content FTS5 table: it stores only the index, the text is read
+# from expenses_transaction. The triggers replay every row change into it.
+CREATE_SEARCH = [
+    """
+    CREATE VIRTUAL TABLE expenses_transaction_fts USING fts5(
+        description, content='expenses_transaction', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+    )
+    """,
+    """
+    CREATE TRIGGER expenses_transaction_fts_insert AFTER INSERT ON expenses_transaction BEGIN
+        INSERT INTO expenses_transaction_fts(rowid, description) VALUES (new.id, new.description);
+    END
+    """,
+    """
+    CREATE TRIGGER expenses_transaction_fts_delete AFTER DELETE ON expenses_transaction BEGIN
+        INSERT INTO expenses_transaction_fts(expenses_transaction_fts, rowid, description) VALUES ('delete', old.id, old.description);
+    END
+    """,
+    """
+    CREATE TRIGGER expenses_transaction_fts_update AFTER UPDATE OF description ON expenses_transaction BEGIN
+        INSERT INTO expenses_transaction_fts(expenses_transaction_fts, rowid, description) VALUES ('delete', old.id, old.description);
+        INSERT INTO expenses_transaction_fts(rowid, description) VALUES (new.id, new.description);
+    END
+    """,
+    "INSERT INTO expenses_transaction_fts(expenses_transaction_fts) VALUES ('rebuild')",
+]
+
+DROP_SEARCH = [
+    'DROP TRIGGER IF EXISTS expenses_transaction_fts_insert',
+    'DROP TRIGGER IF EXISTS expenses_transaction_fts_delete',
+    'DROP TRIGGER IF EXISTS expenses_transaction_fts_update',
+    'DROP TABLE IF EXISTS expenses_transaction_fts',
+]
+
+
+def run_on_sqlite(statements):
+    # Other databases have no FTS5; the q filter falls back to icontains there
+    def run(apps, schema_editor):
+        if schema_editor.connection.vendor == 'sqlite':
+            for statement in statements:
+                schema_editor.execute(statement)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('expenses', '0007_reportjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TransactionSearch',
+            fields=[
+                ('transaction', models.OneToOneField(db_column='rowid', db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='search', serialize=False, to='expenses.transaction')),
+                ('description', models.TextField()),
+                ('rank', models.FloatField()),
+            ],
+            options={
+                'db_table': 'expenses_transaction_fts',
+                'managed': False,
+            },
+        ),
+        migrations.RunPython(run_on_sqlite(CREATE_SEARCH), run_on_sqlite(DROP_SEARCH)),
+    ]
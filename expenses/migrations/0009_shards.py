@@ -0,0 +1,81 @@
+# Generated by Django 6.0 on 2026-10-17 07:07
+
+import importlib
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+search = importlib.import_module('expenses.migrations.0008_transaction_search')
+
+# SQLite rebuilds expenses_transaction to drop the owner constraint, which
+# drops the full-text search triggers with the old table. The index itself
+# is untouched since the rows keep their ids.
+CREATE_SEARCH_TRIGGERS = [statement for statement in search.CREATE_SEARCH if 'CREATE TRIGGER' in statement]
+
+
+def assign_existing_users(apps, schema_editor):
+    # Their rows are already on the database the users live on
+    User = apps.get_model(settings.AUTH_USER_MODEL)
+    ShardAssignment = apps.get_model('expenses', 'ShardAssignment')
+
+    db = schema_editor.connection.alias
+    ShardAssignment.objects.using(db).bulk_create(
+        (ShardAssignment(owner_id=pk, shard=db) for pk in User.objects.using(db).values_list('pk', flat=True).iterator()),
+        batch_size=1000
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0001_initial'),
+        ('expenses', '0008_transaction_search'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ShardAssignment',
+            fields=[
+                ('owner', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='shard_assignment', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('shard', models.CharField(max_length=50)),
+                ('moving', models.BooleanField(default=False)),
+                ('assigned_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.RunPython(assign_existing_users, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='category',
+            name='owner',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='changemarker',
+            name='owner',
+            field=models.OneToOneField(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='change_marker', serialize=False, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='dailyrollup',
+            name='owner',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='monthlybalance',
+            name='owner',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='tombstone',
+            name='owner',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.RunPython(migrations.RunPython.noop, search.run_on_sqlite(CREATE_SEARCH_TRIGGERS)),
+        migrations.AlterField(
+            model_name='transaction',
+            name='owner',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.RunPython(search.run_on_sqlite(CREATE_SEARCH_TRIGGERS), migrations.RunPython.noop),
+    ]
@@ -0,0 +1,66 @@
+# Generated by Django 6.0 on 2026-10-17 07:25
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+def populate_spend(apps, schema_editor):
+    Transaction = apps.get_model('expenses', 'Transaction')
+    CategorySpend = apps.get_model('expenses', 'CategorySpend')
+
+    db = schema_editor.connection.alias
+    totals = {}
+    rows = (
+        Transaction.objects.using(db).filter(type='expense', category__isnull=False)
+        .values('owner_id', 'category_id', 'date').annotate(total=Sum('amount'), transactions=Count('id')).order_by()
+    )
+    for row in rows.iterator():
+        key = (row['owner_id'], row['category_id'], row['date'].replace(day=1))
+        spent, count = totals.get(key, (0, 0))
+        totals[key] = (spent + row['total'], count + row['transactions'])
+
+    CategorySpend.objects.using(db).bulk_create(
+        [
+            CategorySpend(owner_id=owner_id, category_id=category_id, month=month, spent=spent, count=count)
+            for (owner_id, category_id, month), (spent, count) in totals.items()
+        ],
+        batch_size=1000
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('expenses', '0009_shards'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Budget',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('category', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='budget', to='expenses.category')),
+                ('owner', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='CategorySpend',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField()),
+                ('spent', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='expenses.category')),
+                ('owner', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('category', 'month'), name='unique_category_spend')],
+            },
+        ),
+        migrations.RunPython(populate_spend, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,60 @@
+# Generated by Django 6.0 on 2026-10-17 07:40
+
+import math
+from collections import Counter, defaultdict
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+# The bucket layout of expenses/services/sketches.py at 1% relative accuracy
+GAMMA = 1.01 / 0.99
+
+
+def populate_sketches(apps, schema_editor):
+    Transaction = apps.get_model('expenses', 'Transaction')
+    SpendSketch = apps.get_model('expenses', 'SpendSketch')
+
+    db = schema_editor.connection.alias
+    sketches = defaultdict(Counter)
+    rows = Transaction.objects.using(db).filter(type='expense').values('owner_id', 'category_id', 'date', 'amount').order_by()
+    for row in rows.iterator(chunk_size=5000):
+        amount = float(row['amount'])
+        key = 'zero' if amount <= 0 else str(math.ceil(math.log(amount) / math.log(GAMMA)))
+        sketches[row['owner_id'], row['category_id'], row['date'].replace(day=1)][key] += 1
+
+    SpendSketch.objects.using(db).bulk_create(
+        [
+            SpendSketch(owner_id=owner_id, category_id=category_id, month=month, bins=dict(bins), count=sum(bins.values()))
+            for (owner_id, category_id, month), bins in sketches.items()
+        ],
+        batch_size=1000
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('expenses', '0010_budgets'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SpendSketch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField()),
+                ('bins', models.JSONField(default=dict)),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('category', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='expenses.category')),
+                ('owner', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['owner', 'month'], name='sketch_owner_month_idx')],
+                'constraints': [models.UniqueConstraint(condition=models.Q(('category__isnull', False)), fields=('owner', 'category', 'month'), name='unique_spend_sketch'), models.UniqueConstraint(condition=models.Q(('category__isnull', True)), fields=('owner', 'month'), name='unique_spend_sketch_uncategorized')],
+            },
+        ),
+        migrations.RunPython(populate_sketches, migrations.RunPython.noop),
+    ]
@@ -1,20 +1,45 @@
-from django.db import models
+from django.db import models, router, transaction
 from django.contrib.auth import get_user_model
 
 
 User = get_user_model()
 
 
-class Category(models.Model):
+class SyncedModel(models.Model):
+    # Saved in one transaction with the change_seq stamped by pre_save and
+    # the derived rows written by post_save (signals.py): the owner's marker
+    # stays locked until the row commits, so no reader sees a version whose
+    # rows are still missing
+    class Meta:
+        abstract = True
+
+
+    def save(self, *args, using=None, **kwargs):
+        using = using or router.db_for_write(type(self), instance=self)
+        with transaction.atomic(using=using):
+            super().save(*args, using=using, **kwargs)
+
+
+class Category(SyncedModel):
     name = models.CharField(max_length=50)
-    owner = models.ForeignKey(User, on_delete=models.CASCADE)
+    # The users stay on the default database while the owner's rows may live
+    # on another shard (routers.py), so owner keys have no database constraint
+    owner = models.ForeignKey(User, on_delete=models.CASCADE, db_constraint=False)
+    # Owner's ChangeMarker.version at the last write, the delta sync position
+    change_seq = models.PositiveBigIntegerField(default=0)
+
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['owner', 'change_seq'], name='category_owner_seq_idx'),
+        ]
 
 
     def __str__(self):
         return self.name
 
 
-class Transaction(models.Model):
+class Transaction(SyncedModel):
     INCOME = 'income'
     EXPENSE = 'expense'
 
@@ -28,9 +53,270 @@ class Transaction(models.Model):
     category = models.ForeignKey(Category, on_delete=models.SET_NULL, null=True, blank=True)
     date = models.DateField()
     description = models.TextField(blank=True)
-    owner = models.ForeignKey(User, on_delete=models.CASCADE)
+    owner = models.ForeignKey(User, on_delete=models.CASCADE, db_constraint=False)
     create_at = models.DateTimeField(auto_now_add=True)
+    change_seq = models.PositiveBigIntegerField(default=0)
+
+
+    class Meta:
+        # Every hot query filters by owner first, then by date, type or
+        # category, and the list is ordered by -date
+        indexes = [
+            models.Index(fields=['owner', 'date'], name='transaction_owner_date_idx'),
+            models.Index(fields=['owner', 'type', 'date'], name='transaction_owner_type_idx'),
+            models.Index(fields=['owner', 'category', 'date'], name='transaction_owner_cat_idx'),
+            models.Index(fields=['owner', 'change_seq'], name='transaction_owner_seq_idx'),
+        ]
+
+
+    def __str__(self):
+        return f"{self.type} - {self.amount}"
+
+
+class Match(models.Lookup):
+    # SQLite FTS5 full-text match, e.g. search__description__match='"coffee"*'
+    lookup_name = 'match'
+
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return f'{lhs} MATCH {rhs}', [*lhs_params, *rhs_params]
+
+
+class TransactionSearch(models.Model):
+    # The FTS5 index over Transaction.description (migration 0008, SQLite
+    # only). Database triggers keep it in sync with every insert, update and
+    # delete, bulk ones included; rank is FTS5's bm25 score for the current
+    # MATCH, lower is more relevant.
+    transaction = models.OneToOneField(
+        Transaction, on_delete=models.DO_NOTHING, primary_key=True, db_column='rowid', db_constraint=False,
+        related_name='search'
+    )
+    description = models.TextField()
+    rank = models.FloatField()
+
+
+    class Meta:
+        managed = False
+        db_table = 'expenses_transaction_fts'
+
+
+TransactionSearch._meta.get_field('description').register_lookup(Match)
+
+
+class DailyRollup(models.Model):
+    owner = models.ForeignKey(User, on_delete=models.CASCADE, db_constraint=False)
+    date = models.DateField()
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, null=True, blank=True)
+    type = models.CharField(max_length=10, choices=Transaction.TYPE_CHOICES)
+    amount = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    count = models.PositiveIntegerField(default=0)
+
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['owner', 'date'], name='rollup_owner_date_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['owner', 'date', 'category', 'type'],
+                condition=models.Q(category__isnull=False),
+                name='unique_daily_rollup'
+            ),
+            models.UniqueConstraint(
+                fields=['owner', 'date', 'type'],
+                condition=models.Q(category__isnull=True),
+                name='unique_daily_rollup_uncategorized'
+            ),
+        ]
+
+
+    def __str__(self):
+        return f"{self.date} {self.type} - {self.amount} ({self.count})"
+
+
+class ChangeMarker(models.Model):
+    # Bumped on every write to the owner's transactions or categories; the
+    # conditional GET validators are derived from it without touching the data
+    owner = models.OneToOneField(
+        User, on_delete=models.CASCADE, primary_key=True, related_name='change_marker', db_constraint=False
+    )
+    version = models.PositiveBigIntegerField(default=0)
+    modified_at = models.DateTimeField()
+    # Tombstones up to this version were pruned; older sync cursors must resync
+    pruned_seq = models.PositiveBigIntegerField(default=0)
+
+
+    def __str__(self):
+        return f"{self.owner_id} v{self.version} at {self.modified_at}"
+
+
+class Tombstone(models.Model):
+    # Left behind by deleted transactions and categories for the delta sync
+    CATEGORY = 'category'
+    TRANSACTION = 'transaction'
+
+    MODEL_CHOICES = [
+        (CATEGORY, 'Category'),
+        (TRANSACTION, 'Transaction'),
+    ]
+
+    owner = models.ForeignKey(User, on_delete=models.CASCADE, db_constraint=False)
+    model = models.CharField(max_length=20, choices=MODEL_CHOICES)
+    object_id = models.BigIntegerField()
+    change_seq = models.PositiveBigIntegerField()
+    deleted_at = models.DateTimeField(auto_now_add=True)
+
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['owner', 'change_seq'], name='tombstone_owner_seq_idx'),
+        ]
+
+
+    def __str__(self):
+        return f"{self.model} {self.object_id} deleted at {self.change_seq}"
+
+
+class MonthlyBalance(models.Model):
+    # Month-end checkpoint of the running balance: net is the month's income
+    # minus expense, balance the cumulative net up to and including the month.
+    # Only months with transactions have a row.
+    owner = models.ForeignKey(User, on_delete=models.CASCADE, db_constraint=False)
+    month = models.DateField()
+    net = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    balance = models.DecimalField(max_digits=16, decimal_places=2, default=0)
+
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['owner', 'month'], name='unique_monthly_balance'),
+        ]
+
+
+    def __str__(self):
+        return f"{self.month:%Y-%m} {self.balance}"
+
+
+class Budget(models.Model):
+    # Monthly spending limit for a category, checked against CategorySpend
+    owner = models.ForeignKey(User, on_delete=models.CASCADE, db_constraint=False)
+    category = models.OneToOneField(Category, on_delete=models.CASCADE, related_name='budget')
+    amount = models.DecimalField(max_digits=12, decimal_places=2)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+
+    def __str__(self):
+        return f"{self.category_id} {self.amount}/month"
+
+
+class CategorySpend(models.Model):
+    # Running total of the expenses in a category and month, kept up to date
+    # with every transaction write so budget checks read one row
+    owner = models.ForeignKey(User, on_delete=models.CASCADE, db_constraint=False)
+    category = models.ForeignKey(Category, on_delete=models.CASCADE)
+    month = models.DateField()
+    spent = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    count = models.PositiveIntegerField(default=0)
+
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['category', 'month'], name='unique_category_spend'),
+        ]
+
+
+    def __str__(self):
+        return f"{self.category_id} {self.month:%Y-%m} {self.spent}"
+
+
+class SpendSketch(models.Model):
+    # Log-bucketed histogram of the expense amounts in a category and month
+    # (expenses/services/sketches.py). bins maps a bucket index, or "zero"
+    # for amounts of 0, to how many expenses fell into it.
+    owner = models.ForeignKey(User, on_delete=models.CASCADE, db_constraint=False)
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, null=True, blank=True)
+    month = models.DateField()
+    bins = models.JSONField(default=dict)
+    count = models.PositiveIntegerField(default=0)
+
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['owner', 'month'], name='sketch_owner_month_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['owner', 'category', 'month'], condition=models.Q(category__isnull=False), name='unique_spend_sketch'
+            ),
+            models.UniqueConstraint(
+                fields=['owner', 'month'], condition=models.Q(category__isnull=True), name='unique_spend_sketch_uncategorized'
+            ),
+        ]
+
+
+    def __str__(self):
+        return f"{self.category_id} {self.month:%Y-%m} ({self.count})"
+
+
+class ReportJob(models.Model):
+    # A stats payload computed outside the request cycle by the report
+    # worker (expenses/services/reports.py) and kept until expires_at
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    ]
+
+    owner = models.ForeignKey(User, on_delete=models.CASCADE)
+    kind = models.CharField(max_length=30)
+    params = models.JSONField(default=dict)
+    # Digest of kind and params; identical pending jobs are not queued twice
+    key = models.CharField(max_length=40)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    # Owner's ChangeMarker.version the result was computed at
+    version = models.PositiveBigIntegerField(null=True, blank=True)
+    # The rendered JSON payload
+    result = models.BinaryField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    expires_at = models.DateTimeField(null=True, blank=True)
+
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['owner', 'key'], condition=models.Q(status__in=['pending', 'running']), name='unique_active_report_job'
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['owner', 'key'], name='reportjob_owner_key_idx'),
+            models.Index(fields=['status', 'created_at'], name='reportjob_status_idx'),
+        ]
+
+
+    def __str__(self):
+        return f"{self.kind} {self.status} ({self.owner_id})"
+
+
+class ShardAssignment(models.Model):
+    # Which of settings.EXPENSES_SHARDS holds the owner's expenses rows
+    # (expenses/routers.py). Kept on the default database with the users.
+    owner = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='shard_assignment')
+    shard = models.CharField(max_length=50)
+    # Set while rebalance_shards copies the owner's rows; writes are refused
+    moving = models.BooleanField(default=False)
+    assigned_at = models.DateTimeField(auto_now=True)
 
 
     def __str__(self):
-        return f"{self.type} - {self.amount}"
\ No newline at end of file
+        return f"{self.owner_id} on {self.shard}"
@@ -0,0 +1,52 @@
+import random
+import time
+
+from django.conf import settings
+from django.db import OperationalError, transaction
+
+
+
+DATABASE_LOCK_RETRY_DEFAULTS = {
+    'ATTEMPTS': 4,
+    'BASE_DELAY': 0.05,
+    'MAX_DELAY': 1.0,
+}
+
+
+def get_config():
+    return {**DATABASE_LOCK_RETRY_DEFAULTS, **getattr(settings, 'DATABASE_LOCK_RETRY', {})}
+
+
+def is_locked(exc):
+    # SQLite gave up waiting for another connection's write lock
+    return isinstance(exc, OperationalError) and 'locked' in str(exc)
+
+
+def backoff(attempt, config):
+    # Full jitter, so writers that collided do not collide again in step
+    return random.uniform(0, min(config['MAX_DELAY'], config['BASE_DELAY'] * 2 ** attempt))
+
+
+def run_with_retry(func, *args, using=None, **kwargs):
+    # Runs func in one transaction on the using database, and again when it
+    # fails with "database is locked". Being one transaction, a failed attempt
+    # leaves nothing behind to repeat.
+    if transaction.get_connection(using).in_atomic_block:
+        # Part of a caller's transaction, which still holds the locks taken
+        # so far: sleeping would only keep them longer, so it is up to the
+        # caller to run the whole transaction again
+        with transaction.atomic(using=using):
+            return func(*args, **kwargs)
+
+    config = get_config()
+    for attempt in range(config['ATTEMPTS']):
+        try:
+            with transaction.atomic(using=using):
+                return func(*args, **kwargs)
+        except OperationalError as exc:
+            if not is_locked(exc):
+                raise
+            if attempt == config['ATTEMPTS'] - 1:
+                raise
+
+        time.sleep(backoff(attempt, config))
@@ -0,0 +1,176 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models import F
+
+
+
+# Each user's expenses rows live on one of settings.EXPENSES_SHARDS, recorded
+# in ShardAssignment on the default database with the users themselves.
+# Queries run against the shard selected for the current request or job:
+# the viewsets select the user's shard in initial(), background code wraps
+# its work in use_shard().
+
+# Models that stay on the default database with the users
+GLOBAL_MODELS = {'reportjob', 'shardassignment'}
+
+# (owner_id, alias) selected for the current request or job; owner_id is None
+# when everything goes to alias, e.g. maintenance over a whole shard
+_current_shard = ContextVar('expenses_shard', default=None)
+
+
+class ShardNotSelected(Exception):
+    pass
+
+
+class OwnerMoving(Exception):
+    pass
+
+
+def get_shards():
+    return list(getattr(settings, 'EXPENSES_SHARDS', [DEFAULT_DB_ALIAS]))
+
+
+def is_sharded(model):
+    return model._meta.app_label == 'expenses' and model._meta.model_name not in GLOBAL_MODELS
+
+
+def get_assignment(owner_id, create=True):
+    # (shard, moving) for the owner. New owners are placed by id and keep their
+    # shard until rebalance_shards moves them; with create=False an owner
+    # that was never placed gives (None, False).
+    shards = get_shards()
+    if len(shards) == 1:
+        return shards[0], False
+
+    from expenses.models import ShardAssignment
+
+    assignment = ShardAssignment.objects.filter(owner_id=owner_id).values_list('shard', 'moving').first()
+    if assignment is None and create:
+        assignment = ShardAssignment.objects.get_or_create(
+            owner_id=owner_id, defaults={'shard': shards[owner_id % len(shards)]}
+        )[0]
+        assignment = (assignment.shard, assignment.moving)
+    return assignment or (None, False)
+
+
+def check_owner_shard(owner_id, alias):
+    # Raises OwnerMoving unless the owner lives on alias and is not being
+    # moved. Writers call it while holding the write lock on their marker
+    # row on alias (lock_owner_shard(), changes.touch()); move_owner() takes
+    # the same lock to switch the owner away, so a write either commits
+    # before the switch or finds the owner gone.
+    if len(get_shards()) == 1:
+        return
+
+    shard, moving = get_assignment(owner_id)
+    if moving or shard != alias:
+        raise OwnerMoving(f'Owner {owner_id} is being moved off {alias}')
+
+
+def lock_owner_shard(owner_id, alias):
+    # Takes the owner's write lock on alias for the rest of the transaction
+    if len(get_shards()) == 1:
+        return
+
+    from expenses.models import ChangeMarker
+
+    ChangeMarker.objects.using(alias).filter(owner_id=owner_id).update(version=F('version'))
+    check_owner_shard(owner_id, alias)
+
+
+def shard_for(owner_id):
+    return get_assignment(owner_id)[0]
+
+
+def shards_of(owner_id=None):
+    # The shard holding the owner's rows, or every shard
+    return [shard_for(owner_id)] if owner_id is not None else get_shards()
+
+
+def activate_shard(owner_id, alias=None):
+    _current_shard.set((owner_id, alias or shard_for(owner_id)))
+
+
+def deactivate_shard():
+    _current_shard.set(None)
+
+
+def current_shard():
+    return _current_shard.get()
+
+
+@contextmanager
+def use_shard(owner_id=None, alias=None):
+    # Routes the expenses queries inside the block to the owner's shard, or
+    # to alias for all owners when no owner is given
+    token = _current_shard.set((owner_id, alias or shard_for(owner_id)))
+    try:
+        yield _current_shard.get()[1]
+    finally:
+        _current_shard.reset(token)
+
+
+def in_shard(iterable, owner_id, alias):
+    # Iterates inside use_shard(), for streaming responses consumed after the
+    # view has returned
+    iterator = iter(iterable)
+    while True:
+        with use_shard(owner_id, alias):
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+        yield item
+
+
+def hint_owner(instance):
+    if instance is None:
+        return None
+    if isinstance(instance, get_user_model()):
+        return instance.pk
+    return getattr(instance, 'owner_id', None)
+
+
+class ShardRouter:
+    def db_for_read(self, model, **hints):
+        return self.db_for_model(model, **hints)
+
+
+    def db_for_write(self, model, **hints):
+        return self.db_for_model(model, **hints)
+
+
+    def db_for_model(self, model, instance=None, **hints):
+        if not is_sharded(model):
+            return DEFAULT_DB_ALIAS
+
+        shards = get_shards()
+        if len(shards) == 1:
+            return shards[0]
+
+        # Rows read from a shard, and their related rows, stay on it
+        if instance is not None and is_sharded(type(instance)) and instance._state.db:
+            return instance._state.db
+
+        owner_id = hint_owner(instance)
+        current = _current_shard.get()
+        if current is not None and (owner_id is None or current[0] in (None, owner_id)):
+            return current[1]
+        if owner_id is not None:
+            return shard_for(owner_id)
+
+        raise ShardNotSelected(f'No shard selected for {model._meta.label}; wrap the query in use_shard()')
+
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Owner foreign keys cross from the shards to the user table
+        return True
+
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Every database gets every table, so any of them can be a shard
+        return None
@@ -1,5 +1,6 @@
 from rest_framework import serializers
-from .models import Category, Transaction
+from .models import Budget, Category, ReportJob, Transaction
+from .services.budgets import transaction_budget
 
 
 class CategorySerializer(serializers.ModelSerializer):
@@ -14,4 +15,83 @@ class TransactionSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Transaction
-        fields = '__all__'
\ No newline at end of file
+        fields = '__all__'
+
+class TransactionImportSerializer(TransactionSerializer):
+    # Same field rules as TransactionSerializer, with the category given by name
+    category = serializers.CharField(max_length=50, required=False, allow_blank=True)
+
+
+    class Meta:
+        model = Transaction
+        fields = ['amount', 'type', 'category', 'date', 'description']
+
+
+class SyncTransactionSerializer(TransactionSerializer):
+    # Offline clients join on the category id, the name alone is ambiguous
+    category_id = serializers.IntegerField(read_only=True, allow_null=True)
+
+
+class BudgetSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Budget
+        fields = ['id', 'category', 'amount', 'created_at']
+
+
+    def validate_category(self, category):
+        if category.owner_id != self.context['request'].user.pk:
+            raise serializers.ValidationError('Invalid pk "%s" - object does not exist.' % category.pk)
+        return category
+
+
+    def validate_amount(self, amount):
+        if amount <= 0:
+            raise serializers.ValidationError('The budget must be positive.')
+        return amount
+
+
+class BudgetStatusSerializer(BudgetSerializer):
+    # A budget with the spend counter of one month (services/budgets.with_spend)
+    month = serializers.DateField(read_only=True)
+    spent = serializers.DecimalField(max_digits=14, decimal_places=2, read_only=True)
+    transactions = serializers.IntegerField(read_only=True)
+    remaining = serializers.SerializerMethodField()
+    over_budget = serializers.SerializerMethodField()
+
+
+    class Meta(BudgetSerializer.Meta):
+        fields = BudgetSerializer.Meta.fields + ['month', 'spent', 'transactions', 'remaining', 'over_budget']
+
+
+    def get_remaining(self, budget):
+        return serializers.DecimalField(max_digits=14, decimal_places=2).to_representation(budget.amount - budget.spent)
+
+
+    def get_over_budget(self, budget):
+        return budget.spent > budget.amount
+
+
+class TransactionWriteSerializer(TransactionSerializer):
+    # Writes may set the category by id, and their responses carry the
+    # category's budget for the month of the transaction, read from the
+    # spend counter inside the write's transaction
+    category_id = serializers.IntegerField(required=False, allow_null=True)
+    budget = serializers.SerializerMethodField()
+
+
+    def validate_category_id(self, category_id):
+        owner = self.context['request'].user
+        if category_id is not None and not Category.objects.filter(pk=category_id, owner=owner).exists():
+            raise serializers.ValidationError('Invalid pk "%s" - object does not exist.' % category_id)
+        return category_id
+
+
+    def get_budget(self, obj):
+        budget = transaction_budget(obj)
+        return BudgetStatusSerializer(budget).data if budget is not None else None
+
+
+class ReportJobSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = ReportJob
+        fields = ['id', 'kind', 'params', 'status', 'version', 'error', 'created_at', 'started_at', 'finished_at', 'expires_at']
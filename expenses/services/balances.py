@@ -0,0 +1,223 @@
+import datetime
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import IntegrityError, router, transaction
+from django.db.models import F, Max, Min, Sum
+from expenses.models import DailyRollup, MonthlyBalance, Transaction
+from expenses.services.stats import PERIOD_CONFIG, PERIOD_KEYS, RESOLUTIONS, lttb
+
+
+
+# Resolutions the series can be served at. day and week fold the daily
+# rollups of the requested range; month and year only read checkpoints.
+BALANCE_PERIODS = ('day', 'week', 'month', 'year')
+
+# Weeks are keyed by ISO year here: a dense series cannot merge the last days
+# of December into week 1 of the same calendar year like the stats do
+BALANCE_KEYS = {**PERIOD_KEYS, 'week': lambda d: tuple(d.isocalendar()[:2])}
+
+
+def month_start(date):
+    return date.replace(day=1)
+
+
+def next_month(date):
+    return (date.replace(day=28) + datetime.timedelta(days=4)).replace(day=1)
+
+
+def signed_amount(type, amount):
+    return amount if type == Transaction.INCOME else -amount
+
+
+def balance_deltas(rollup_deltas):
+    # Rollup deltas ({(owner_id, date, category_id, type): [amount, count]})
+    # to net changes per (owner_id, month)
+    deltas = defaultdict(Decimal)
+    for (owner_id, date, category_id, type), (amount, count) in rollup_deltas.items():
+        deltas[owner_id, month_start(date)] += signed_amount(type, amount)
+    return deltas
+
+
+def apply_balance_delta(owner_id, month, net):
+    # The month's own checkpoint and every later one move by net, one UPDATE
+    # over at most the owner's months after it
+    with transaction.atomic(using=router.db_for_write(MonthlyBalance)):
+        MonthlyBalance.objects.filter(owner_id=owner_id, month__gt=month).update(balance=F('balance') + net)
+        updated = MonthlyBalance.objects.filter(owner_id=owner_id, month=month).update(
+            net=F('net') + net, balance=F('balance') + net
+        )
+        if updated:
+            return
+
+        previous = MonthlyBalance.objects.filter(owner_id=owner_id, month__lt=month).order_by('-month').values_list('balance', flat=True).first()
+        try:
+            with transaction.atomic(using=router.db_for_write(MonthlyBalance)):
+                MonthlyBalance.objects.create(owner_id=owner_id, month=month, net=net, balance=(previous or 0) + net)
+        except IntegrityError:
+            # Another writer created the row in the meantime
+            MonthlyBalance.objects.filter(owner_id=owner_id, month=month).update(
+                net=F('net') + net, balance=F('balance') + net
+            )
+
+
+def apply_balance_deltas(rollup_deltas):
+    for (owner_id, month), net in balance_deltas(rollup_deltas).items():
+        if net:
+            apply_balance_delta(owner_id, month, net)
+
+
+def compute_balances(owner=None):
+    # {(owner_id, month): (net, balance)} from the transactions
+    qs = Transaction.objects.all()
+    if owner is not None:
+        qs = qs.filter(owner=owner)
+
+    nets = defaultdict(Decimal)
+    for row in qs.order_by().values('owner_id', 'date', 'type').annotate(total=Sum('amount')).iterator():
+        nets[row['owner_id'], month_start(row['date'])] += signed_amount(row['type'], row['total'])
+
+    result = {}
+    running = defaultdict(Decimal)
+    for (owner_id, month), net in sorted(nets.items()):
+        running[owner_id] += net
+        result[owner_id, month] = (net, running[owner_id])
+    return result
+
+
+def rebuild_balances(owner=None):
+    expected = compute_balances(owner)
+    balances = MonthlyBalance.objects.all()
+    if owner is not None:
+        balances = balances.filter(owner=owner)
+
+    with transaction.atomic(using=router.db_for_write(MonthlyBalance)):
+        balances.delete()
+        MonthlyBalance.objects.bulk_create(
+            [
+                MonthlyBalance(owner_id=owner_id, month=month, net=net, balance=balance)
+                for (owner_id, month), (net, balance) in expected.items()
+            ],
+            batch_size=1000
+        )
+
+    return len(expected)
+
+
+def verify_balances(owner=None):
+    expected = compute_balances(owner)
+    balances = MonthlyBalance.objects.all()
+    if owner is not None:
+        balances = balances.filter(owner=owner)
+
+    # Months whose transactions were all deleted keep a row with net 0
+    actual = {
+        (row['owner_id'], row['month']): (row['net'], row['balance'])
+        for row in balances.values('owner_id', 'month', 'net', 'balance').iterator()
+    }
+
+    mismatches = []
+    carried = {}
+    for key in sorted(expected.keys() | actual.keys()):
+        owner_id, month = key
+        if key in expected:
+            carried[owner_id] = expected[key][1]
+        wanted = expected.get(key, (Decimal(0), carried.get(owner_id, Decimal(0))))
+        if actual.get(key) != wanted:
+            mismatches.append((key, wanted, actual.get(key)))
+    return mismatches
+
+
+def daily_nets(owner, start, end):
+    # {date: net} for days with rollups in [start, end]
+    rows = DailyRollup.objects.filter(owner=owner, date__gte=start, date__lte=end).order_by().values('date', 'type').annotate(
+        total=Sum('amount')
+    )
+
+    nets = defaultdict(Decimal)
+    for row in rows:
+        nets[row['date']] += signed_amount(row['type'], row['total'])
+    return nets
+
+
+def checkpoint_before(owner, month):
+    # Closing balance of the month before month
+    balance = MonthlyBalance.objects.filter(owner=owner, month__lt=month).order_by('-month').values_list('balance', flat=True).first()
+    return balance or Decimal(0)
+
+
+def balance_before(owner, date):
+    # Closing balance of the previous day: the last checkpoint before date's
+    # month plus the daily rollups of the month so far, at most 31 days
+    if date == datetime.date.min:
+        return Decimal(0)
+    partial = daily_nets(owner, month_start(date), date - datetime.timedelta(days=1)).values()
+    return checkpoint_before(owner, month_start(date)) + sum(partial, Decimal(0))
+
+
+def balance_on(owner, date):
+    # Closing balance of date, without stepping past date.max
+    partial = daily_nets(owner, month_start(date), date).values()
+    return checkpoint_before(owner, month_start(date)) + sum(partial, Decimal(0))
+
+
+def activity_range(owner):
+    bounds = DailyRollup.objects.filter(owner=owner).aggregate(first=Min('date'), last=Max('date'))
+    return bounds['first'], bounds['last']
+
+
+def balance_series(owner, start, end, period='day'):
+    # Closing balance of every day/week/month/year bucket in [start, end],
+    # dense, each point dated at its last day inside the range
+    key_func = BALANCE_KEYS[period]
+    points = {}
+
+    if period in ('day', 'week'):
+        balance = balance_before(owner, start)
+        nets = daily_nets(owner, start, end)
+        for offset in range((end - start).days + 1):
+            day = start + datetime.timedelta(days=offset)
+            balance += nets.get(day, 0)
+            points[key_func(day)] = (day, balance)
+    else:
+        # Whole months come from the checkpoints, carried over months without
+        # a row; only the month end falls into is summed from the rollups
+        checkpoints = dict(
+            MonthlyBalance.objects.filter(
+                owner=owner, month__gte=month_start(start), month__lt=month_start(end)
+            ).values_list('month', 'balance')
+        )
+        balance = checkpoint_before(owner, month_start(start))
+        month = month_start(start)
+        while month < month_start(end):
+            balance = checkpoints.get(month, balance)
+            points[key_func(month)] = (next_month(month) - datetime.timedelta(days=1), balance)
+            month = next_month(month)
+
+        points[key_func(end)] = (end, balance_on(owner, end))
+
+    names = list(PERIOD_CONFIG[period]['fields'])
+    return [{**dict(zip(names, key)), 'date': date, 'balance': balance} for key, (date, balance) in points.items()]
+
+
+def bucket_count(start, end, period):
+    # Number of points balance_series(start, end, period) returns
+    if period == 'day':
+        return (end - start).days + 1
+    if period == 'week':
+        return ((end - start).days + start.weekday()) // 7 + 1
+    if period == 'month':
+        return (end.year - start.year) * 12 + end.month - start.month + 1
+    return end.year - start.year + 1
+
+
+def limited_balance_series(owner, start, end, period, max_points):
+    # Coarsens the resolution until the series fits in max_points, so the
+    # work stays bounded too; a range with more years than that is thinned
+    # with LTTB. Returns (resolution used, points).
+    for resolution in RESOLUTIONS[RESOLUTIONS.index(period):]:
+        if bucket_count(start, end, resolution) <= max_points:
+            return resolution, balance_series(owner, start, end, resolution)
+
+    points = balance_series(owner, start, end, 'year')
+    return 'year', lttb(points, max_points, x=lambda point: point['date'].toordinal(), y=lambda point: float(point['balance']))
@@ -0,0 +1,331 @@
+import asyncio
+import datetime
+import json
+import logging
+import math
+import random
+import statistics
+import sys
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain
+
+from django.conf import settings
+from django.core.signals import got_request_exception
+from django.db import connection, connections
+from django.test import AsyncClient
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from expenses.cache import stats_cache
+from expenses.models import Transaction
+from expenses.retry import is_locked
+from expenses.urls import router
+
+
+
+# Query parameters for endpoints that need them; every period is exercised
+ENDPOINT_PARAMS = {
+    'stats-time': [{'period': period} for period in ('day', 'week', 'month', 'year')],
+    'stats-extreme-day': [{'period': period} for period in ('day', 'week', 'month', 'year')],
+}
+
+# Sync actions and their async twins from expenses/async_views.py
+ASYNC_ENDPOINTS = {
+    'transaction-stats': 'async-transaction-stats',
+    'stats-categories': 'async-stats-categories',
+}
+
+
+def discover_endpoints():
+    # Every list route and collection-level GET action registered in expenses/urls.py
+    endpoints = []
+    for prefix, viewset, basename in router.registry:
+        if hasattr(viewset, 'list'):
+            endpoints.append(f'{basename}-list')
+
+        for extra_action in viewset.get_extra_actions():
+            if not extra_action.detail and 'get' in extra_action.mapping:
+                endpoints.append(f'{basename}-{extra_action.url_name}')
+
+    return endpoints
+
+
+def benchmark_host():
+    # A host name the requests will pass ALLOWED_HOSTS validation with;
+    # localhost is accepted when DEBUG is on and ALLOWED_HOSTS is empty
+    for host in settings.ALLOWED_HOSTS:
+        if host != '*' and not host.startswith('.'):
+            return host
+    return 'localhost'
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    index = max(0, math.ceil(fraction * len(ordered)) - 1)
+    return ordered[index]
+
+
+def consume(response):
+    if response.streaming:
+        return sum(len(chunk) for chunk in response.streaming_content)
+    return len(response.content)
+
+
+def measure(client, url, params, iterations, warm_cache):
+    latencies, query_counts = [], []
+    size = 0
+
+    for iteration in range(iterations + 1):
+        if not warm_cache:
+            stats_cache.cache.clear()
+
+        trace_memory = iteration == 0
+        if trace_memory:
+            tracemalloc.start()
+
+        with CaptureQueriesContext(connection) as queries:
+            start = time.perf_counter()
+            response = client.get(url, params)
+            size = consume(response)
+            elapsed = (time.perf_counter() - start) * 1000
+
+        if trace_memory:
+            # The first run only measures peak memory; tracing slows it down
+            peak_memory = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            continue
+
+        if response.status_code != 200:
+            raise RuntimeError(f'GET {url} {params} returned {response.status_code}')
+
+        latencies.append(elapsed)
+        query_counts.append(len(queries))
+
+    return {
+        'url': url,
+        'params': params,
+        'iterations': iterations,
+        'latency_ms': {
+            'mean': statistics.fmean(latencies),
+            'p50': percentile(latencies, 0.5),
+            'p90': percentile(latencies, 0.9),
+            'p99': percentile(latencies, 0.99),
+            'max': max(latencies),
+        },
+        'queries': max(query_counts),
+        'peak_memory_bytes': peak_memory,
+        'response_bytes': size,
+    }
+
+
+def run_benchmarks(user, iterations=20, endpoints=None, warm_cache=False, auth='jwt'):
+    client = APIClient(HTTP_HOST=benchmark_host())
+    if auth == 'jwt':
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(user)}')
+    else:
+        client.force_authenticate(user)
+
+    results = {}
+    for name in endpoints or discover_endpoints():
+        url = reverse(name)
+        for params in ENDPOINT_PARAMS.get(name, [{}]):
+            key = name + ''.join(f'[{k}={v}]' for k, v in sorted(params.items()))
+            results[key] = measure(client, url, params, iterations, warm_cache)
+
+    return {
+        'meta': {
+            'user': user.email,
+            'transactions': user.transaction_set.count(),
+            'iterations': iterations,
+            'warm_cache': warm_cache,
+            'auth': auth,
+            'database': connection.vendor,
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        },
+        'endpoints': results,
+    }
+
+
+def compare_with_baseline(results, baseline, threshold=0.2):
+    # Returns (endpoint, metric, baseline value, current value, ratio) for every
+    # p50 latency or query count that got worse by more than threshold
+    regressions = []
+    for name, current in results['endpoints'].items():
+        previous = baseline.get('endpoints', {}).get(name)
+        if previous is None:
+            continue
+
+        for metric, old, new in (
+            ('p50', previous['latency_ms']['p50'], current['latency_ms']['p50']),
+            ('queries', previous['queries'], current['queries']),
+        ):
+            ratio = new / old if old else (math.inf if new else 1.0)
+            if ratio > 1 + threshold:
+                regressions.append((name, metric, old, new, ratio))
+
+    return regressions
+
+
+def load_results(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+async def fire(client, url, params, headers, concurrency):
+    # concurrency simultaneous requests; returns the wall time and each
+    # request's (latency, response)
+    async def one():
+        start = time.perf_counter()
+        response = await client.get(url, params, headers=headers)
+        return (time.perf_counter() - start) * 1000, response
+
+    start = time.perf_counter()
+    results = await asyncio.gather(*(one() for _ in range(concurrency)))
+    return (time.perf_counter() - start) * 1000, results
+
+
+def compare_async(user, concurrency=8, rounds=5, params=None, endpoints=None):
+    # Drives each sync stats action and its async twin through the ASGI
+    # handler with the same concurrent load. Under ASGI the sync views share
+    # one thread, so this measures what the async path buys a real server.
+    # The stats cache is bypassed so every request aggregates.
+    # Client-level defaults are not turned into ASGI headers, so they go with
+    # each request; the async client always sends Host: testserver
+    client = AsyncClient()
+    headers = {'authorization': f'Bearer {AccessToken.for_user(user)}'}
+    params = params or {}
+    results = {}
+
+    overrides = {
+        'STATS_CACHE': {**stats_cache.config, 'MAX_ENTRY_SIZE': 0},
+        'ALLOWED_HOSTS': [*settings.ALLOWED_HOSTS, 'testserver'],
+    }
+    with override_settings(**overrides):
+        for sync_name in endpoints or list(ASYNC_ENDPOINTS):
+            bodies = {}
+            for name in (sync_name, ASYNC_ENDPOINTS[sync_name]):
+                walls, latencies = [], []
+                for _ in range(rounds):
+                    wall, responses = asyncio.run(fire(client, reverse(name), params, headers, concurrency))
+                    for latency, response in responses:
+                        if response.status_code != 200:
+                            raise RuntimeError(f'GET {reverse(name)} {params} returned {response.status_code}')
+                        bodies.setdefault(name, response.content)
+                        latencies.append(latency)
+                    walls.append(wall)
+
+                results[name] = {
+                    'wall_ms': statistics.median(walls),
+                    'latency_ms': {'p50': percentile(latencies, 0.5), 'p90': percentile(latencies, 0.9), 'max': max(latencies)},
+                    'requests_per_second': concurrency * 1000 / statistics.median(walls),
+                }
+
+            results[sync_name]['identical'] = results[ASYNC_ENDPOINTS[sync_name]]['identical'] = (
+                bodies[sync_name] == bodies[ASYNC_ENDPOINTS[sync_name]]
+            )
+
+    return results
+
+
+# Reads mixed in by stress(), each as likely as the others
+STRESS_READS = [
+    ('transaction-list', {'page_size': 50}),
+    ('stats-overview', {}),
+    ('transaction-stats', {}),
+]
+
+
+_stress_errors = threading.local()
+
+
+def record_stress_error(sender, **kwargs):
+    # Sent in the thread that handled the failed request
+    _stress_errors.locked = is_locked(sys.exc_info()[1])
+
+
+def stress_worker(index, user, deadline, write_ratio):
+    # Requests back to back until deadline; returns (kind, status, latency ms, locked)
+    client = APIClient(HTTP_HOST=benchmark_host(), raise_request_exception=False)
+    client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(user)}')
+    rnd = random.Random(index)
+
+    samples = []
+    try:
+        while time.monotonic() < deadline:
+            start = time.perf_counter()
+            if rnd.random() < write_ratio:
+                kind = 'write'
+                response = client.post('/api/transaction/', {
+                    'owner': user.pk, 'amount': f'{rnd.randint(1, 500)}.{rnd.randint(0, 99):02d}',
+                    'type': rnd.choice([Transaction.INCOME, Transaction.EXPENSE]),
+                    'date': str(datetime.date(2025, 1, 1) + datetime.timedelta(days=rnd.randrange(365))),
+                    'description': f'stress {index}',
+                }, format='json')
+            else:
+                kind = 'read'
+                name, params = rnd.choice(STRESS_READS)
+                response = client.get(reverse(name), params)
+                consume(response)
+            elapsed = (time.perf_counter() - start) * 1000
+
+            samples.append((kind, response.status_code, elapsed, getattr(_stress_errors, 'locked', False)))
+            _stress_errors.locked = False
+    finally:
+        connections.close_all()
+
+    return samples
+
+
+def summarize_stress(samples, duration):
+    summary = {}
+    for kind in ('write', 'read'):
+        rows = [sample for sample in samples if sample[0] == kind]
+        ok = [latency for _, status, latency, _ in rows if status < 400]
+        errors = len(rows) - len(ok)
+        summary[kind] = {
+            'requests': len(rows),
+            'per_second': len(ok) / duration,
+            'errors': errors,
+            'error_rate': errors / len(rows) if rows else 0.0,
+            'locked': sum(1 for sample in rows if sample[3]),
+            'latency_ms': {'p50': percentile(ok, 0.5), 'p95': percentile(ok, 0.95), 'max': max(ok)} if ok else None,
+        }
+    return summary
+
+
+def stress(users, threads=8, duration=10.0, write_ratio=0.5):
+    # threads clients hammer the API for duration seconds through the WSGI
+    # handler, each request a POST /api/transaction/ with probability
+    # write_ratio and otherwise one of STRESS_READS. Failed requests are
+    # counted rather than raised; "locked" are the ones SQLite turned away.
+    deadline = time.monotonic() + duration
+
+    # Failed requests are part of the measurement, not worth a traceback each
+    request_logger = logging.getLogger('django.request')
+    level = request_logger.level
+    request_logger.setLevel(logging.CRITICAL)
+    got_request_exception.connect(record_stress_error)
+    try:
+        with ThreadPoolExecutor(max_workers=threads, thread_name_prefix='stress') as executor:
+            samples = list(chain.from_iterable(executor.map(
+                lambda index: stress_worker(index, users[index % len(users)], deadline, write_ratio), range(threads)
+            )))
+    finally:
+        got_request_exception.disconnect(record_stress_error)
+        request_logger.setLevel(level)
+
+    return {
+        'meta': {
+            'profile': getattr(settings, 'DATABASE_PROFILE', None),
+            'journal_mode': connection.cursor().execute('PRAGMA journal_mode').fetchone()[0] if connection.vendor == 'sqlite' else None,
+            'threads': threads,
+            'duration': duration,
+            'write_ratio': write_ratio,
+        },
+        **summarize_stress(samples, duration),
+    }
@@ -0,0 +1,148 @@
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import IntegrityError, router, transaction
+from django.db.models import Count, DecimalField, F, IntegerField, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from expenses.models import Budget, CategorySpend, Transaction
+from expenses.services.balances import month_start
+
+
+
+# Counters are kept for every categorized expense, budget or not, so a
+# budget added later is checked against the whole month straight away
+SPEND_KEY_FIELDS = ('owner_id', 'category_id', 'month')
+
+
+def spend_deltas(rollup_deltas):
+    # Rollup deltas ({(owner_id, date, category_id, type): [amount, count]})
+    # to counter changes per (owner_id, category_id, month)
+    deltas = defaultdict(lambda: [Decimal(0), 0])
+    for (owner_id, date, category_id, type), (amount, count) in rollup_deltas.items():
+        if type == Transaction.EXPENSE and category_id is not None:
+            delta = deltas[owner_id, category_id, month_start(date)]
+            delta[0] += amount
+            delta[1] += count
+    return deltas
+
+
+def apply_spend_delta(key, amount, count):
+    owner_id, category_id, month = key
+    counters = CategorySpend.objects.filter(category_id=category_id, month=month)
+
+    with transaction.atomic(using=router.db_for_write(CategorySpend)):
+        updated = counters.update(spent=F('spent') + amount, count=F('count') + count)
+
+        if count < 0:
+            counters.filter(count__lte=0).delete()
+        elif not updated and count > 0:
+            try:
+                with transaction.atomic(using=router.db_for_write(CategorySpend)):
+                    CategorySpend.objects.create(
+                        owner_id=owner_id, category_id=category_id, month=month, spent=amount, count=count
+                    )
+            except IntegrityError:
+                # Another writer created the row in the meantime
+                counters.update(spent=F('spent') + amount, count=F('count') + count)
+
+
+def apply_spend_deltas(rollup_deltas):
+    for key, (amount, count) in spend_deltas(rollup_deltas).items():
+        if amount or count:
+            apply_spend_delta(key, amount, count)
+
+
+def compute_spend(owner=None):
+    # {(owner_id, category_id, month): (spent, count)} from the transactions
+    qs = Transaction.objects.filter(type=Transaction.EXPENSE, category__isnull=False)
+    if owner is not None:
+        qs = qs.filter(owner=owner)
+
+    totals = defaultdict(lambda: (Decimal(0), 0))
+    rows = qs.order_by().values('owner_id', 'category_id', 'date').annotate(total=Sum('amount'), transactions=Count('id'))
+    for row in rows.iterator():
+        key = (row['owner_id'], row['category_id'], month_start(row['date']))
+        spent, count = totals[key]
+        totals[key] = (spent + row['total'], count + row['transactions'])
+    return dict(totals)
+
+
+def stored_spend(owner=None):
+    counters = CategorySpend.objects.all()
+    if owner is not None:
+        counters = counters.filter(owner=owner)
+
+    return {
+        tuple(row[field] for field in SPEND_KEY_FIELDS): (row['spent'], row['count'])
+        for row in counters.values(*SPEND_KEY_FIELDS, 'spent', 'count').iterator()
+    }
+
+
+def verify_spend(owner=None):
+    expected = compute_spend(owner)
+    actual = stored_spend(owner)
+
+    return [
+        (key, expected.get(key), actual.get(key))
+        for key in sorted(expected.keys() | actual.keys(), key=str)
+        if expected.get(key) != actual.get(key)
+    ]
+
+
+def repair_spend(mismatches):
+    # Overwrites the drifted counters from verify_spend() with the expected
+    # values and deletes the ones no transaction backs
+    with transaction.atomic(using=router.db_for_write(CategorySpend)):
+        for (owner_id, category_id, month), expected, actual in mismatches:
+            counters = CategorySpend.objects.filter(category_id=category_id, month=month)
+            if expected is None:
+                counters.delete()
+            elif actual is None:
+                CategorySpend.objects.create(
+                    owner_id=owner_id, category_id=category_id, month=month, spent=expected[0], count=expected[1]
+                )
+            else:
+                counters.update(spent=expected[0], count=expected[1])
+
+    return len(mismatches)
+
+
+def rebuild_spend(owner=None):
+    expected = compute_spend(owner)
+    counters = CategorySpend.objects.all()
+    if owner is not None:
+        counters = counters.filter(owner=owner)
+
+    with transaction.atomic(using=router.db_for_write(CategorySpend)):
+        counters.delete()
+        CategorySpend.objects.bulk_create(
+            [
+                CategorySpend(owner_id=owner_id, category_id=category_id, month=month, spent=spent, count=count)
+                for (owner_id, category_id, month), (spent, count) in expected.items()
+            ],
+            batch_size=1000
+        )
+
+    return len(expected)
+
+
+def with_spend(budgets, month):
+    # Annotates the budgets with month and the counter of their category for
+    # it: one indexed lookup per budget, however many transactions there are
+    counters = CategorySpend.objects.filter(category=OuterRef('category'), month=month)
+    return budgets.annotate(
+        month=Value(month),
+        spent=Coalesce(
+            Subquery(counters.values('spent')), Value(Decimal(0)),
+            output_field=DecimalField(max_digits=14, decimal_places=2)
+        ),
+        transactions=Coalesce(Subquery(counters.values('count')), Value(0), output_field=IntegerField()),
+    )
+
+
+def transaction_budget(obj):
+    # The budget of the transaction's category with the spend of its month,
+    # or None when the category has no budget
+    if obj.category_id is None:
+        return None
+    return with_spend(Budget.objects.filter(category_id=obj.category_id), month_start(obj.date)).first()
@@ -0,0 +1,41 @@
+from django.db import router, transaction
+from django.db.models import F
+from django.utils import timezone
+from expenses.models import ChangeMarker
+from expenses.routers import check_owner_shard
+
+
+
+# The marker is read from the database on every conditional GET (one primary
+# key lookup) rather than cached: a cached copy can be set before the write
+# that bumped it commits, or survive its rollback, and a per-process cache is
+# not seen by the other workers. Either way a client would get 304 for data
+# that changed.
+
+
+def get_marker(owner_id):
+    # (version, modified_at) of the owner's committed data
+    marker = ChangeMarker.objects.filter(owner_id=owner_id).values_list('version', 'modified_at').first()
+    if marker is None:
+        marker = ChangeMarker.objects.get_or_create(owner_id=owner_id, defaults={'modified_at': timezone.now()})[0]
+        marker = (marker.version, marker.modified_at)
+    return marker
+
+
+def touch(owner_id):
+    # Bumps the owner's version and returns it. Markers are created with the
+    # user, so an owner without one is being deleted and None is returned.
+    # Call it inside the transaction that writes the rows stamped with the
+    # version: the marker row stays locked until that commits, so versions
+    # become visible in the order they were handed out, and a shard move
+    # cannot switch the owner away in between (routers.check_owner_shard).
+    alias = router.db_for_write(ChangeMarker)
+    with transaction.atomic(using=alias):
+        updated = ChangeMarker.objects.filter(owner_id=owner_id).update(
+            version=F('version') + 1, modified_at=timezone.now()
+        )
+        if not updated:
+            return None
+
+        check_owner_shard(owner_id, alias)
+        return ChangeMarker.objects.filter(owner_id=owner_id).values_list('version', flat=True).first()
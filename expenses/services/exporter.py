@@ -0,0 +1,74 @@
+import csv
+import datetime
+import io
+import json
+from decimal import Decimal
+
+from rest_framework import serializers
+
+
+
+# (column name, values_list() lookup); the category name comes from a join
+EXPORT_COLUMNS = [
+    ('id', 'id'),
+    ('date', 'date'),
+    ('type', 'type'),
+    ('amount', 'amount'),
+    ('category', 'category__name'),
+    ('description', 'description'),
+    ('create_at', 'create_at'),
+]
+
+
+_datetime_field = serializers.DateTimeField()
+
+
+def format_value(value):
+    # Same representation as TransactionSerializer uses in the JSON API
+    if isinstance(value, datetime.datetime):
+        return _datetime_field.to_representation(value)
+    if isinstance(value, datetime.date):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    return value
+
+
+def export_rows(qs, chunk_size=2000):
+    lookups = [lookup for _, lookup in EXPORT_COLUMNS]
+    for row in qs.values_list(*lookups).iterator(chunk_size=chunk_size):
+        yield [format_value(value) for value in row]
+
+
+def stream_csv(rows, rows_per_chunk=500):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    # Send the header before the first query runs so clients see bytes at once
+    writer.writerow([name for name, _ in EXPORT_COLUMNS])
+    yield buffer.getvalue()
+    buffer.seek(0)
+    buffer.truncate()
+
+    for count, row in enumerate(rows, start=1):
+        writer.writerow(['' if value is None else value for value in row])
+        if count % rows_per_chunk == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+
+    yield buffer.getvalue()
+
+
+def stream_ndjson(rows, rows_per_chunk=500):
+    names = [name for name, _ in EXPORT_COLUMNS]
+    chunk = []
+
+    for row in rows:
+        chunk.append(json.dumps(dict(zip(names, row)), ensure_ascii=False, separators=(',', ':')))
+        if len(chunk) == rows_per_chunk:
+            yield '\n'.join(chunk) + '\n'
+            chunk = []
+
+    if chunk:
+        yield '\n'.join(chunk) + '\n'
@@ -0,0 +1,136 @@
+import codecs
+import csv
+import json
+
+from django.db import router
+from expenses.models import Category, Transaction
+from expenses.retry import run_with_retry
+from expenses.serializer import TransactionImportSerializer
+from expenses.services.changes import touch
+from expenses.signals import transactions_bulk_created
+
+
+
+IMPORT_FORMATS = ('csv', 'ndjson')
+
+
+def iter_lines(source):
+    # source is any iterable of byte lines (UploadedFile, HttpRequest);
+    # decoding incrementally keeps multi-byte characters split across reads intact
+    decoder = codecs.getincrementaldecoder('utf-8-sig')(errors='replace')
+    for line in source:
+        yield decoder.decode(line)
+
+    tail = decoder.decode(b'', final=True)
+    if tail:
+        yield tail
+
+
+def iter_csv_rows(source):
+    reader = csv.DictReader(iter_lines(source))
+    for row in reader:
+        yield reader.line_num, {key.strip(): value for key, value in row.items() if key}, None
+
+
+def iter_ndjson_rows(source):
+    for line_num, line in enumerate(iter_lines(source), start=1):
+        if not line.strip():
+            continue
+
+        try:
+            row = json.loads(line)
+        except ValueError as exc:
+            yield line_num, None, {'non_field_errors': [f'Invalid JSON: {exc}']}
+            continue
+
+        if not isinstance(row, dict):
+            yield line_num, None, {'non_field_errors': ['Expected a JSON object']}
+            continue
+
+        yield line_num, row, None
+
+
+class TransactionImporter:
+    # Validates rows one by one and writes them with bulk_create in batches,
+    # so memory is bounded by batch_size and the error report cap, not by
+    # the size of the upload
+
+    def __init__(self, owner, batch_size=500, max_errors=1000):
+        self.owner = owner
+        self.batch_size = batch_size
+        self.max_errors = max_errors
+
+        self.categories = dict(Category.objects.filter(owner=owner).values_list('name', 'id'))
+        self.batch = []
+        self.created = 0
+        self.failed = 0
+        self.errors = []
+
+
+    def category_id(self, name):
+        name = (name or '').strip()
+        if not name:
+            return None
+
+        if name not in self.categories:
+            self.categories[name] = Category.objects.create(name=name, owner=self.owner).id
+        return self.categories[name]
+
+
+    def add_error(self, line_num, errors):
+        self.failed += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append({'row': line_num, 'errors': errors})
+
+
+    def flush(self):
+        if not self.batch:
+            return
+
+        created = run_with_retry(self.write_batch, using=router.db_for_write(Transaction))
+        self.created += len(created)
+        self.batch = []
+
+
+    def write_batch(self):
+        # bulk_create() skips pre_save, so the batch shares one sync sequence number
+        seq = touch(self.owner.pk) or 0
+        for row in self.batch:
+            row.change_seq = seq
+        created = Transaction.objects.bulk_create(self.batch)
+        transactions_bulk_created.send(sender=Transaction, owner_id=self.owner.pk, transactions=created)
+        return created
+
+
+    def run(self, rows):
+        for line_num, row, errors in rows:
+            if errors:
+                self.add_error(line_num, errors)
+                continue
+
+            serializer = TransactionImportSerializer(data=row)
+            if not serializer.is_valid():
+                self.add_error(line_num, serializer.errors)
+                continue
+
+            data = serializer.validated_data
+            self.batch.append(Transaction(
+                owner=self.owner,
+                amount=data['amount'],
+                type=data['type'],
+                date=data['date'],
+                description=data.get('description', ''),
+                category_id=self.category_id(data.get('category')),
+            ))
+
+            if len(self.batch) >= self.batch_size:
+                self.flush()
+
+        self.flush()
+
+        return {
+            'created': self.created,
+            'failed': self.failed,
+            'errors': self.errors,
+            'errors_truncated': self.failed > len(self.errors),
+        }
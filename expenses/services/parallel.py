@@ -0,0 +1,96 @@
+import asyncio
+import contextvars
+import datetime
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import Max, Min
+
+from expenses.services.stats import (
+    build_stats_from_rows, category_stats_from_days, fold_category_days, get_category_rows, get_stats_rows
+)
+
+
+
+STATS_CONCURRENCY_DEFAULTS = {
+    # Threads shared by every async stats request in the process; each one
+    # holds its own database connection
+    'WORKERS': 4,
+    # Date ranges a single stats payload is split into
+    'PARTITIONS': 4,
+}
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_config():
+    return {**STATS_CONCURRENCY_DEFAULTS, **getattr(settings, 'STATS_CONCURRENCY', {})}
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=get_config()['WORKERS'], thread_name_prefix='stats')
+        return _executor
+
+
+def shutdown_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown()
+            _executor = None
+
+
+def run_query(func, *args):
+    # Pool threads live outside the request cycle, so they get the same
+    # connection housekeeping Django does around each request
+    close_old_connections()
+    try:
+        return func(*args)
+    finally:
+        close_old_connections()
+
+
+async def in_pool(func, *args):
+    # Runs in a copy of the caller's context, which carries the request's shard
+    context = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(get_executor(), context.run, run_query, func, *args)
+
+
+def date_partitions(qs, partitions):
+    # Contiguous, non-overlapping [start, end] date ranges covering qs
+    bounds = qs.order_by().aggregate(start=Min('date'), end=Max('date'))
+    start, end = bounds['start'], bounds['end']
+    if start is None:
+        return []
+
+    days = (end - start).days + 1
+    partitions = max(1, min(partitions, days))
+    edges = [start + datetime.timedelta(days=days * index // partitions) for index in range(partitions + 1)]
+    return [(edges[index], edges[index + 1] - datetime.timedelta(days=1)) for index in range(partitions)]
+
+
+async def gather_rows(qs, rows, partitions=None):
+    # Runs rows(qs) once per date range, concurrently, and concatenates the
+    # results; rows must group by date so no group spans two partitions
+    ranges = await in_pool(date_partitions, qs, partitions or get_config()['PARTITIONS'])
+    parts = await asyncio.gather(*(
+        in_pool(lambda start, end: list(rows(qs.filter(date__gte=start, date__lte=end))), start, end)
+        for start, end in ranges
+    ))
+    return chain.from_iterable(parts)
+
+
+async def build_stats_concurrently(qs, partitions=None):
+    return build_stats_from_rows(await gather_rows(qs, get_stats_rows, partitions))
+
+
+async def build_category_stats_concurrently(qs, partitions=None):
+    rows = await gather_rows(qs.filter(category__isnull=False), get_category_rows, partitions)
+    return category_stats_from_days(fold_category_days(rows))
@@ -0,0 +1,203 @@
+import datetime
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from django_filters import utils
+
+from expenses.cache import stats_cache
+from expenses.filters import DailyRollupFilter, TransactionFilter
+from expenses.models import DailyRollup, ReportJob, Transaction
+from expenses.renderers import FastJSONRenderer
+from expenses.routers import use_shard
+from expenses.services.changes import get_marker
+from expenses.services.parallel import run_query
+from expenses.services.stats import build_category_stats, compute_stats, limit_stats
+
+
+
+REPORT_JOBS_DEFAULTS = {
+    # 'thread' runs jobs on an in-process pool as soon as they are submitted;
+    # 'command' leaves them to the run_report_worker management command
+    'RUNNER': 'thread',
+    'WORKERS': 2,
+    # Seconds a finished result is kept
+    'RESULT_TTL': 3600,
+    # Seconds after which a running job is assumed lost with its worker and queued again
+    'STALE_AFTER': 900,
+}
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_config():
+    return {**REPORT_JOBS_DEFAULTS, **getattr(settings, 'REPORT_JOBS', {})}
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=get_config()['WORKERS'], thread_name_prefix='reports')
+        return _executor
+
+
+def get_max_points(params):
+    value = params.get('max_points')
+    return int(value) if value else None
+
+
+def build_transaction_stats(owner, params):
+    # What TransactionViewSet.stats returns for the same parameters
+    if DailyRollupFilter.supports(params):
+        qs = DailyRollupFilter(params, queryset=DailyRollup.objects.filter(owner=owner)).qs
+    else:
+        qs = TransactionFilter(params, queryset=Transaction.objects.filter(owner=owner)).qs
+
+    data = compute_stats(qs)
+    max_points = get_max_points(params)
+    return limit_stats(data, max_points) if max_points is not None else data
+
+
+def build_categories(owner, params):
+    return build_category_stats(DailyRollup.objects.filter(owner=owner))
+
+
+REPORT_KINDS = {
+    'transaction-stats': {
+        'build': build_transaction_stats,
+        'params': ('max_points',),
+        'filtered': True,
+    },
+    'stats-categories': {
+        'build': build_categories,
+        'params': (),
+        'filtered': False,
+    },
+}
+
+
+def clean_params(kind, params):
+    # The parameters that change the payload, in the normalized form the stats
+    # cache keys on. Raises ValidationError for invalid filters and
+    # ValueError for an invalid max_points.
+    config = REPORT_KINDS[kind]
+    if config['filtered']:
+        filterset = TransactionFilter(params)
+        if not filterset.is_valid():
+            raise utils.translate_validation(filterset.errors)
+
+    if 'max_points' in config['params']:
+        max_points = get_max_points(params)
+        if max_points is not None and max_points < 2:
+            raise ValueError('max_points must be at least 2')
+
+    return dict(stats_cache.normalize_params(params, config['params'], config['filtered']))
+
+
+def report_key(kind, params):
+    return hashlib.sha1(repr((kind, sorted(params.items()))).encode()).hexdigest()
+
+
+def submit(owner, kind, params):
+    # Returns (job, created). An identical pending or running job is returned
+    # instead of queueing another, as is a finished one that is still fresh
+    # and was computed at the owner's current version.
+    key = report_key(kind, params)
+    requeue_stale(owner=owner)
+
+    version, _ = get_marker(owner.pk)
+    finished = ReportJob.objects.filter(
+        owner=owner, key=key, status=ReportJob.DONE, version=version, expires_at__gt=timezone.now()
+    ).defer('result').order_by('-finished_at').first()
+    if finished is not None:
+        return finished, False
+
+    try:
+        with transaction.atomic():
+            job = ReportJob.objects.create(owner=owner, kind=kind, params=params, key=key)
+    except IntegrityError:
+        # Lost the race to an identical submission, or one is already queued
+        job = ReportJob.objects.filter(
+            owner=owner, key=key, status__in=[ReportJob.PENDING, ReportJob.RUNNING]
+        ).defer('result').first()
+        if job is None:
+            raise
+        if job.status == ReportJob.PENDING:
+            dispatch(job)
+        return job, False
+
+    dispatch(job)
+    return job, True
+
+
+def dispatch(job):
+    # Claiming is atomic, so dispatching a job twice never runs it twice
+    if get_config()['RUNNER'] == 'thread':
+        transaction.on_commit(lambda: get_executor().submit(run_query, run_and_expire, job.pk))
+
+
+def claim(job_id):
+    claimed = ReportJob.objects.filter(pk=job_id, status=ReportJob.PENDING).update(
+        status=ReportJob.RUNNING, started_at=timezone.now()
+    )
+    return ReportJob.objects.filter(pk=job_id).defer('result').first() if claimed else None
+
+
+def run_job(job_id):
+    # Runs the job if it is still pending; returns it, or None when another
+    # worker claimed it first
+    job = claim(job_id)
+    if job is None:
+        return None
+
+    try:
+        with use_shard(job.owner_id):
+            version, _ = get_marker(job.owner_id)
+            data = REPORT_KINDS[job.kind]['build'](job.owner, job.params)
+        result = FastJSONRenderer().render(data)
+    except Exception as exc:
+        job.status, job.error = ReportJob.FAILED, f'{type(exc).__name__}: {exc}'
+        job.version = None
+    else:
+        job.status, job.result, job.version = ReportJob.DONE, result, version
+
+    job.finished_at = timezone.now()
+    job.expires_at = job.finished_at + datetime.timedelta(seconds=get_config()['RESULT_TTL'])
+    job.save(update_fields=['status', 'result', 'error', 'version', 'finished_at', 'expires_at'])
+    return job
+
+
+def run_and_expire(job_id):
+    run_job(job_id)
+    expire_jobs()
+
+
+def pending_jobs(limit=None):
+    ids = ReportJob.objects.filter(status=ReportJob.PENDING).order_by('created_at', 'pk').values_list('pk', flat=True)
+    return list(ids[:limit] if limit else ids)
+
+
+def run_pending(limit=None):
+    # Runs queued jobs in this thread, oldest first; returns how many ran
+    return sum(1 for job_id in pending_jobs(limit) if run_job(job_id) is not None)
+
+
+def requeue_stale(now=None, owner=None):
+    now = now or timezone.now()
+    stale = ReportJob.objects.filter(
+        status=ReportJob.RUNNING, started_at__lt=now - datetime.timedelta(seconds=get_config()['STALE_AFTER'])
+    )
+    if owner is not None:
+        stale = stale.filter(owner=owner)
+    return stale.update(status=ReportJob.PENDING, started_at=None)
+
+
+def expire_jobs(now=None):
+    return ReportJob.objects.filter(
+        status__in=[ReportJob.DONE, ReportJob.FAILED], expires_at__lte=now or timezone.now()
+    ).delete()[0]
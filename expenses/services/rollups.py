@@ -0,0 +1,127 @@
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import IntegrityError, router, transaction
+from django.db.models import Count, F, Sum
+from expenses.models import DailyRollup, Transaction
+
+
+
+ROLLUP_KEY_FIELDS = ('owner_id', 'date', 'category_id', 'type')
+
+
+def rollup_key(obj):
+    # obj is a Transaction instance or a values() dict with the same fields
+    if isinstance(obj, dict):
+        return tuple(obj[field] for field in ROLLUP_KEY_FIELDS)
+    return tuple(getattr(obj, field) for field in ROLLUP_KEY_FIELDS)
+
+
+def apply_delta(key, amount, count):
+    owner_id, date, category_id, type = key
+    rollups = DailyRollup.objects.filter(owner_id=owner_id, date=date, category_id=category_id, type=type)
+
+    with transaction.atomic(using=router.db_for_write(DailyRollup)):
+        updated = rollups.update(amount=F('amount') + amount, count=F('count') + count)
+
+        if count < 0:
+            rollups.filter(count__lte=0).delete()
+        elif not updated and count > 0:
+            try:
+                with transaction.atomic(using=router.db_for_write(DailyRollup)):
+                    DailyRollup.objects.create(
+                        owner_id=owner_id, date=date, category_id=category_id, type=type,
+                        amount=amount, count=count
+                    )
+            except IntegrityError:
+                # Another writer created the row in the meantime
+                rollups.update(amount=F('amount') + amount, count=F('count') + count)
+
+
+def apply_deltas(deltas):
+    # deltas: {rollup key: [amount, count]}
+    for key, (amount, count) in deltas.items():
+        if amount or count:
+            apply_delta(key, amount, count)
+
+
+def transaction_deltas(old=None, new=None):
+    deltas = defaultdict(lambda: [Decimal(0), 0])
+
+    if old is not None:
+        delta = deltas[rollup_key(old)]
+        delta[0] -= Decimal(old['amount'] if isinstance(old, dict) else old.amount)
+        delta[1] -= 1
+
+    if new is not None:
+        delta = deltas[rollup_key(new)]
+        delta[0] += Decimal(new['amount'] if isinstance(new, dict) else new.amount)
+        delta[1] += 1
+
+    return deltas
+
+
+def bulk_deltas(transactions, sign=1):
+    deltas = defaultdict(lambda: [Decimal(0), 0])
+    for obj in transactions:
+        delta = deltas[rollup_key(obj)]
+        delta[0] += sign * Decimal(obj.amount)
+        delta[1] += sign
+
+    return deltas
+
+
+def merge_category_rollups(category):
+    # Category deletion sets Transaction.category to NULL without signals,
+    # so move its rollups into the uncategorized rows of the same day
+    with transaction.atomic(using=router.db_for_write(DailyRollup)):
+        for rollup in DailyRollup.objects.filter(category=category):
+            apply_delta((rollup.owner_id, rollup.date, None, rollup.type), rollup.amount, rollup.count)
+        DailyRollup.objects.filter(category=category).delete()
+
+
+def compute_rollups(owner=None):
+    qs = Transaction.objects.all()
+    if owner is not None:
+        qs = qs.filter(owner=owner)
+
+    rows = qs.order_by().values(*ROLLUP_KEY_FIELDS).annotate(total=Sum('amount'), transactions=Count('id'))
+
+    return {rollup_key(row): (row['total'], row['transactions']) for row in rows.iterator()}
+
+
+def rebuild_rollups(owner=None):
+    expected = compute_rollups(owner)
+    rollups = DailyRollup.objects.all()
+    if owner is not None:
+        rollups = rollups.filter(owner=owner)
+
+    with transaction.atomic(using=router.db_for_write(DailyRollup)):
+        rollups.delete()
+        DailyRollup.objects.bulk_create(
+            [
+                DailyRollup(owner_id=owner_id, date=date, category_id=category_id, type=type, amount=amount, count=count)
+                for (owner_id, date, category_id, type), (amount, count) in expected.items()
+            ],
+            batch_size=1000
+        )
+
+    return len(expected)
+
+
+def verify_rollups(owner=None):
+    expected = compute_rollups(owner)
+    rollups = DailyRollup.objects.all()
+    if owner is not None:
+        rollups = rollups.filter(owner=owner)
+
+    actual = {
+        rollup_key(row): (row['amount'], row['count'])
+        for row in rollups.values(*ROLLUP_KEY_FIELDS, 'amount', 'count').iterator()
+    }
+
+    return [
+        (key, expected.get(key), actual.get(key))
+        for key in sorted(expected.keys() | actual.keys(), key=str)
+        if expected.get(key) != actual.get(key)
+    ]
@@ -0,0 +1,186 @@
+from django.db import transaction
+from django.db.models import Count, F, Sum
+from django.utils import timezone
+from expenses.cache import stats_cache
+from expenses.models import (
+    Budget, Category, CategorySpend, ChangeMarker, DailyRollup, MonthlyBalance, ShardAssignment, SpendSketch, Tombstone,
+    Transaction
+)
+from expenses.routers import get_shards, shard_for, use_shard
+from expenses.services.balances import rebuild_balances
+from expenses.services.budgets import rebuild_spend
+from expenses.services.rollups import rebuild_rollups
+from expenses.services.sketches import rebuild_sketches
+
+
+
+# Everything stored per owner on their shard, rows that reference categories first
+OWNER_MODELS = [Tombstone, MonthlyBalance, DailyRollup, SpendSketch, CategorySpend, Budget, Transaction, Category, ChangeMarker]
+
+COPY_BATCH_SIZE = 2000
+
+
+class ShardMoveError(Exception):
+    pass
+
+
+def purge_owner(owner_id, alias):
+    # Deletes the owner's rows on alias without signals, so no tombstones or
+    # rollup updates are written for them
+    with transaction.atomic(using=alias):
+        for model in OWNER_MODELS:
+            model.objects.using(alias).filter(owner_id=owner_id)._raw_delete(alias)
+
+
+def copy_owner(owner_id, source, target):
+    # Copies the owner's rows from source to target and returns the source
+    # version that was copied. Ids are allocated per database and may be taken
+    # on target, so the rows get new ones; all of them share one new sync
+    # sequence number and older cursors are expired, which makes sync clients
+    # start over with the new ids.
+    version = ChangeMarker.objects.using(source).filter(owner_id=owner_id).values_list('version', flat=True).first() or 0
+    seq = version + 1
+    ChangeMarker.objects.using(target).create(owner_id=owner_id, version=seq, modified_at=timezone.now(), pruned_seq=seq)
+
+    categories = list(Category.objects.using(source).filter(owner_id=owner_id).order_by('pk'))
+    old_ids = [category.pk for category in categories]
+    for category in categories:
+        category.pk, category.change_seq = None, seq
+    Category.objects.using(target).bulk_create(categories, batch_size=COPY_BATCH_SIZE)
+    category_ids = dict(zip(old_ids, (category.pk for category in categories)))
+
+    budgets = list(Budget.objects.using(source).filter(owner_id=owner_id))
+    created = [budget.created_at for budget in budgets]
+    for budget in budgets:
+        budget.pk, budget.category_id = None, category_ids[budget.category_id]
+    Budget.objects.using(target).bulk_create(budgets)
+    for budget, created_at in zip(budgets, created):
+        budget.created_at = created_at
+    Budget.objects.using(target).bulk_update(budgets, ['created_at'])
+
+    rows = Transaction.objects.using(source).filter(owner_id=owner_id).order_by('pk').iterator(chunk_size=COPY_BATCH_SIZE)
+    while True:
+        batch = [row for _, row in zip(range(COPY_BATCH_SIZE), rows)]
+        if not batch:
+            break
+
+        created = [row.create_at for row in batch]
+        for row in batch:
+            row.pk, row.change_seq = None, seq
+            row.category_id = category_ids.get(row.category_id)
+        Transaction.objects.using(target).bulk_create(batch)
+
+        # bulk_create() stamps auto_now_add fields with the current time
+        for row, create_at in zip(batch, created):
+            row.create_at = create_at
+        Transaction.objects.using(target).bulk_update(batch, ['create_at'])
+
+    with use_shard(owner_id, target):
+        rebuild_rollups(owner_id)
+        rebuild_balances(owner_id)
+        rebuild_spend(owner_id)
+        rebuild_sketches(owner_id)
+
+    return version
+
+
+def owner_totals(owner_id, alias):
+    return (
+        Category.objects.using(alias).filter(owner_id=owner_id).count(),
+        Transaction.objects.using(alias).filter(owner_id=owner_id).aggregate(count=Count('id'), total=Sum('amount')),
+    )
+
+
+def move_owner(owner_id, target):
+    # Moves the owner's rows to target and returns how many transactions
+    # were moved. Writes are refused while the move runs; one that was
+    # already under way when it started either commits before the owner is
+    # switched, making the move fail so it can simply be retried, or is
+    # refused once it gets the source's write lock (routers.check_owner_shard).
+    if target not in get_shards():
+        raise ShardMoveError(f'{target} is not one of EXPENSES_SHARDS')
+
+    source = shard_for(owner_id)
+    if source == target:
+        return 0
+
+    assignment = ShardAssignment.objects.filter(owner_id=owner_id)
+    assignment.update(moving=True)
+    try:
+        with transaction.atomic(using=target):
+            purge_owner(owner_id, target)
+            version = copy_owner(owner_id, source, target)
+
+            expected = owner_totals(owner_id, source)
+            if owner_totals(owner_id, target) != expected:
+                raise ShardMoveError(f'The rows of owner {owner_id} copied to {target} do not match {source}')
+
+        # The copy is committed but not used until the switch. From here on
+        # writers on source wait for this transaction: nothing can commit
+        # between the version check and the purge.
+        with transaction.atomic(using=source):
+            markers = ChangeMarker.objects.using(source).filter(owner_id=owner_id)
+            markers.update(version=F('version'))
+
+            current = markers.values_list('version', flat=True).first() or 0
+            if current != version:
+                raise ShardMoveError(f'Owner {owner_id} was written to during the move, try again')
+
+            assignment.update(shard=target, moving=False)
+            purge_owner(owner_id, source)
+    except Exception:
+        if shard_for(owner_id) != target:
+            purge_owner(owner_id, target)
+        assignment.update(moving=False)
+        raise
+
+    stats_cache.bump_version(owner_id)
+
+    return expected[1]['count']
+
+
+def shard_loads():
+    # {alias: {owner_id: transactions}} for the owners assigned to each shard
+    loads = {alias: {} for alias in get_shards()}
+    for owner_id, alias in ShardAssignment.objects.values_list('owner_id', 'shard').iterator():
+        if alias in loads:
+            loads[alias][owner_id] = 0
+
+    for alias, owners in loads.items():
+        rows = Transaction.objects.using(alias).order_by().values('owner_id').annotate(count=Count('id'))
+        for row in rows.iterator():
+            if row['owner_id'] in owners:
+                owners[row['owner_id']] = row['count']
+
+    return loads
+
+
+def plan_rebalance(loads):
+    # Greedy: keep moving to the emptiest shard the owner whose move narrows
+    # the gaps the most, until no move does. Returns [(owner_id, source,
+    # target, transactions)] in the order the moves should run.
+    owners = {alias: dict(counts) for alias, counts in loads.items()}
+    totals = {alias: sum(counts.values()) for alias, counts in owners.items()}
+
+    moves = []
+    while True:
+        target = min(totals, key=totals.get)
+        # Moving count rows from source to target lowers the sum of squared
+        # shard sizes by 2 * count * (source - target - count)
+        gain, owner_id, source = max(
+            (
+                (count * (totals[source] - totals[target] - count), owner_id, source)
+                for source, counts in owners.items() if source != target
+                for owner_id, count in counts.items()
+            ),
+            default=(0, None, None)
+        )
+        if gain <= 0:
+            break
+
+        count = owners[target][owner_id] = owners[source].pop(owner_id)
+        totals[source] -= count
+        totals[target] += count
+        moves.append((owner_id, source, target, count))
+
+    return moves
@@ -0,0 +1,216 @@
+import math
+from collections import Counter, defaultdict
+
+from django.db import IntegrityError, router, transaction
+from expenses.models import SpendSketch, Transaction
+from expenses.services.balances import month_start
+
+
+
+# Amounts are counted in logarithmic buckets (the DDSketch layout): bucket i
+# holds (GAMMA ** (i - 1), GAMMA ** i] and is read back as the point whose
+# relative distance to both ends is RELATIVE_ACCURACY. Any quantile read from
+# a sketch, or from any merge of sketches, is therefore within
+# RELATIVE_ACCURACY of the exact one, e.g. a p90 of 100.00 is the exact p90
+# within 99.00..101.00. Unlike t-digest or KLL the buckets are plain counts,
+# so deletes and updates are exact too. Changing RELATIVE_ACCURACY needs a
+# rebuild_sketches() of the stored bins.
+RELATIVE_ACCURACY = 0.01
+GAMMA = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+LOG_GAMMA = math.log(GAMMA)
+
+# Amounts of 0 (or below) have no logarithm and a bucket of their own
+ZERO_BIN = 'zero'
+
+DEFAULT_QUANTILES = (0.5, 0.9, 0.99)
+
+
+def bin_key(amount):
+    amount = float(amount)
+    if amount <= 0:
+        return ZERO_BIN
+    return str(math.ceil(math.log(amount) / LOG_GAMMA))
+
+
+def bin_value(key):
+    if key == ZERO_BIN:
+        return 0.0
+    return 2 * GAMMA ** int(key) / (GAMMA + 1)
+
+
+def quantile_label(q):
+    return f'p{q * 100:g}'
+
+
+class QuantileSketch:
+    def __init__(self, bins=None):
+        self.bins = Counter()
+        if bins:
+            self.merge(bins)
+
+
+    @property
+    def count(self):
+        return sum(self.bins.values())
+
+
+    def add(self, amount, count=1):
+        self.merge({bin_key(amount): count})
+
+
+    def merge(self, bins):
+        # bins: another sketch or its {bucket: count}; negative counts remove
+        for key, count in getattr(bins, 'bins', bins).items():
+            self.bins[key] += count
+            if self.bins[key] <= 0:
+                del self.bins[key]
+
+
+    def quantile(self, q):
+        # The bucket holding the value of rank q * (count - 1), or None when empty
+        rank = q * (self.count - 1)
+        seen = 0
+        for key in sorted(self.bins, key=lambda key: -math.inf if key == ZERO_BIN else int(key)):
+            seen += self.bins[key]
+            if seen > rank:
+                return bin_value(key)
+        return None
+
+
+    def summary(self, quantiles=DEFAULT_QUANTILES):
+        values = {quantile_label(q): self.quantile(q) for q in quantiles}
+        return {'count': self.count, **{label: round(value, 2) if value is not None else None for label, value in values.items()}}
+
+
+def field_value(obj, field):
+    # obj is a Transaction instance or a values() dict with the same fields
+    return obj[field] if isinstance(obj, dict) else getattr(obj, field)
+
+
+def sketch_key(obj):
+    return field_value(obj, 'owner_id'), field_value(obj, 'category_id'), month_start(field_value(obj, 'date'))
+
+
+def transaction_changes(old=None, new=None):
+    # {sketch key: {bucket: count change}} for a transaction written from old to new
+    changes = defaultdict(Counter)
+    for obj, sign in ((old, -1), (new, 1)):
+        if obj is not None and field_value(obj, 'type') == Transaction.EXPENSE:
+            changes[sketch_key(obj)][bin_key(field_value(obj, 'amount'))] += sign
+    return changes
+
+
+def bulk_changes(transactions):
+    changes = defaultdict(Counter)
+    for obj in transactions:
+        if obj.type == Transaction.EXPENSE:
+            changes[sketch_key(obj)][bin_key(obj.amount)] += 1
+    return changes
+
+
+def apply_sketch_change(key, bins):
+    owner_id, category_id, month = key
+    sketches = SpendSketch.objects.filter(owner_id=owner_id, category_id=category_id, month=month)
+
+    with transaction.atomic(using=router.db_for_write(SpendSketch)):
+        sketch = sketches.select_for_update().first() or SpendSketch(owner_id=owner_id, category_id=category_id, month=month)
+        merged = QuantileSketch(sketch.bins)
+        merged.merge(bins)
+
+        if not merged.count:
+            if sketch.pk is not None:
+                sketch.delete()
+            return
+
+        sketch.bins, sketch.count = dict(merged.bins), merged.count
+        try:
+            with transaction.atomic(using=router.db_for_write(SpendSketch)):
+                sketch.save()
+        except IntegrityError:
+            # Another writer created the row in the meantime
+            apply_sketch_change(key, bins)
+
+
+def apply_sketch_changes(changes):
+    for key, bins in changes.items():
+        if any(bins.values()):
+            apply_sketch_change(key, bins)
+
+
+def merge_category_sketches(category):
+    # Category deletion sets Transaction.category to NULL without signals,
+    # so fold its sketches into the uncategorized ones of the same month
+    with transaction.atomic(using=router.db_for_write(SpendSketch)):
+        for sketch in SpendSketch.objects.filter(category=category):
+            apply_sketch_change((sketch.owner_id, None, sketch.month), sketch.bins)
+        SpendSketch.objects.filter(category=category).delete()
+
+
+def compute_sketches(owner=None):
+    qs = Transaction.objects.filter(type=Transaction.EXPENSE)
+    if owner is not None:
+        qs = qs.filter(owner=owner)
+
+    sketches = defaultdict(QuantileSketch)
+    for row in qs.order_by().values('owner_id', 'category_id', 'date', 'amount').iterator(chunk_size=5000):
+        sketches[sketch_key(row)].add(row['amount'])
+    return sketches
+
+
+def rebuild_sketches(owner=None):
+    expected = compute_sketches(owner)
+    sketches = SpendSketch.objects.all()
+    if owner is not None:
+        sketches = sketches.filter(owner=owner)
+
+    with transaction.atomic(using=router.db_for_write(SpendSketch)):
+        sketches.delete()
+        SpendSketch.objects.bulk_create(
+            [
+                SpendSketch(
+                    owner_id=owner_id, category_id=category_id, month=month, bins=dict(sketch.bins), count=sketch.count
+                )
+                for (owner_id, category_id, month), sketch in expected.items()
+            ],
+            batch_size=1000
+        )
+
+    return len(expected)
+
+
+def verify_sketches(owner=None):
+    expected = {key: dict(sketch.bins) for key, sketch in compute_sketches(owner).items()}
+    sketches = SpendSketch.objects.all()
+    if owner is not None:
+        sketches = sketches.filter(owner=owner)
+
+    actual = {
+        (row['owner_id'], row['category_id'], row['month']): row['bins']
+        for row in sketches.values('owner_id', 'category_id', 'month', 'bins').iterator()
+    }
+
+    return [
+        (key, expected.get(key), actual.get(key))
+        for key in sorted(expected.keys() | actual.keys(), key=str)
+        if expected.get(key) != actual.get(key)
+    ]
+
+
+def spend_distribution(sketches, quantiles=DEFAULT_QUANTILES):
+    # Merges the monthly sketches into one per category and one overall; the
+    # cost depends on the number of categories and months, not transactions
+    overall = QuantileSketch()
+    categories = {}
+    for row in sketches.order_by().values('category_id', 'category__name', 'bins').iterator():
+        name, sketch = categories.setdefault(row['category_id'], (row['category__name'], QuantileSketch()))
+        sketch.merge(row['bins'])
+        overall.merge(row['bins'])
+
+    return {
+        'relative_accuracy': RELATIVE_ACCURACY,
+        'overall': overall.summary(quantiles),
+        'categories': [
+            {'category_id': category_id, 'category': name, **sketch.summary(quantiles)}
+            for category_id, (name, sketch) in sorted(categories.items(), key=lambda item: (item[1][0] is None, item[1][0] or ''))
+        ],
+    }
@@ -1,6 +1,14 @@
-from django.db.models import Sum, Case, When, DecimalField, ExpressionWrapper, F
+import heapq
+import math
+from collections import defaultdict
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db.models import Sum, Count, Case, When, DecimalField, ExpressionWrapper, F
 from django.db.models.functions import ExtractYear, ExtractMonth, ExtractWeek, ExtractDay
-from expenses.models import Transaction
+from django.utils.module_loading import import_string
+from expenses.models import DailyRollup, Transaction
 
 
 
@@ -36,6 +44,40 @@ PERIOD_CONFIG = {
 }
 
 
+# Python equivalents of the PERIOD_CONFIG extracts, used to bucket dates
+# that were already fetched instead of asking the database again.
+# ExtractWeek is the ISO week number, paired with the calendar year.
+PERIOD_KEYS = {
+    'year': lambda d: (d.year,),
+    'month': lambda d: (d.year, d.month),
+    'week': lambda d: (d.year, d.isocalendar()[1]),
+    'day': lambda d: (d.year, d.month, d.day),
+}
+
+
+# Interchangeable implementations of build_stats(), selected with the
+# EXPENSES_STATS_BACKEND setting; 'numpy' needs numpy to be installed
+STATS_BACKENDS = {
+    'orm': 'expenses.services.stats.build_stats',
+    'numpy': 'expenses.services.stats_numpy.build_stats',
+}
+
+
+def get_stats_backend(name=None):
+    name = name or getattr(settings, 'EXPENSES_STATS_BACKEND', 'orm')
+    if name not in STATS_BACKENDS:
+        raise ImproperlyConfigured(f"Unknown EXPENSES_STATS_BACKEND: {name}")
+
+    try:
+        return import_string(STATS_BACKENDS[name])
+    except ImportError as exc:
+        raise ImproperlyConfigured(f"The {name} stats backend is not available: {exc}")
+
+
+def compute_stats(qs, backend=None):
+    return get_stats_backend(backend)(qs)
+
+
 def get_time_stats(qs, period: str, category=None):
     config = PERIOD_CONFIG[period]
   
@@ -54,4 +96,342 @@ def get_time_stats(qs, period: str, category=None):
 def get_time_extreme_stats(qs, period: str):
     config = PERIOD_CONFIG[period]
     result = qs.annotate(**config['fields']).values(*config['fields'].keys()).annotate(total=Sum('amount')).order_by('total')
-    return result
\ No newline at end of file
+    return result
+
+
+def get_stats_rows(qs):
+    # The single grouped scan every stats payload is built from.
+    # qs is either a Transaction or a DailyRollup queryset.
+    return qs.order_by().values('date', 'type', 'category_id', 'category__name').annotate(
+        total=Sum('amount'),
+        transactions=Sum('count') if qs.model is DailyRollup else Count('id'),
+    )
+
+
+def roll_up(days, period: str):
+    # days: {date: [income, expense]} -> same shape as get_time_stats(qs, period)
+    names = list(PERIOD_CONFIG[period]['fields'].keys())
+    key_func = PERIOD_KEYS[period]
+
+    buckets = defaultdict(lambda: [Decimal(0), Decimal(0)])
+    for day, (income, expense) in days.items():
+        bucket = buckets[key_func(day)]
+        bucket[0] += income
+        bucket[1] += expense
+
+    return [
+        {
+            **dict(zip(names, key)),
+            'income': income,
+            'expense': expense,
+            'net': income - expense
+        }
+        for key, (income, expense) in sorted(buckets.items())
+    ]
+
+
+def build_stats(qs):
+    return build_stats_from_rows(get_stats_rows(qs))
+
+
+def build_stats_from_rows(rows):
+    # rows need not be grouped or ordered, so partial scans can be concatenated
+    totals = {Transaction.INCOME: None, Transaction.EXPENSE: None}
+    transaction_count = 0
+    days = defaultdict(lambda: [Decimal(0), Decimal(0)])
+    expense_days = defaultdict(Decimal)
+    categories = {}
+
+    for row in rows:
+        day, total = row['date'], row['total']
+        is_income = row['type'] == Transaction.INCOME
+
+        transaction_count += row['transactions']
+        totals[row['type']] = (totals[row['type']] or 0) + total
+        days[day][0 if is_income else 1] += total
+
+        if not is_income:
+            expense_days[day] += total
+
+        if row['category_id'] is not None:
+            name, category_days = categories.setdefault(
+                row['category_id'], (row['category__name'], defaultdict(lambda: [Decimal(0), Decimal(0)]))
+            )
+            category_days[day][0 if is_income else 1] += total
+
+    # By categories stats
+    by_category = {}
+    for category_id, (name, category_days) in sorted(categories.items(), key=lambda item: (item[1][0], item[0])):
+        by_category[name] = {
+            name: {
+                'yearly': roll_up(category_days, 'year'),
+                'monthly': roll_up(category_days, 'month'),
+                'weekly': roll_up(category_days, 'week'),
+            }
+        }
+
+    # The cheapest and the most expensive day
+    cheapest_day = expensive_day = None
+    if expense_days:
+        cheapest = min(expense_days.items(), key=lambda item: (item[1], item[0]))
+        expensive = min(expense_days.items(), key=lambda item: (-item[1], item[0]))
+        cheapest_day = {'date': cheapest[0], 'total': cheapest[1]}
+        expensive_day = {'date': expensive[0], 'total': expensive[1]}
+
+    income_total = totals[Transaction.INCOME]
+    expense_total = totals[Transaction.EXPENSE]
+
+    return {
+        'transaction_count': transaction_count,
+        'balance': (income_total or 0) - (expense_total or 0),
+        'total_income': income_total,
+        'total_expense': expense_total,
+        'cheapest_day': cheapest_day,
+        'expensive_day': expensive_day,
+        'by_category': list(by_category.values()),
+        'daily': [
+            {
+                'date': day,
+                'income': income,
+                'expense': expense,
+                'net': income - expense
+            }
+            for day, (income, expense) in sorted(days.items())
+        ],
+        'weekly': roll_up(days, 'week'),
+        'monthly': roll_up(days, 'month'),
+        'yearly': roll_up(days, 'year')
+    }
+
+
+def get_category_rows(qs, categories=None):
+    rows = qs.order_by().values('category_id', 'category__name', 'date', 'type').annotate(total=Sum('amount'))
+    if categories is not None:
+        rows = rows.filter(category_id__in=categories)
+    return rows
+
+
+def get_category_days(qs, categories=None):
+    # {category_id: (name, {date: [income, expense]})} from one grouped query
+    return fold_category_days(get_category_rows(qs, categories))
+
+
+def fold_category_days(rows):
+    result = {}
+    for row in rows:
+        name, days = result.setdefault(
+            row['category_id'], (row['category__name'], defaultdict(lambda: [Decimal(0), Decimal(0)]))
+        )
+        days[row['date']][0 if row['type'] == Transaction.INCOME else 1] += row['total']
+
+    return result
+
+
+def build_category_stats(qs):
+    # Same payload as the former per-category loop in StatsViewSet.categories
+    return category_stats_from_days(get_category_days(qs.filter(category__isnull=False)))
+
+
+def category_stats_from_days(category_days):
+    by_category = defaultdict(list)
+
+    for category_id, (name, days) in sorted(category_days.items(), key=lambda item: (item[1][0], item[0])):
+        income = sum((day[0] for day in days.values()), Decimal(0))
+        expense = sum((day[1] for day in days.values()), Decimal(0))
+
+        by_category[name].append({
+            'income': income,
+            'expense': expense,
+            'net': income - expense,
+            'daily': roll_up(days, 'day'),
+            'weekly': roll_up(days, 'week'),
+            'monthly': roll_up(days, 'month'),
+            'yearly': roll_up(days, 'year')
+        })
+
+    return by_category
+
+
+def build_cube(qs, periods=tuple(PERIOD_CONFIG), categories=None):
+    # Sparse category x period cube: dimension tables plus one
+    # [category, period, bucket, income, expense, net] row per non-empty cell
+    category_days = get_category_days(qs, categories)
+    order = sorted(category_days, key=lambda category_id: (category_id is not None, category_days[category_id][0] or '', category_id or 0))
+
+    buckets = {period: {} for period in periods}
+    rows = []
+
+    for category_index, category_id in enumerate(order):
+        days = category_days[category_id][1]
+        for period_index, period in enumerate(periods):
+            for entry in roll_up(days, period):
+                key = tuple(entry[name] for name in PERIOD_CONFIG[period]['fields'])
+                bucket_index = buckets[period].setdefault(key, len(buckets[period]))
+                rows.append([category_index, period_index, bucket_index, entry['income'], entry['expense'], entry['net']])
+
+    # Number buckets chronologically, then remap the rows
+    labels, positions = {}, []
+    for period in periods:
+        ordered = sorted(buckets[period])
+        labels[period] = [list(key) for key in ordered]
+        positions.append({buckets[period][key]: index for index, key in enumerate(ordered)})
+
+    for row in rows:
+        row[2] = positions[row[1]][row[2]]
+
+    rows.sort(key=lambda row: (row[0], row[1], row[2]))
+
+    return {
+        'dimensions': {
+            'category': [{'id': category_id, 'name': category_days[category_id][0]} for category_id in order],
+            'period': list(periods),
+            'bucket_fields': {period: list(PERIOD_CONFIG[period]['fields']) for period in periods},
+            'buckets': labels,
+        },
+        'columns': ['category', 'period', 'bucket', 'income', 'expense', 'net'],
+        'rows': rows,
+    }
+
+
+def select_extremes(buckets, period: str, n: int):
+    # buckets: {period key: total} -> the n largest and n smallest totals,
+    # picked with bounded heaps; ties go to the earlier bucket
+    names = list(PERIOD_CONFIG[period]['fields'].keys())
+
+    def entry(item):
+        key, total = item
+        return {**dict(zip(names, key)), 'total': total}
+
+    return {
+        'top': [entry(item) for item in heapq.nsmallest(n, buckets.items(), key=lambda item: (-item[1], item[0]))],
+        'bottom': [entry(item) for item in heapq.nsmallest(n, buckets.items(), key=lambda item: (item[1], item[0]))],
+    }
+
+
+def build_extremes(qs, periods=tuple(PERIOD_CONFIG), n=5, by_category=False):
+    # One grouped query; every row is folded into the buckets of all the
+    # requested periods (and of its category) before the heaps select
+    fields = ['date', 'category_id', 'category__name'] if by_category else ['date']
+    rows = qs.order_by().values(*fields).annotate(total=Sum('amount'))
+
+    totals = {period: defaultdict(Decimal) for period in periods}
+    categories = {}
+
+    for row in rows:
+        keys = [(period, PERIOD_KEYS[period](row['date'])) for period in periods]
+        for period, key in keys:
+            totals[period][key] += row['total']
+
+        if by_category:
+            name, category_totals = categories.setdefault(
+                row['category_id'], (row['category__name'], {period: defaultdict(Decimal) for period in periods})
+            )
+            for period, key in keys:
+                category_totals[period][key] += row['total']
+
+    data = {
+        'results': {period: select_extremes(totals[period], period, n) for period in periods},
+    }
+
+    if by_category:
+        order = sorted(categories, key=lambda category_id: (category_id is not None, categories[category_id][0] or '', category_id or 0))
+        data['categories'] = [
+            {
+                'id': category_id,
+                'name': categories[category_id][0],
+                'results': {
+                    period: select_extremes(categories[category_id][1][period], period, n) for period in periods
+                },
+            }
+            for category_id in order
+        ]
+
+    return data
+
+
+# Time-series resolutions from finest to coarsest, for max_points
+RESOLUTIONS = ('day', 'week', 'month', 'year')
+
+STATS_SERIES = (('daily', 'day'), ('weekly', 'week'), ('monthly', 'month'), ('yearly', 'year'))
+
+
+def get_days(qs):
+    # {date: [income, expense]} from one grouped query
+    days = defaultdict(lambda: [Decimal(0), Decimal(0)])
+    for row in qs.order_by().values('date', 'type').annotate(total=Sum('amount')):
+        days[row['date']][0 if row['type'] == Transaction.INCOME else 1] += row['total']
+    return days
+
+
+def merge_buckets(series, max_points):
+    # Sums runs of consecutive entries so at most max_points are left; each
+    # merged entry keeps the key of its first bucket
+    size = math.ceil(len(series) / max_points)
+    merged = []
+    for start in range(0, len(series), size):
+        chunk = series[start:start + size]
+        income = sum((entry['income'] for entry in chunk), Decimal(0))
+        expense = sum((entry['expense'] for entry in chunk), Decimal(0))
+        merged.append({**chunk[0], 'income': income, 'expense': expense, 'net': income - expense})
+    return merged
+
+
+def resample(days, period: str, max_points: int):
+    # The finest resolution, starting at period, with at most max_points
+    # non-empty buckets; beyond yearly, consecutive years are merged.
+    # Returns (resolution used, series in the roll_up() shape).
+    for resolution in RESOLUTIONS[RESOLUTIONS.index(period):]:
+        if len({PERIOD_KEYS[resolution](day) for day in days}) <= max_points:
+            return resolution, roll_up(days, resolution)
+
+    return 'year', merge_buckets(roll_up(days, 'year'), max_points)
+
+
+def limit_stats(data, max_points: int):
+    # Bounds the top-level series of a build_stats() payload (from any
+    # backend) to max_points entries each; 'resolution' tells which period
+    # every series ended up at
+    days = {entry['date']: [entry['income'], entry['expense']] for entry in data['daily']}
+    resolution = {}
+
+    for key, period in STATS_SERIES:
+        resolution[key] = period
+        if len(data[key]) > max_points:
+            resolution[key], data[key] = resample(days, period, max_points)
+
+    data['resolution'] = resolution
+    return data
+
+
+def lttb(points, max_points: int, x, y):
+    # Largest-Triangle-Three-Buckets: keeps the first and last point and, from
+    # each of max_points - 2 equal buckets in between, the point forming the
+    # largest triangle with its neighbours, which preserves peaks and troughs
+    if max_points >= len(points):
+        return points
+    if max_points < 3:
+        return [points[0], points[-1]][-max_points:]
+
+    selected = [points[0]]
+    size = (len(points) - 2) / (max_points - 2)
+    previous = points[0]
+
+    for bucket in range(max_points - 2):
+        start = int(bucket * size) + 1
+        end = int((bucket + 1) * size) + 1
+
+        following = points[end:min(int((bucket + 2) * size) + 1, len(points) - 1)] or [points[-1]]
+        average_x = sum(x(point) for point in following) / len(following)
+        average_y = sum(y(point) for point in following) / len(following)
+
+        selected_point = max(
+            points[start:end],
+            key=lambda point: abs(
+                (x(previous) - average_x) * (y(point) - y(previous)) - (x(previous) - x(point)) * (average_y - y(previous))
+            )
+        )
+        selected.append(selected_point)
+        previous = selected_point
+
+    selected.append(points[-1])
+    return selected
@@ -0,0 +1,100 @@
+import binascii
+import heapq
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from itertools import islice
+
+from django.db.models import Max, Q
+from expenses.models import Category, ChangeMarker, Tombstone, Transaction
+
+
+
+# Every change is positioned at (change_seq, kind, id). Within one sequence
+# number categories come first so a client can resolve the transactions'
+# category ids, and deletions come last.
+SYNC_KINDS = ('category', 'transaction', 'tombstone')
+
+START = (-1, 0, 0)
+
+
+class CursorExpired(Exception):
+    pass
+
+
+def encode_cursor(position):
+    payload = json.dumps(list(position), separators=(',', ':'))
+    return urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    # Raises ValueError for anything that is not a cursor we handed out
+    try:
+        position = json.loads(urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except (binascii.Error, UnicodeDecodeError) as exc:
+        raise ValueError(str(exc))
+
+    if not (isinstance(position, list) and len(position) == 3 and all(isinstance(value, int) for value in position)):
+        raise ValueError('Malformed cursor')
+    if not 0 <= position[1] < len(SYNC_KINDS):
+        raise ValueError('Malformed cursor')
+
+    return tuple(position)
+
+
+def after(position, kind):
+    # Rows of kind that sort after position
+    seq, cursor_kind, pk = position
+    if kind < cursor_kind:
+        return Q(change_seq__gt=seq)
+    if kind > cursor_kind:
+        return Q(change_seq__gte=seq)
+    return Q(change_seq__gt=seq) | Q(change_seq=seq, id__gt=pk)
+
+
+def keyed(rows, kind):
+    for row in rows:
+        yield (row.change_seq, kind, row.id), row
+
+
+def get_changes(owner, position=START, limit=500):
+    # Returns (changes, next position, has_more); changes is a list of
+    # (kind name, object) in sync order. Each kind is one index range read.
+    if position[0] >= 0:
+        pruned = ChangeMarker.objects.filter(owner=owner).values_list('pruned_seq', flat=True).first() or 0
+        if position[0] < pruned:
+            raise CursorExpired
+
+    sources = [
+        Category.objects.filter(owner=owner),
+        Transaction.objects.filter(owner=owner).select_related('category'),
+        Tombstone.objects.filter(owner=owner),
+    ]
+
+    streams = [
+        keyed(qs.filter(after(position, kind)).order_by('change_seq', 'id')[:limit + 1], kind)
+        for kind, qs in enumerate(sources)
+    ]
+
+    merged = list(islice(heapq.merge(*streams, key=lambda item: item[0]), limit + 1))
+    has_more = len(merged) > limit
+    merged = merged[:limit]
+
+    if merged:
+        position = merged[-1][0]
+
+    return [(SYNC_KINDS[key[1]], row) for key, row in merged], position, has_more
+
+
+def prune_tombstones(before, owner=None):
+    # Deletes tombstones older than before and records the highest pruned
+    # sequence number per owner, so cursors from before then are rejected
+    tombstones = Tombstone.objects.filter(deleted_at__lt=before)
+    if owner is not None:
+        tombstones = tombstones.filter(owner=owner)
+
+    pruned = 0
+    for row in tombstones.values('owner_id').annotate(seq=Max('change_seq')).order_by():
+        ChangeMarker.objects.filter(owner_id=row['owner_id'], pruned_seq__lt=row['seq']).update(pruned_seq=row['seq'])
+        pruned += Tombstone.objects.filter(owner_id=row['owner_id'], change_seq__lte=row['seq'], deleted_at__lt=before).delete()[0]
+
+    return pruned
@@ -0,0 +1,92 @@
+import datetime
+import random
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.db import router, transaction
+from expenses.models import Category, Transaction
+from expenses.routers import use_shard
+from expenses.services.changes import touch
+from expenses.signals import transactions_reloaded
+
+
+
+User = get_user_model()
+
+
+SCALES = {
+    '10k': 10_000,
+    '100k': 100_000,
+    '1m': 1_000_000,
+}
+
+CATEGORY_NAMES = [
+    'Groceries', 'Rent', 'Transport', 'Restaurants', 'Utilities', 'Health', 'Entertainment',
+    'Shopping', 'Travel', 'Education', 'Gifts', 'Insurance', 'Subscriptions', 'Pets', 'Salary', 'Freelance',
+]
+
+DESCRIPTIONS = [
+    'card payment', 'monthly bill', 'coffee and snacks', 'weekly shopping', 'online order',
+    'taxi ride', 'concert tickets', 'pharmacy', 'salary transfer', 'refund', 'dinner with friends',
+]
+
+
+def synthetic_email(seed, index):
+    return f'synthetic-{seed}-{index}@example.com'
+
+
+def generate_transactions(owner, category_ids, count, rnd, start, days):
+    # Dates skew towards the recent end of the range, categories follow a
+    # Zipf-like distribution and amounts are log-normal, like real histories
+    weights = [1 / (rank + 1) for rank in range(len(category_ids))]
+
+    for _ in range(count):
+        is_income = rnd.random() < 0.12
+        amount = rnd.lognormvariate(7.5, 0.6) if is_income else rnd.lognormvariate(3.2, 1.1)
+
+        yield Transaction(
+            owner=owner,
+            amount=min(Decimal(round(amount, 2)).quantize(Decimal('0.01')), Decimal('99999999.99')),
+            type=Transaction.INCOME if is_income else Transaction.EXPENSE,
+            category_id=None if rnd.random() < 0.05 else rnd.choices(category_ids, weights)[0],
+            date=start + datetime.timedelta(days=int(days * rnd.betavariate(2.5, 1)) % days),
+            description=rnd.choice(DESCRIPTIONS),
+        )
+
+
+def generate_dataset(transactions, users=1, categories=10, seed=42, years=10, batch_size=5000, end=None):
+    # Deterministic for a given set of arguments; existing synthetic users
+    # with the same seed are replaced
+    rnd = random.Random(seed)
+    end = end or datetime.date(2025, 12, 31)
+    days = 365 * years
+    start = end - datetime.timedelta(days=days - 1)
+
+    User.objects.filter(email__in=[synthetic_email(seed, index) for index in range(users)]).delete()
+
+    created = []
+    per_user = [transactions // users + (1 if index < transactions % users else 0) for index in range(users)]
+
+    for index, count in enumerate(per_user):
+        owner = User.objects.create_user(
+            email=synthetic_email(seed, index), username=f'synthetic-{seed}-{index}', password=f'synthetic-{seed}'
+        )
+        with use_shard(owner.pk):
+            names = CATEGORY_NAMES[:categories] + [f'Category {n}' for n in range(len(CATEGORY_NAMES), categories)]
+            category_ids = [Category.objects.create(name=name, owner=owner).id for name in names]
+
+            rows = generate_transactions(owner, category_ids, count, rnd, start, days)
+            while True:
+                batch = [row for _, row in zip(range(batch_size), rows)]
+                if not batch:
+                    break
+                with transaction.atomic(using=router.db_for_write(Transaction)):
+                    seq = touch(owner.pk) or 0
+                    for row in batch:
+                        row.change_seq = seq
+                    Transaction.objects.bulk_create(batch)
+
+            transactions_reloaded.send(sender=Transaction, owner_id=owner.pk)
+        created.append(owner)
+
+    return created
@@ -0,0 +1,155 @@
+from django.contrib.auth import get_user_model
+from django.db import router, transaction
+from django.db.models import QuerySet
+from django.db.models.signals import pre_save, post_save, post_delete, pre_delete
+from django.dispatch import Signal, receiver
+from django.utils import timezone
+
+from .cache import stats_cache
+from .models import Category, ChangeMarker, Tombstone, Transaction
+from .routers import get_assignment, use_shard
+from .services.balances import apply_balance_deltas, rebuild_balances
+from .services.budgets import apply_spend_deltas, rebuild_spend
+from .services.changes import touch
+from .services.sketches import (
+    apply_sketch_changes, bulk_changes, merge_category_sketches, rebuild_sketches, transaction_changes
+)
+from .services.shards import purge_owner
+from .services.rollups import (
+    ROLLUP_KEY_FIELDS, apply_deltas, bulk_deltas, merge_category_rollups, rebuild_rollups, transaction_deltas
+)
+
+
+# bulk_create() skips the model signals, so bulk writers send this instead
+# with sender=Transaction, owner_id and the list of created transactions
+transactions_bulk_created = Signal()
+
+# Sent with sender=Transaction and owner_id after loads too large for
+# per-batch bookkeeping; receivers rebuild their derived data from scratch
+transactions_reloaded = Signal()
+
+
+def deleting_owner(origin):
+    # True when a delete cascades from the owner (a User or a User queryset);
+    # everything derived from their rows is being deleted along with them
+    model = origin.model if isinstance(origin, QuerySet) else type(origin)
+    return model is get_user_model()
+
+
+@receiver(pre_save, sender=Transaction)
+def remember_previous_transaction(sender, instance, **kwargs):
+    instance._previous = None
+    if instance.pk is not None:
+        instance._previous = Transaction.objects.filter(pk=instance.pk).values(*ROLLUP_KEY_FIELDS, 'amount').first()
+
+
+@receiver(post_save, sender=Transaction)
+def update_rollups_on_save(sender, instance, **kwargs):
+    deltas = transaction_deltas(old=getattr(instance, '_previous', None), new=instance)
+    apply_deltas(deltas)
+    apply_balance_deltas(deltas)
+    apply_spend_deltas(deltas)
+    apply_sketch_changes(transaction_changes(old=getattr(instance, '_previous', None), new=instance))
+
+
+@receiver(post_delete, sender=Transaction)
+def update_rollups_on_delete(sender, instance, origin=None, **kwargs):
+    if deleting_owner(origin):
+        return
+
+    deltas = transaction_deltas(old=instance)
+    apply_deltas(deltas)
+    apply_balance_deltas(deltas)
+    apply_spend_deltas(deltas)
+    apply_sketch_changes(transaction_changes(old=instance))
+
+
+@receiver(transactions_bulk_created, sender=Transaction)
+def update_rollups_on_bulk_create(sender, owner_id, transactions, **kwargs):
+    deltas = bulk_deltas(transactions)
+    apply_deltas(deltas)
+    apply_balance_deltas(deltas)
+    apply_spend_deltas(deltas)
+    apply_sketch_changes(bulk_changes(transactions))
+
+
+@receiver(transactions_reloaded, sender=Transaction)
+def rebuild_rollups_on_reload(sender, owner_id, **kwargs):
+    rebuild_rollups(owner_id)
+    rebuild_balances(owner_id)
+    rebuild_spend(owner_id)
+    rebuild_sketches(owner_id)
+
+
+@receiver(pre_delete, sender=Category)
+def merge_rollups_on_category_delete(sender, instance, origin=None, **kwargs):
+    if not deleting_owner(origin):
+        merge_category_rollups(instance)
+        merge_category_sketches(instance)
+
+
+@receiver(post_save, sender=Transaction)
+@receiver(post_delete, sender=Transaction)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_stats_cache(sender, instance, using, **kwargs):
+    stats_cache.bump_version_on_commit(instance.owner_id, using)
+
+
+@receiver(transactions_bulk_created, sender=Transaction)
+@receiver(transactions_reloaded, sender=Transaction)
+def invalidate_stats_cache_on_bulk_write(sender, owner_id, **kwargs):
+    stats_cache.bump_version_on_commit(owner_id, router.db_for_write(Transaction))
+
+
+# Bulk writers stamp their rows with touch() themselves
+@receiver(transactions_reloaded, sender=Transaction)
+def touch_on_reload(sender, owner_id, **kwargs):
+    touch(owner_id)
+
+
+@receiver(pre_save, sender=Transaction)
+@receiver(pre_save, sender=Category)
+def stamp_change_seq(sender, instance, **kwargs):
+    instance.change_seq = touch(instance.owner_id) or instance.change_seq
+
+
+@receiver(pre_delete, sender=Category)
+def stamp_orphaned_transactions(sender, instance, origin=None, **kwargs):
+    # The SET_NULL on the category's transactions is a queryset update that
+    # skips pre_save, so they are moved up the sync sequence here
+    if deleting_owner(origin):
+        return
+
+    seq = touch(instance.owner_id)
+    if seq is not None:
+        Transaction.objects.filter(category=instance).update(change_seq=seq)
+
+
+@receiver(post_delete, sender=Transaction)
+@receiver(post_delete, sender=Category)
+def record_tombstone(sender, instance, origin=None, **kwargs):
+    if deleting_owner(origin):
+        return
+
+    seq = touch(instance.owner_id)
+    if seq is not None:
+        model = Tombstone.TRANSACTION if sender is Transaction else Tombstone.CATEGORY
+        Tombstone.objects.create(owner_id=instance.owner_id, model=model, object_id=instance.pk, change_seq=seq)
+
+
+@receiver(post_save, sender=get_user_model())
+def create_change_marker(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        with use_shard(instance.pk):
+            ChangeMarker.objects.get_or_create(owner=instance, defaults={'modified_at': timezone.now()})
+
+
+@receiver(pre_delete, sender=get_user_model())
+def purge_shard_on_user_delete(sender, instance, using, **kwargs):
+    # The delete cascades on the database the user lives on; rows on another
+    # shard are removed once it has committed
+    owner_id = instance.pk
+    alias = get_assignment(owner_id, create=False)[0]
+    if alias is not None and alias != using:
+        transaction.on_commit(lambda: purge_owner(owner_id, alias), using=using)
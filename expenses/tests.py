@@ -1,3 +1,1807 @@
-from django.test import TestCase
+import csv
+import datetime
+import json
+import math
+import os
+import random
+import re
+import tempfile
+from decimal import Decimal
+from io import StringIO
+from unittest import skipUnless
+from unittest import mock
+from unittest.mock import ANY
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, OperationalError, connection, transaction
+from django.db.migrations.executor import MigrationExecutor
+from django.db.models import F
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from project.profiling import registry
+
+from . import renderers
+from .cache import stats_cache
+from .models import (
+    Budget, Category, CategorySpend, ChangeMarker, DailyRollup, MonthlyBalance, ReportJob, ShardAssignment, Transaction
+)
+from .pagination import KeysetPagination
+from .routers import OwnerMoving, get_shards, use_shard
+from .serializer import TransactionSerializer
+from .services.balances import apply_balance_deltas, verify_balances
+from .services.budgets import verify_spend
+from .services.changes import get_marker
+from .services.benchmark import discover_endpoints
+from .services.parallel import date_partitions
+from .services.reports import expire_jobs, requeue_stale, run_pending
+from .services.rollups import verify_rollups
+from .services.shards import ShardMoveError, copy_owner, move_owner, plan_rebalance
+from .services.sketches import RELATIVE_ACCURACY, verify_sketches
+from .services.stats import (
+    PERIOD_CONFIG, build_stats, get_stats_backend, get_time_extreme_stats, get_time_stats, lttb, resample
+)
+from .services.synthetic import generate_dataset, synthetic_email
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+User = get_user_model()
+
+
+def money(value):
+    return Decimal(value).quantize(Decimal('0.01'))
+
+
+def normalize(rows):
+    # The ORM path sums through floats on SQLite, so compare at cent precision
+    return [
+        {key: money(value) if key in ('income', 'expense', 'net') else value for key, value in row.items()}
+        for row in rows
+    ]
+
+
+class StatsTestMixin:
+    def setUp(self):
+        # Writes inside a TestCase never commit, so they do not bump the cached versions
+        stats_cache.cache.clear()
+        self.user = User.objects.create_user(email='owner@example.com', username='owner', password='password123')
+        self.other = User.objects.create_user(email='other@example.com', username='other', password='password123')
+
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+        self.food = Category.objects.create(name='Food', owner=self.user)
+        self.rent = Category.objects.create(name='Rent', owner=self.user)
+        other_food = Category.objects.create(name='Food', owner=self.other)
+
+        start = datetime.date(2020, 12, 25)
+        for i in range(60):
+            Transaction.objects.create(
+                owner=self.user,
+                amount=Decimal(10 + i * 7 % 90) + Decimal('0.35'),
+                type=Transaction.INCOME if i % 4 == 0 else Transaction.EXPENSE,
+                category=[self.food, self.rent, None][i % 3],
+                date=start + datetime.timedelta(days=i * 3 % 45),
+                description=f'transaction {i}',
+            )
+
+        Transaction.objects.create(
+            owner=self.other, amount=Decimal('999.99'), type=Transaction.EXPENSE,
+            category=other_food, date=start,
+        )
+
+
+class TransactionStatsTests(StatsTestMixin, TestCase):
+    def test_stats_use_a_fixed_number_of_queries(self):
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/transaction/stats/')
+
+        self.assertEqual(response.status_code, 200)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Category.objects.create(name='Travel', owner=self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            for i in range(5):
+                Transaction.objects.create(
+                    owner=self.user, amount=Decimal('5.00'), type=Transaction.EXPENSE,
+                    category=Category.objects.create(name=f'Extra {i}', owner=self.user),
+                    date=datetime.date(2021, 3, i + 1),
+                )
+
+        with self.assertNumQueries(2):
+            self.client.get('/api/transaction/stats/')
+
+    def test_stats_match_orm_aggregations(self):
+        qs = Transaction.objects.filter(owner=self.user)
+        data = build_stats(qs)
+
+        self.assertEqual(data['transaction_count'], qs.count())
+        self.assertEqual(data['total_income'], sum(t.amount for t in qs if t.type == Transaction.INCOME))
+        self.assertEqual(data['total_expense'], sum(t.amount for t in qs if t.type == Transaction.EXPENSE))
+        self.assertEqual(data['balance'], data['total_income'] - data['total_expense'])
+
+        for key, period in (('weekly', 'week'), ('monthly', 'month'), ('yearly', 'year')):
+            self.assertEqual(normalize(data[key]), normalize(get_time_stats(qs, period)))
+
+        self.assertEqual([list(item) for item in data['by_category']], [['Food'], ['Rent']])
+        for item, category in zip(data['by_category'], (self.food, self.rent)):
+            periods = item[category.name]
+            self.assertEqual(normalize(periods['weekly']), normalize(get_time_stats(qs, 'week', category)))
+            self.assertEqual(normalize(periods['monthly']), normalize(get_time_stats(qs, 'month', category)))
+            self.assertEqual(normalize(periods['yearly']), normalize(get_time_stats(qs, 'year', category)))
+
+        totals = {}
+        for t in qs.filter(type=Transaction.EXPENSE):
+            totals[t.date] = totals.get(t.date, 0) + t.amount
+        self.assertEqual(data['cheapest_day']['total'], min(totals.values()))
+        self.assertEqual(data['expensive_day']['total'], max(totals.values()))
+        self.assertEqual(len(data['daily']), qs.values('date').distinct().count())
+
+    def test_stats_respect_filters(self):
+        response = self.client.get('/api/transaction/stats/', {'type': 'expense', 'start_date': '2021-01-01'})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(response.data['total_income'])
+        self.assertEqual(
+            response.data['transaction_count'],
+            Transaction.objects.filter(owner=self.user, type=Transaction.EXPENSE, date__gte='2021-01-01').count()
+        )
+
+
+class DailyRollupTests(StatsTestMixin, TestCase):
+    def assertRollupsInSync(self):
+        self.assertEqual(verify_rollups(), [])
+
+    def test_rollups_follow_creates(self):
+        self.assertRollupsInSync()
+        self.assertEqual(
+            sum(DailyRollup.objects.filter(owner=self.user).values_list('count', flat=True)),
+            Transaction.objects.filter(owner=self.user).count()
+        )
+
+    def test_rollups_follow_updates_between_dates_and_categories(self):
+        transaction = Transaction.objects.filter(owner=self.user, category=self.food).first()
+
+        transaction.date = datetime.date(2022, 6, 1)
+        transaction.category = self.rent
+        transaction.amount = Decimal('12.34')
+        transaction.save()
+        self.assertRollupsInSync()
+
+        transaction.type = Transaction.INCOME if transaction.type == Transaction.EXPENSE else Transaction.EXPENSE
+        transaction.category = None
+        transaction.save()
+        self.assertRollupsInSync()
+
+    def test_rollups_follow_deletes(self):
+        Transaction.objects.filter(owner=self.user).first().delete()
+        self.assertRollupsInSync()
+
+        self.client.delete(f'/api/transaction/{Transaction.objects.filter(owner=self.user).last().pk}/')
+        self.assertRollupsInSync()
+
+    def test_category_delete_moves_rollups_to_uncategorized(self):
+        food_id = self.food.pk
+        self.food.delete()
+
+        self.assertRollupsInSync()
+        self.assertFalse(DailyRollup.objects.filter(category_id=food_id).exists())
+
+    def test_rebuild_command_repairs_drift(self):
+        Transaction.objects.filter(owner=self.user, type=Transaction.INCOME).update(amount=Decimal('1.00'))
+
+        with self.assertRaises(CommandError):
+            call_command('rebuild_rollups', '--verify', stdout=StringIO())
+
+        call_command('rebuild_rollups', stdout=StringIO())
+        self.assertRollupsInSync()
+
+    def test_stats_endpoints_read_rollups(self):
+        response = self.client.get('/api/stats/time/', {'period': 'month'})
+        self.assertEqual(
+            normalize(response.data['month']),
+            normalize(get_time_stats(Transaction.objects.filter(owner=self.user), 'month'))
+        )
+
+        response = self.client.get('/api/stats/overview/')
+        self.assertEqual(response.data['transaction_count'], Transaction.objects.filter(owner=self.user).count())
+
+        rollup_stats = self.client.get('/api/transaction/stats/').data
+        raw_stats = build_stats(Transaction.objects.filter(owner=self.user))
+        self.assertEqual(rollup_stats, raw_stats)
+
+
+class StatsCacheTests(StatsTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        stats_cache.cache.clear()
+        stats_cache.reset_info()
+
+    def test_repeated_requests_are_served_from_cache(self):
+        first = self.client.get('/api/transaction/stats/', {'type': 'expense'})
+
+        with self.assertNumQueries(1):
+            second = self.client.get('/api/transaction/stats/', {'type': 'expense', 'unused': '1'})
+
+        self.assertEqual(first.data, second.data)
+        self.assertEqual(stats_cache.info()['hits'], 1)
+        self.assertEqual(stats_cache.info()['misses'], 1)
+
+    def test_filters_are_normalized_into_the_key(self):
+        self.client.get('/api/transaction/stats/', {'start_date': '2021-1-1', 'type': 'income'})
+
+        with self.assertNumQueries(1):
+            self.client.get('/api/transaction/stats/', {'type': 'income', 'start_date': '2021-01-01'})
+
+        self.client.get('/api/transaction/stats/', {'type': 'expense', 'start_date': '2021-01-01'})
+        self.assertEqual(stats_cache.info()['misses'], 2)
+
+    def test_writes_invalidate_the_owner_entries(self):
+        before = self.client.get('/api/stats/overview/').data
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Transaction.objects.create(owner=self.user, amount=Decimal('10.00'), type=Transaction.INCOME, date=datetime.date(2021, 5, 5))
+        after = self.client.get('/api/stats/overview/').data
+        self.assertEqual(after['transaction_count'], before['transaction_count'] + 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Category.objects.create(name='Travel', owner=self.user)
+        self.client.get('/api/stats/overview/')
+        self.assertEqual(stats_cache.info()['hits'], 0)
+
+    def test_versions_are_bumped_once_the_write_commits(self):
+        version = stats_cache.get_version(self.user.pk)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Transaction.objects.create(owner=self.user, amount=Decimal('10.00'), type=Transaction.INCOME, date=datetime.date(2021, 5, 5))
+            # A reader inside the write's window still uses the old version
+            self.assertEqual(stats_cache.get_version(self.user.pk), version)
+        self.assertNotEqual(stats_cache.get_version(self.user.pk), version)
+
+    def test_other_users_writes_keep_entries(self):
+        self.client.get('/api/stats/time/', {'period': 'month'})
+        Transaction.objects.create(owner=self.other, amount=Decimal('1.00'), type=Transaction.INCOME, date=datetime.date(2021, 5, 5))
+
+        with self.assertNumQueries(1):
+            self.client.get('/api/stats/time/', {'period': 'Month'})
+
+    @override_settings(STATS_CACHE={'ALIAS': 'stats', 'MAX_ENTRY_SIZE': 100})
+    def test_oversized_payloads_are_not_stored(self):
+        self.client.get('/api/transaction/stats/')
+        self.client.get('/api/transaction/stats/')
+
+        self.assertEqual(stats_cache.info()['oversized'], 2)
+        self.assertEqual(stats_cache.info()['hits'], 0)
+
+
+class QueryPlanTests(StatsTestMixin, TestCase):
+    # Runs EXPLAIN QUERY PLAN on every query the hot endpoints issue and
+    # fails when SQLite would read a whole table instead of an index range
+    urls = [
+        '/api/transaction/',
+        '/api/transaction/?ordering=-date',
+        '/api/transaction/?ordering=amount',
+        '/api/transaction/?type=expense',
+        '/api/transaction/?category={food}',
+        '/api/transaction/?start_date=2021-01-01&end_date=2021-01-31',
+        '/api/transaction/?type=income&min_amount=20&max_amount=50',
+        '/api/transaction/stats/',
+        '/api/transaction/stats/?type=expense&start_date=2021-01-01',
+        '/api/transaction/stats/?category={food}',
+        '/api/transaction/stats/?min_amount=20',
+        '/api/stats/overview/',
+        '/api/stats/categories/',
+        '/api/stats/time/?period=day',
+        '/api/stats/extreme_day/?period=week',
+    ]
+
+    def setUp(self):
+        super().setUp()
+        stats_cache.cache.clear()
+
+    def explain(self, sql):
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+            return [row[-1] for row in cursor.fetchall()]
+
+    def test_hot_paths_use_indexes(self):
+        for url in self.urls:
+            url = url.format(food=self.food.pk)
+
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200, url)
+
+            for query in queries.captured_queries:
+                for step in self.explain(query['sql']):
+                    with self.subTest(url=url, step=step):
+                        self.assertIsNone(re.match(r'SCAN (expenses|accounts)_\w+', step), query['sql'])
+
+    def test_cursor_pages_use_indexes(self):
+        next_url = self.client.get('/api/transaction/', {'page_size': 5}).data['next']
+
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(next_url)
+
+        plan = self.explain(queries.captured_queries[0]['sql'])
+        self.assertTrue(all(re.match(r'SCAN (expenses|accounts)_\w+', step) is None for step in plan), plan)
+
+    def test_default_ordering_is_served_by_the_index(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get('/api/transaction/')
+
+        plan = ' / '.join(step for query in queries.captured_queries for step in self.explain(query['sql']))
+        self.assertIn('transaction_owner_date_idx', plan)
+        self.assertNotIn('TEMP B-TREE FOR ORDER BY', plan)
+
+
+class KeysetPaginationTests(StatsTestMixin, TestCase):
+    def collect(self, params, direction='next'):
+        ids, pages = [], 0
+        response = self.client.get('/api/transaction/', params)
+        while True:
+            self.assertEqual(response.status_code, 200)
+            ids.extend(item['id'] for item in response.data['results'])
+            pages += 1
+            if not response.data[direction]:
+                return ids, pages
+            response = self.client.get(response.data[direction])
+
+    def test_pages_follow_the_ordering_without_gaps(self):
+        for ordering in ('-date', 'date', 'amount', '-amount'):
+            with self.subTest(ordering=ordering):
+                ids, pages = self.collect({'page_size': 7, 'ordering': ordering})
+                field = ordering.lstrip('-')
+                tiebreaker = '-id' if ordering.startswith('-') else 'id'
+                expected = list(
+                    Transaction.objects.filter(owner=self.user).order_by(ordering, tiebreaker).values_list('id', flat=True)
+                )
+
+                self.assertEqual(ids, expected, field)
+                self.assertEqual(pages, 9)
+
+    def test_previous_links_walk_back(self):
+        response = self.client.get('/api/transaction/', {'page_size': 10})
+        first_page = [item['id'] for item in response.data['results']]
+        self.assertIsNone(response.data['previous'])
+
+        second = self.client.get(response.data['next'])
+        back = self.client.get(second.data['previous'])
+
+        self.assertEqual([item['id'] for item in back.data['results']], first_page)
+
+    def test_filters_and_page_size_cap(self):
+        response = self.client.get('/api/transaction/', {'type': 'income', 'page_size': 10000})
+
+        self.assertEqual(len(response.data['results']), Transaction.objects.filter(owner=self.user, type='income').count())
+        self.assertIsNone(response.data['next'])
+        self.assertEqual(KeysetPagination().get_page_size(type('Request', (), {'query_params': {'page_size': '10000'}})), 500)
+
+    def test_deep_pages_cost_the_same_query(self):
+        response = self.client.get('/api/transaction/', {'page_size': 5})
+        for _ in range(5):
+            response = self.client.get(response.data['next'])
+
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(response.data['next'])
+
+        self.assertNotIn('OFFSET', queries.captured_queries[0]['sql'])
+
+    def test_invalid_cursor(self):
+        self.assertEqual(self.client.get('/api/transaction/', {'cursor': 'garbage'}).status_code, 404)
+
+
+class TransactionImportTests(StatsTestMixin, TestCase):
+    def test_csv_upload(self):
+        upload = SimpleUploadedFile('bank.csv', (
+            'date,amount,type,category,description\n'
+            '2021-02-01,12.50,expense,Food,"Lunch, with ""friends"""\n'
+            '2021-02-02,100.00,income,Salary,Bonus\n'
+            '2021-02-03,oops,expense,Food,Broken\n'
+            '2021-02-04,7.25,expense,,Uncategorized\n'
+        ).encode())
+
+        response = self.client.post('/api/transaction/import/', {'file': upload}, format='multipart')
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['created'], 3)
+        self.assertEqual(response.data['failed'], 1)
+        self.assertEqual(response.data['errors'][0]['row'], 4)
+        self.assertIn('amount', response.data['errors'][0]['errors'])
+
+        self.assertEqual(Category.objects.filter(owner=self.user, name='Food').count(), 1)
+        self.assertTrue(Category.objects.filter(owner=self.user, name='Salary').exists())
+        self.assertTrue(Transaction.objects.filter(owner=self.user, description='Lunch, with "friends"', category=self.food).exists())
+        self.assertEqual(verify_rollups(), [])
+
+    def test_ndjson_body_in_batches(self):
+        lines = [
+            json.dumps({'date': f'2021-03-{i % 28 + 1:02d}', 'amount': f'{i}.10', 'type': 'expense', 'category': 'Rent'})
+            for i in range(1, 1201)
+        ]
+        lines.insert(10, '{not json')
+        before = Transaction.objects.filter(owner=self.user).count()
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.generic(
+                'POST', '/api/transaction/import/', '\n'.join(lines).encode(), content_type='application/x-ndjson'
+            )
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['created'], 1200)
+        self.assertEqual(response.data['errors'], [{'row': 11, 'errors': {'non_field_errors': [ANY]}}])
+        self.assertEqual(Transaction.objects.filter(owner=self.user).count(), before + 1200)
+        self.assertLess(len(queries), len(lines) // 2)
+        self.assertEqual(verify_rollups(), [])
+
+    def test_unsupported_format(self):
+        response = self.client.generic('POST', '/api/transaction/import/', b'a;b', content_type='text/plain')
+        self.assertEqual(response.status_code, 400)
+
+
+class TransactionExportTests(StatsTestMixin, TestCase):
+    def test_csv_export_honours_filters_and_ordering(self):
+        response = self.client.get('/api/transaction/export/', {'type': 'income', 'ordering': 'amount'})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        rows = list(csv.reader(StringIO(b''.join(response.streaming_content).decode())))
+
+        expected = Transaction.objects.filter(owner=self.user, type='income').order_by('amount')
+        self.assertEqual(rows[0], ['id', 'date', 'type', 'amount', 'category', 'description', 'create_at'])
+        self.assertEqual([int(row[0]) for row in rows[1:]], [t.pk for t in expected])
+        self.assertEqual(rows[1][4], str(expected[0].category or ''))
+
+    def test_ndjson_export_matches_the_api_representation(self):
+        response = self.client.get('/api/transaction/export/', {'format': 'ndjson', 'category': self.food.pk})
+
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        listed = self.client.get('/api/transaction/', {'category': self.food.pk, 'page_size': 500}).data['results']
+
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson; charset=utf-8')
+        self.assertEqual(len(lines), len(listed))
+        for line, item in zip(lines, listed):
+            row = json.loads(line)
+            self.assertEqual(row, {key: item[key] for key in row})
+
+    def test_export_does_not_query_per_row(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/transaction/export/')
+            b''.join(response.streaming_content)
+
+        self.assertEqual(len(queries), 1)
+        self.assertIn('JOIN "expenses_category"', queries.captured_queries[0]['sql'])
+
+
+@skipUnless(numpy, 'numpy is not installed')
+class NumpyStatsBackendTests(StatsTestMixin, TestCase):
+    def test_results_are_identical_to_the_orm_backend(self):
+        orm, vectorized = get_stats_backend('orm'), get_stats_backend('numpy')
+        querysets = [
+            Transaction.objects.filter(owner=self.user),
+            Transaction.objects.filter(owner=self.user, type=Transaction.EXPENSE),
+            Transaction.objects.filter(owner=self.user, amount__gte=40),
+            Transaction.objects.none(),
+            DailyRollup.objects.filter(owner=self.user),
+            DailyRollup.objects.filter(owner=self.user, category=self.rent),
+        ]
+
+        for qs in querysets:
+            with self.subTest(query=str(qs.query) if qs.exists() else 'empty'):
+                self.assertEqual(vectorized(qs), orm(qs))
+
+    @override_settings(EXPENSES_STATS_BACKEND='numpy')
+    def test_backend_is_selected_by_setting(self):
+        response = self.client.get('/api/transaction/stats/', {'min_amount': 30})
+
+        self.assertEqual(response.data, build_stats(Transaction.objects.filter(owner=self.user, amount__gte=30)))
+
+    def test_benchmark_command(self):
+        out = StringIO()
+        call_command('benchmark_stats', '--user', self.user.email, '--repeat', '1', '--source', 'rollups', stdout=out)
+
+        self.assertIn('all backends agree', out.getvalue())
+
+
+class BenchmarkTests(TestCase):
+    def test_generator_is_deterministic(self):
+        first = generate_dataset(300, users=2, categories=4, seed=7)
+        snapshot = list(Transaction.objects.filter(owner__in=first).values_list('amount', 'type', 'date', 'category__name'))
+
+        second = generate_dataset(300, users=2, categories=4, seed=7)
+
+        self.assertEqual([user.email for user in first], [user.email for user in second])
+        self.assertEqual(
+            list(Transaction.objects.filter(owner__in=second).values_list('amount', 'type', 'date', 'category__name')),
+            snapshot
+        )
+        self.assertEqual(Transaction.objects.count(), 300)
+        self.assertEqual(verify_rollups(), [])
+
+    def test_runner_covers_every_endpoint(self):
+        call_command('generate_synthetic_data', '--transactions', '200', '--seed', '3', stdout=StringIO())
+        user = User.objects.get(email=synthetic_email(3, 0))
+
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, 'results.json')
+            call_command('run_benchmarks', '--user', user.email, '--iterations', '2', '--output', output, stdout=StringIO())
+            with open(output) as f:
+                results = json.load(f)
+
+            call_command(
+                'run_benchmarks', '--user', user.email, '--iterations', '1', '--baseline', output,
+                '--threshold', '1000', stdout=StringIO()
+            )
+
+        names = {name.split('[')[0] for name in results['endpoints']}
+        self.assertEqual(names, set(discover_endpoints()))
+        self.assertIn('transaction-stats', names)
+        self.assertIn('stats-time[period=week]', results['endpoints'])
+        for result in results['endpoints'].values():
+            self.assertGreater(result['peak_memory_bytes'], 0)
+            self.assertLessEqual(result['latency_ms']['p50'], result['latency_ms']['max'])
+
+
+@override_settings(PROFILING={'ENABLED': True, 'SAMPLE_RATE': 1.0})
+class ProfilingMiddlewareTests(StatsTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        registry.reset()
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(self.user)}')
+
+    def test_server_timing_header(self):
+        response = self.client.get('/api/transaction/stats/', {'min_amount': 1})
+
+        timings = {
+            part.split(';')[0]: part for part in response['Server-Timing'].split(', ')
+        }
+        self.assertEqual(set(timings), {'auth', 'db', 'view', 'render', 'total'})
+        self.assertRegex(timings['db'], r'db;dur=[\d.]+;desc="3 queries"')
+        self.assertRegex(timings['auth'], r'auth;dur=[\d.]+')
+
+    def test_metrics_are_aggregated_per_endpoint(self):
+        for _ in range(3):
+            self.client.get('/api/stats/overview/')
+        self.client.get('/api/transaction/')
+
+        snapshot = registry.snapshot()
+        self.assertEqual(snapshot['stats-overview']['total']['count'], 3)
+        self.assertEqual(snapshot['transaction-list']['total']['count'], 1)
+        self.assertEqual(sum(snapshot['stats-overview']['queries']['buckets'].values()), 3)
+
+    def test_unresolved_paths_share_one_entry(self):
+        for i in range(3):
+            self.client.get(f'/api/no-such-endpoint-{i}/')
+
+        self.assertEqual(list(registry.snapshot()), ['<unmatched>'])
+        self.assertEqual(registry.snapshot()['<unmatched>']['total']['count'], 3)
+
+    @override_settings(PROFILING={'ENABLED': True, 'SAMPLE_RATE': 0})
+    def test_unsampled_requests_are_not_profiled(self):
+        response = self.client.get('/api/stats/overview/')
+
+        self.assertNotIn('Server-Timing', response)
+        self.assertEqual(registry.snapshot(), {})
+
+    @override_settings(PROFILING={'ENABLED': False})
+    def test_disabled_by_default(self):
+        self.assertNotIn('Server-Timing', self.client.get('/api/stats/overview/'))
+
+
+class CategoryCubeTests(StatsTestMixin, TestCase):
+    def test_categories_match_per_category_aggregations(self):
+        response = self.client.get('/api/stats/categories/')
+        qs = Transaction.objects.filter(owner=self.user)
+
+        self.assertEqual(list(response.data), ['Food', 'Rent'])
+        for category in (self.food, self.rent):
+            entry, = response.data[category.name]
+            self.assertEqual(entry['income'], sum(t.amount for t in qs.filter(category=category, type=Transaction.INCOME)))
+            self.assertEqual(entry['net'], entry['income'] - entry['expense'])
+            for key, period in (('daily', 'day'), ('weekly', 'week'), ('monthly', 'month'), ('yearly', 'year')):
+                self.assertEqual(normalize(entry[key]), normalize(get_time_stats(qs, period, category)))
+
+    def test_categories_use_a_fixed_number_of_queries(self):
+        with self.assertNumQueries(2):
+            self.client.get('/api/stats/categories/')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            for i in range(5):
+                Transaction.objects.create(
+                    owner=self.user, amount=Decimal('5.00'), type=Transaction.EXPENSE,
+                    category=Category.objects.create(name=f'Extra {i}', owner=self.user),
+                    date=datetime.date(2021, 3, i + 1),
+                )
+
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/stats/categories/')
+        self.assertEqual(len(response.data), 7)
+
+    def test_cube_cells_add_up_to_the_totals(self):
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/stats/cube/')
+
+        data = response.data
+        self.assertEqual(data['dimensions']['period'], ['year', 'month', 'week', 'day'])
+        self.assertEqual(
+            [category['name'] for category in data['dimensions']['category']], [None, 'Food', 'Rent']
+        )
+
+        qs = Transaction.objects.filter(owner=self.user)
+        period = data['dimensions']['period'].index('month')
+        for index, category in enumerate(data['dimensions']['category']):
+            cells = [row for row in data['rows'] if row[0] == index and row[1] == period]
+            expected = qs.filter(category_id=category['id'], type=Transaction.EXPENSE)
+            self.assertEqual(sum(row[4] for row in cells), sum(t.amount for t in expected))
+
+        buckets = data['dimensions']['buckets']['month']
+        self.assertEqual(buckets, sorted(buckets))
+        self.assertEqual(data['dimensions']['bucket_fields']['month'], ['year', 'month'])
+
+    def test_cube_selection_and_filters(self):
+        response = self.client.get('/api/stats/cube/', {
+            'periods': 'Year,month', 'categories': f'{self.rent.pk}', 'type': 'income', 'start_date': '2021-01-01'
+        })
+
+        data = response.data
+        self.assertEqual(data['dimensions']['period'], ['year', 'month'])
+        self.assertEqual(data['dimensions']['category'], [{'id': self.rent.pk, 'name': 'Rent'}])
+
+        expected = Transaction.objects.filter(
+            owner=self.user, category=self.rent, type=Transaction.INCOME, date__gte='2021-01-01'
+        )
+        year_rows = [row for row in data['rows'] if row[1] == 0]
+        self.assertEqual(sum(row[3] for row in year_rows), sum(t.amount for t in expected))
+        self.assertTrue(all(row[4] == 0 for row in data['rows']))
+
+    def test_cube_applies_amount_filters_and_search(self):
+        expected = Transaction.objects.filter(owner=self.user, type=Transaction.EXPENSE, amount__gte=50)
+        data = self.client.get('/api/stats/cube/', {'periods': 'year', 'min_amount': 50}).data
+        self.assertEqual(sum(row[4] for row in data['rows']), sum(t.amount for t in expected))
+
+        full = self.client.get('/api/stats/cube/', {'periods': 'year'}).data
+        self.assertNotEqual(data['rows'], full['rows'])
+        self.assertEqual(self.client.get('/api/stats/cube/', {'q': 'nothing matches this'}).data['rows'], [])
+
+    def test_cube_rejects_invalid_options(self):
+        self.assertEqual(self.client.get('/api/stats/cube/', {'periods': 'decade'}).status_code, 400)
+        self.assertEqual(self.client.get('/api/stats/cube/', {'categories': 'food'}).status_code, 400)
+
+
+class ConditionalGetTests(StatsTestMixin, TestCase):
+    endpoints = [
+        ('/api/transaction/', {}),
+        ('/api/transaction/stats/', {'type': 'expense'}),
+        ('/api/stats/overview/', {}),
+        ('/api/stats/categories/', {}),
+        ('/api/stats/cube/', {'periods': 'month'}),
+        ('/api/stats/time/', {'period': 'week'}),
+        ('/api/stats/extreme_day/', {'period': 'month'}),
+    ]
+
+    def test_unchanged_data_is_answered_with_304_with_one_query(self):
+        for url, params in self.endpoints:
+            response = self.client.get(url, params)
+            self.assertEqual(response.status_code, 200)
+            self.assertIn('Last-Modified', response)
+            # Drop the cached payloads; a 304 must not depend on them
+            stats_cache.bump_version(self.user.pk)
+
+            # Only the change marker is read
+            with self.assertNumQueries(1):
+                revalidated = self.client.get(url, params, HTTP_IF_NONE_MATCH=response['ETag'])
+            self.assertEqual(revalidated.status_code, 304)
+            self.assertEqual(revalidated['ETag'], response['ETag'])
+
+            since = self.client.get(url, params, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+            self.assertEqual(since.status_code, 304)
+
+    def test_writes_change_the_validators(self):
+        etag = self.client.get('/api/stats/overview/')['ETag']
+
+        Transaction.objects.create(owner=self.other, amount=Decimal('1.00'), type=Transaction.INCOME, date=datetime.date(2021, 5, 5))
+        self.assertEqual(self.client.get('/api/stats/overview/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        Category.objects.create(name='Travel', owner=self.user)
+        response = self.client.get('/api/stats/overview/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_rolled_back_writes_keep_the_validators(self):
+        etag = self.client.get('/api/stats/overview/')['ETag']
+
+        with self.assertRaises(IntegrityError):
+            with transaction.atomic():
+                Transaction.objects.create(owner=self.user, amount=Decimal('1.00'), type=Transaction.INCOME, date=datetime.date(2021, 5, 5))
+                raise IntegrityError('rolled back')
+        self.assertEqual(self.client.get('/api/stats/overview/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+    def test_validators_depend_on_the_query(self):
+        first = self.client.get('/api/transaction/', {'type': 'income'})
+        second = self.client.get('/api/transaction/', {'type': 'expense'})
+
+        self.assertNotEqual(first['ETag'], second['ETag'])
+        self.assertEqual(self.client.get('/api/transaction/', {'type': 'expense'}, HTTP_IF_NONE_MATCH=first['ETag']).status_code, 200)
+
+
+class DeltaSyncTests(StatsTestMixin, TestCase):
+    def sync(self, cursor=None, **params):
+        if cursor:
+            params['cursor'] = cursor
+        response = self.client.get('/api/sync/', params)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def sync_all(self, cursor=None, limit=25):
+        pages = []
+        while True:
+            data = self.sync(cursor, limit=limit)
+            pages.append(data)
+            cursor = data['cursor']
+            if not data['has_more']:
+                return pages, cursor
+
+    def test_initial_sync_pages_through_everything(self):
+        pages, cursor = self.sync_all()
+
+        transactions = [item for page in pages for item in page['transactions']]
+        categories = [item for page in pages for item in page['categories']]
+        self.assertEqual(len(pages), 3)
+        self.assertEqual(sorted(t['id'] for t in transactions), sorted(Transaction.objects.filter(owner=self.user).values_list('id', flat=True)))
+        self.assertEqual({c['name'] for c in categories}, {'Food', 'Rent'})
+        self.assertEqual(transactions[0]['category_id'], Transaction.objects.get(pk=transactions[0]['id']).category_id)
+
+        data = self.sync(cursor)
+        self.assertEqual((data['transactions'], data['categories'], data['has_more']), ([], [], False))
+        self.assertEqual(data['cursor'], cursor)
+
+    def test_changes_since_cursor(self):
+        _, cursor = self.sync_all()
+
+        changed = Transaction.objects.filter(owner=self.user).first()
+        changed.amount = Decimal('1.23')
+        changed.save()
+        removed = Transaction.objects.filter(owner=self.user).last()
+        removed_id = removed.pk
+        removed.delete()
+        created = Transaction.objects.create(owner=self.user, amount=Decimal('4.00'), type=Transaction.INCOME, date=datetime.date(2021, 6, 1))
+        Transaction.objects.create(owner=self.other, amount=Decimal('4.00'), type=Transaction.INCOME, date=datetime.date(2021, 6, 1))
+
+        # The pruning watermark plus one range read per kind
+        with self.assertNumQueries(4):
+            data = self.sync(cursor)
+
+        self.assertEqual([t['id'] for t in data['transactions']], [changed.pk, created.pk])
+        self.assertEqual(data['transactions'][0]['amount'], '1.23')
+        self.assertEqual(data['deleted'], {'categories': [], 'transactions': [removed_id]})
+
+    def test_category_delete_resyncs_its_transactions(self):
+        _, cursor = self.sync_all()
+        food_id = self.food.pk
+        orphaned = set(Transaction.objects.filter(category=self.food).values_list('id', flat=True))
+
+        self.food.delete()
+        data = self.sync(cursor)
+
+        self.assertEqual(data['deleted']['categories'], [food_id])
+        self.assertEqual({t['id'] for t in data['transactions']}, orphaned)
+        self.assertTrue(all(t['category_id'] is None for t in data['transactions']))
+
+    def test_imported_batches_are_synced(self):
+        _, cursor = self.sync_all()
+        upload = SimpleUploadedFile('rows.csv', b'amount,type,date,category\n5.00,expense,2021-02-01,Travel\n6.00,income,2021-02-02,\n')
+        self.client.post('/api/transaction/import/', {'file': upload}, format='multipart')
+
+        data = self.sync(cursor)
+        self.assertEqual(len(data['transactions']), 2)
+        self.assertEqual([c['name'] for c in data['categories']], ['Travel'])
+
+    def test_pruned_tombstones_expire_older_cursors(self):
+        _, cursor = self.sync_all()
+        Transaction.objects.filter(owner=self.user).first().delete()
+        _, recent = self.sync_all(cursor)
+
+        call_command('prune_tombstones', days=0, stdout=StringIO())
+
+        self.assertEqual(self.client.get('/api/sync/', {'cursor': cursor}).status_code, 410)
+        self.assertEqual(self.client.get('/api/sync/', {'cursor': recent}).status_code, 200)
+        self.assertEqual(self.client.get('/api/sync/').status_code, 200)
+
+    def test_invalid_parameters(self):
+        self.assertEqual(self.client.get('/api/sync/', {'cursor': 'garbage'}).status_code, 400)
+        self.assertEqual(self.client.get('/api/sync/', {'limit': 'all'}).status_code, 400)
+
+
+class FastListTests(StatsTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        for description in ('café ☕', 'line\u2028separator\u2029', 'quote " and \\ backslash', ''):
+            Transaction.objects.create(
+                owner=self.user, amount=Decimal('12345678.90'), type=Transaction.EXPENSE,
+                category=self.food if description else None, date=datetime.date(2021, 6, 1), description=description,
+            )
+
+    def expected_content(self, response, queryset):
+        data = {
+            'next': response.data['next'],
+            'previous': response.data['previous'],
+            'results': TransactionSerializer(queryset, many=True).data,
+        }
+        return JSONRenderer().render(data, 'application/json', {'request': response.wsgi_request})
+
+    def assertListMatchesSerializer(self, params, queryset):
+        response = self.client.get('/api/transaction/', params, HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, self.expected_content(response, queryset))
+
+    def test_output_matches_the_model_serializer_byte_for_byte(self):
+        qs = Transaction.objects.filter(owner=self.user)
+        self.assertListMatchesSerializer({'page_size': 500}, qs.order_by('-date', '-id'))
+        self.assertListMatchesSerializer({'page_size': 7, 'ordering': 'amount'}, qs.order_by('amount', 'id')[:7])
+        self.assertListMatchesSerializer({'type': 'income'}, qs.filter(type='income').order_by('-date', '-id'))
+
+    @skipUnless(renderers.orjson, 'orjson is not installed')
+    def test_standard_encoder_gives_the_same_bytes(self):
+        fast = self.client.get('/api/transaction/', {'page_size': 500}, HTTP_ACCEPT='application/json').content
+
+        with mock.patch.object(renderers, 'orjson', None):
+            standard = self.client.get('/api/transaction/', {'page_size': 500}, HTTP_ACCEPT='application/json').content
+
+        self.assertEqual(fast, standard)
+        self.assertIn(b'\\u2028', fast)
+
+    def test_query_count_does_not_depend_on_page_size(self):
+        counts = []
+        for page_size in (5, 60):
+            with CaptureQueriesContext(connection) as queries:
+                self.client.get('/api/transaction/', {'page_size': page_size})
+            counts.append(len(queries))
+
+        self.assertEqual(counts, [2, 2])
+
+
+class BalanceSeriesTests(StatsTestMixin, TestCase):
+    def expected_balance(self, date):
+        return sum(
+            (t.amount if t.type == Transaction.INCOME else -t.amount)
+            for t in Transaction.objects.filter(owner=self.user, date__lte=date)
+        )
+
+    def assertSeriesCorrect(self, params):
+        response = self.client.get('/api/stats/balance/', params)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.data['results'])
+        for point in response.data['results']:
+            self.assertEqual(point['balance'], self.expected_balance(point['date']), point)
+        return response.data
+
+    def test_series_match_the_running_sum(self):
+        data = self.assertSeriesCorrect({})
+        self.assertEqual(data['start_date'], datetime.date(2020, 12, 25))
+        self.assertEqual(len(data['results']), (data['end_date'] - data['start_date']).days + 1)
+
+        for period in ('day', 'week', 'month', 'year'):
+            self.assertSeriesCorrect({'period': period, 'start_date': '2021-01-10', 'end_date': '2021-02-03'})
+            self.assertSeriesCorrect({'period': period, 'start_date': '2020-11-15', 'end_date': '2021-03-31'})
+
+        weeks = self.assertSeriesCorrect({'period': 'week', 'start_date': '2020-12-20', 'end_date': '2021-01-20'})['results']
+        self.assertEqual([(p['year'], p['week']) for p in weeks[:3]], [(2020, 51), (2020, 52), (2020, 53)])
+
+    def test_checkpoints_follow_writes(self):
+        moved = Transaction.objects.filter(owner=self.user, date__month=1).first()
+        moved.date = datetime.date(2020, 11, 3)
+        moved.type = Transaction.INCOME if moved.type == Transaction.EXPENSE else Transaction.EXPENSE
+        moved.save()
+        Transaction.objects.filter(owner=self.user, date__month=12).first().delete()
+
+        upload = SimpleUploadedFile('rows.csv', b'amount,type,date\n5.00,expense,2020-10-01\n7.50,income,2021-05-02\n')
+        self.client.post('/api/transaction/import/', {'file': upload}, format='multipart')
+
+        self.assertEqual(verify_balances(), [])
+        self.assertSeriesCorrect({'period': 'month'})
+        self.assertSeriesCorrect({'start_date': '2021-01-01'})
+
+    def test_query_count_does_not_depend_on_history_or_range(self):
+        for period, start, end in (('day', '2021-02-01', '2021-02-03'), ('month', '2021-01-01', '2021-02-15')):
+            with self.assertNumQueries(5 if period == 'month' else 4):
+                self.client.get('/api/stats/balance/', {'period': period, 'start_date': start, 'end_date': end})
+
+        with self.assertNumQueries(5):
+            response = self.client.get('/api/stats/balance/', {'period': 'month', 'start_date': '2015-01-01', 'end_date': '2030-12-31'})
+        self.assertEqual(len(response.data['results']), 16 * 12)
+
+    def test_series_size_is_bounded(self):
+        huge = {'start_date': '0001-01-01', 'end_date': '9998-12-31'}
+        for period in ('day', 'week', 'month'):
+            self.assertEqual(self.client.get('/api/stats/balance/', {'period': period, **huge}).status_code, 400)
+        self.assertEqual(self.client.get('/api/stats/balance/', {'max_points': 10 ** 6, **huge}).status_code, 400)
+
+        self.assertEqual(self.client.get('/api/stats/balance/', {'period': 'year', **huge}).status_code, 400)
+        years = self.client.get('/api/stats/balance/', {'period': 'year', 'start_date': '1001-01-01', 'end_date': '4000-12-31'})
+        self.assertEqual(len(years.data['results']), 3000)
+        limited = self.client.get('/api/stats/balance/', {'max_points': 100, **huge}).data
+        self.assertEqual((limited['period'], len(limited['results'])), ('year', 100))
+
+    def test_ranges_at_the_calendar_edges(self):
+        for period in ('day', 'week', 'month', 'year'):
+            first = self.client.get('/api/stats/balance/', {'period': period, 'start_date': '0001-01-01', 'end_date': '0001-01-20'})
+            self.assertEqual(first.status_code, 200)
+            self.assertEqual(first.data['results'][-1]['balance'], 0)
+
+            self.assertSeriesCorrect({'period': period, 'start_date': '9999-12-01', 'end_date': '9999-12-31'})
+
+    def test_invalid_parameters(self):
+        self.assertEqual(self.client.get('/api/stats/balance/', {'period': 'decade'}).status_code, 400)
+        self.assertEqual(self.client.get('/api/stats/balance/', {'start_date': '2021-13-01'}).status_code, 400)
+        self.assertEqual(
+            self.client.get('/api/stats/balance/', {'start_date': '2021-02-01', 'end_date': '2021-01-01'}).status_code, 400
+        )
+
+
+class BalanceMigrationTests(TransactionTestCase):
+    migrate_from = [('expenses', '0005_sync')]
+
+    def tearDown(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes())
+
+    def test_existing_transactions_get_checkpoints(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.migrate_from)
+
+        user = User.objects.create_user(email='history@example.com', username='history', password='password123')
+        OldTransaction = executor.loader.project_state(self.migrate_from).apps.get_model('expenses', 'Transaction')
+        for i in range(10):
+            OldTransaction.objects.create(
+                owner_id=user.pk, amount=Decimal(10 + i), type='income' if i % 3 == 0 else 'expense',
+                date=datetime.date(2021, 1 + i % 5, 1 + i)
+            )
+
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes())
+
+        self.assertEqual(MonthlyBalance.objects.filter(owner=user).count(), 5)
+        self.assertEqual(verify_balances(), [])
+
+
+class ExtremesTests(StatsTestMixin, TestCase):
+    def expected_totals(self, qs, period):
+        return sorted(money(row['total']) for row in get_time_extreme_stats(qs.filter(type=Transaction.EXPENSE), period))
+
+    def test_top_and_bottom_buckets_for_every_period(self):
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/stats/extremes/', {'n': 3})
+
+        qs = Transaction.objects.filter(owner=self.user)
+        self.assertEqual(list(response.data['results']), ['year', 'month', 'week', 'day'])
+        for period, extremes in response.data['results'].items():
+            expected = self.expected_totals(qs, period)
+            self.assertEqual([entry['total'] for entry in extremes['bottom']], expected[:3])
+            self.assertEqual([entry['total'] for entry in extremes['top']], expected[::-1][:3])
+            self.assertEqual(list(extremes['top'][0]), list(PERIOD_CONFIG[period]['fields']) + ['total'])
+
+    def test_per_category_extremes(self):
+        response = self.client.get('/api/stats/extremes/', {'periods': 'month,week', 'n': 2, 'by_category': 'true'})
+
+        self.assertEqual([category['name'] for category in response.data['categories']], [None, 'Food', 'Rent'])
+        for category in response.data['categories']:
+            qs = Transaction.objects.filter(owner=self.user, category_id=category['id'])
+            self.assertEqual(list(category['results']), ['month', 'week'])
+            for period, extremes in category['results'].items():
+                self.assertEqual([entry['total'] for entry in extremes['top']], self.expected_totals(qs, period)[::-1][:2])
+
+    def test_filters_and_extreme_day_agree(self):
+        response = self.client.get('/api/stats/extremes/', {'periods': 'day', 'n': 1, 'type': 'income', 'start_date': '2021-01-01'})
+        expected = Transaction.objects.filter(owner=self.user, type=Transaction.INCOME, date__gte='2021-01-01')
+        self.assertEqual(response.data['results']['day']['top'][0]['total'], max(
+            sum(t.amount for t in expected if t.date == day) for day in expected.values_list('date', flat=True)
+        ))
+
+        extreme_day = self.client.get('/api/stats/extreme_day/', {'period': 'week'}).data['week']
+        extremes = self.client.get('/api/stats/extremes/', {'periods': 'week', 'n': 1}).data['results']['week']
+        self.assertEqual(extreme_day, {'cheapest': extremes['bottom'][0], 'expensive': extremes['top'][0]})
+
+    def test_amount_filters_use_the_transactions(self):
+        response = self.client.get('/api/stats/extremes/', {'periods': 'day', 'n': 1, 'max_amount': 20})
+        expected = Transaction.objects.filter(owner=self.user, type=Transaction.EXPENSE, amount__lte=20)
+        self.assertEqual(response.data['results']['day']['top'][0]['total'], max(
+            sum(t.amount for t in expected if t.date == day) for day in expected.values_list('date', flat=True)
+        ))
+
+    def test_invalid_parameters(self):
+        self.assertEqual(self.client.get('/api/stats/extremes/', {'periods': 'decade'}).status_code, 400)
+        self.assertEqual(self.client.get('/api/stats/extremes/', {'n': 0}).status_code, 400)
+        self.assertEqual(self.client.get('/api/stats/extremes/', {'n': 'ten'}).status_code, 400)
+
+
+class MaxPointsTests(StatsTestMixin, TestCase):
+    def test_time_series_pick_the_finest_resolution_that_fits(self):
+        qs = Transaction.objects.filter(owner=self.user)
+        active_days = qs.values('date').distinct().count()
+
+        for max_points, expected in ((active_days, 'day'), (10, 'week'), (3, 'month'), (2, 'year')):
+            data = self.client.get('/api/stats/time/', {'period': 'day', 'max_points': max_points}).data
+            self.assertEqual(data['period'], expected)
+            self.assertLessEqual(len(data[expected]), max_points)
+            self.assertEqual(normalize(data[expected]), normalize(get_time_stats(qs, expected)))
+
+        self.assertIn('day', self.client.get('/api/stats/time/', {'period': 'day'}).data)
+
+    def test_years_are_merged_beyond_the_coarsest_resolution(self):
+        days = {datetime.date(2015 + i, 6, 1): [Decimal(i), Decimal(1)] for i in range(5)}
+        resolution, series = resample(days, 'month', 2)
+
+        self.assertEqual(resolution, 'year')
+        self.assertEqual([(entry['year'], entry['income'], entry['expense']) for entry in series], [(2015, 3, 3), (2018, 7, 2)])
+
+    def test_stats_series_are_bounded(self):
+        full = self.client.get('/api/transaction/stats/').data
+        data = self.client.get('/api/transaction/stats/', {'max_points': 4}).data
+
+        self.assertEqual(data['resolution'], {'daily': 'month', 'weekly': 'month', 'monthly': 'month', 'yearly': 'year'})
+        self.assertEqual(data['monthly'], full['monthly'])
+        self.assertEqual(data['daily'], full['monthly'])
+        self.assertEqual(data['total_income'], full['total_income'])
+
+    def test_balance_series_are_bounded(self):
+        data = self.client.get('/api/stats/balance/', {'max_points': 10}).data
+        self.assertEqual(data['period'], 'week')
+        self.assertLessEqual(len(data['results']), 10)
+
+        transactions = Transaction.objects.filter(owner=self.user)
+        for point in data['results']:
+            expected = sum((t.amount if t.type == Transaction.INCOME else -t.amount) for t in transactions if t.date <= point['date'])
+            self.assertEqual(point['balance'], expected)
+
+        data = self.client.get('/api/stats/balance/', {'period': 'month', 'start_date': '2000-01-01', 'max_points': 12}).data
+        self.assertEqual(data['period'], 'year')
+        self.assertEqual(len(data['results']), 12)
+        self.assertEqual(data['results'][-1]['date'], data['end_date'])
+
+    def test_lttb_keeps_the_shape(self):
+        points = [(x, [0, 5, -3, 8, 2, 1, 9, -7, 4, 0, 3][x % 11]) for x in range(110)]
+        selected = lttb(points, 20, x=lambda point: point[0], y=lambda point: point[1])
+
+        self.assertEqual(len(selected), 20)
+        self.assertEqual((selected[0], selected[-1]), (points[0], points[-1]))
+        self.assertEqual(selected, sorted(selected))
+        self.assertEqual({point[1] for point in selected[1:-1]} & {9, -7}, {9, -7})
+
+    def test_invalid_max_points(self):
+        for url in ('/api/stats/time/?period=day', '/api/transaction/stats/?', '/api/stats/balance/?'):
+            self.assertEqual(self.client.get(url + '&max_points=1').status_code, 400)
+            self.assertEqual(self.client.get(url + '&max_points=many').status_code, 400)
+
+
+class AsyncStatsTests(StatsTestMixin, TransactionTestCase):
+    # The partitions are queried from pool threads on their own connections,
+    # which only see committed rows
+    def setUp(self):
+        super().setUp()
+        stats_cache.cache.clear()
+
+    def assertSameResponse(self, path, params):
+        stats_cache.cache.clear()
+        expected = self.client.get(path, params)
+        stats_cache.cache.clear()
+        response = self.client.get('/api/async' + path.removeprefix('/api'), params)
+
+        self.assertEqual(response.status_code, expected.status_code)
+        self.assertEqual(response.content, expected.content)
+        return response
+
+    def test_payloads_match_the_sync_endpoints(self):
+        for params in ({}, {'type': 'expense'}, {'min_amount': '40'}, {'category': self.food.pk}, {'max_points': 5}, {'start_date': '2021-01-10'}):
+            self.assertSameResponse('/api/transaction/stats/', params)
+
+        self.assertSameResponse('/api/stats/categories/', {})
+        self.assertEqual(self.assertSameResponse('/api/transaction/stats/', {'max_points': 1}).status_code, 400)
+        self.assertEqual(self.assertSameResponse('/api/transaction/stats/', {'start_date': 'soon'}).status_code, 400)
+
+    def test_the_configured_stats_backend_builds_the_payload(self):
+        calls = []
+
+        def backend(qs):
+            calls.append(qs.model)
+            return build_stats(qs)
+
+        with mock.patch('expenses.async_views.get_stats_backend', return_value=backend):
+            self.assertSameResponse('/api/transaction/stats/', {'min_amount': '40'})
+            self.assertSameResponse('/api/transaction/stats/', {'type': 'expense'})
+        self.assertEqual(calls, [Transaction, DailyRollup])
+
+    def test_partitions_cover_the_range_without_overlap(self):
+        qs = Transaction.objects.filter(owner=self.user)
+        ranges = date_partitions(qs, 4)
+
+        self.assertEqual(len(ranges), 4)
+        self.assertEqual(ranges[0][0], datetime.date(2020, 12, 25))
+        self.assertEqual(ranges[-1][1], datetime.date(2021, 2, 5))
+        for (_, end), (start, _) in zip(ranges, ranges[1:]):
+            self.assertEqual(start, end + datetime.timedelta(days=1))
+
+        self.assertEqual(len(date_partitions(qs.filter(date='2020-12-28'), 4)), 1)
+        self.assertEqual(date_partitions(qs.none(), 4), [])
+
+        with override_settings(STATS_CONCURRENCY={'WORKERS': 2, 'PARTITIONS': 7}):
+            self.assertSameResponse('/api/transaction/stats/', {})
+
+    def test_cache_and_validators_are_shared_with_the_sync_endpoint(self):
+        response = self.client.get('/api/async/transaction/stats/')
+        self.assertEqual(response['Cache-Control'], 'private, no-cache')
+
+        with CaptureQueriesContext(connection) as queries:
+            cached = self.client.get('/api/transaction/stats/')
+        self.assertEqual(cached.content, response.content)
+        self.assertFalse([query for query in queries.captured_queries if 'expenses_dailyrollup' in query['sql']])
+
+        not_modified = self.client.get('/api/async/transaction/stats/', HTTP_IF_NONE_MATCH=cached['ETag'])
+        self.assertEqual(not_modified.status_code, 304)
+
+    def test_authentication_is_required(self):
+        response = APIClient().get('/api/async/stats/categories/')
+        self.assertEqual(response.status_code, 401)
+        self.assertIn('detail', response.json())
+
+    def test_benchmark_compares_both_paths(self):
+        out = StringIO()
+        call_command('benchmark_async_stats', '--user', self.user.email, '--rounds', '1', '--concurrency', '2', stdout=out)
+
+        self.assertIn('async-transaction-stats', out.getvalue())
+        self.assertIn('identical', out.getvalue())
+
+
+class InlineExecutor:
+    def submit(self, fn, *args):
+        return fn(*args)
+
+
+@override_settings(REPORT_JOBS={'RUNNER': 'command', 'WORKERS': 1, 'RESULT_TTL': 60, 'STALE_AFTER': 60})
+class ReportJobTests(StatsTestMixin, TestCase):
+    def submit(self, params=None, **data):
+        return self.client.post('/api/reports/' + (f'?{params}' if params else ''), data, format='json')
+
+    def test_reports_match_the_stats_endpoint(self):
+        response = self.submit('type=expense&max_points=4')
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.data['status'], ReportJob.PENDING)
+        self.assertEqual(response.data['params'], {'type': 'expense', 'max_points': '4'})
+        self.assertEqual(response['Location'], f"http://testserver/api/reports/{response.data['id']}/")
+
+        url = f"/api/reports/{response.data['id']}/"
+        self.assertEqual(self.client.get(url + 'result/').status_code, 202)
+
+        out = StringIO()
+        call_command('run_report_worker', '--once', '--workers', '1', stdout=out)
+        self.assertIn('1 reports done', out.getvalue())
+
+        self.assertEqual(self.client.get(url).data['status'], ReportJob.DONE)
+        result = self.client.get(url + 'result/')
+        self.assertEqual(result['Content-Type'], 'application/json')
+        self.assertEqual(
+            json.loads(result.content), json.loads(self.client.get('/api/transaction/stats/', {'type': 'expense', 'max_points': 4}).content)
+        )
+
+        categories = self.submit(kind='stats-categories')
+        run_pending()
+        self.assertEqual(
+            json.loads(self.client.get(f"/api/reports/{categories.data['id']}/result/").content),
+            json.loads(self.client.get('/api/stats/categories/').content)
+        )
+
+    def test_identical_jobs_are_deduplicated(self):
+        first = self.submit('type=income&start_date=2021-1-1')
+        second = self.submit(type='income', start_date='2021-01-01', ignored='1')
+        self.assertEqual(second.status_code, 202)
+        self.assertEqual(second.data['id'], first.data['id'])
+        self.assertNotEqual(self.submit('type=expense').data['id'], first.data['id'])
+
+        self.assertEqual(run_pending(), 2)
+
+        # A finished report is reused until the owner's data changes
+        reused = self.submit('type=income&start_date=2021-01-01')
+        self.assertEqual(reused.status_code, 200)
+        self.assertEqual(reused.data['id'], first.data['id'])
+
+        Transaction.objects.create(owner=self.user, amount=Decimal('5.00'), type=Transaction.INCOME, date=datetime.date(2021, 1, 2))
+        self.assertNotEqual(self.submit('type=income&start_date=2021-01-01').data['id'], first.data['id'])
+
+    def test_invalid_requests_are_rejected(self):
+        self.assertEqual(self.submit(kind='everything').status_code, 400)
+        self.assertEqual(self.submit('start_date=soon').status_code, 400)
+        self.assertEqual(self.submit(max_points='1').status_code, 400)
+        self.assertFalse(ReportJob.objects.exists())
+
+    def test_jobs_are_private(self):
+        job_id = self.submit().data['id']
+        other = APIClient()
+        other.force_authenticate(self.other)
+
+        self.assertEqual(other.get(f'/api/reports/{job_id}/').status_code, 404)
+        self.assertEqual(other.get('/api/reports/').data, [])
+        self.assertEqual(len(self.client.get('/api/reports/').data), 1)
+
+    def test_failures_expiry_and_stale_jobs(self):
+        job_id = self.submit().data['id']
+        with mock.patch('expenses.services.reports.compute_stats', side_effect=RuntimeError('boom')):
+            run_pending()
+
+        job = ReportJob.objects.get(pk=job_id)
+        self.assertEqual(job.status, ReportJob.FAILED)
+        response = self.client.get(f'/api/reports/{job_id}/result/')
+        self.assertEqual(response.status_code, 409)
+        self.assertIn('boom', response.data['error'])
+
+        job_id = self.submit().data['id']
+        ReportJob.objects.filter(pk=job_id).update(status=ReportJob.RUNNING, started_at=job.created_at - datetime.timedelta(minutes=5))
+        self.assertEqual(requeue_stale(), 1)
+        run_pending()
+
+        ReportJob.objects.filter(pk=job_id).update(expires_at=job.created_at)
+        self.assertEqual(self.client.get(f'/api/reports/{job_id}/result/').status_code, 410)
+        self.assertEqual(expire_jobs(), 1)
+        self.assertEqual(self.client.get(f'/api/reports/{job_id}/').status_code, 404)
+
+    def test_thread_runner_starts_jobs_on_commit(self):
+        with override_settings(REPORT_JOBS={'RUNNER': 'thread'}):
+            with mock.patch('expenses.services.reports.get_executor', return_value=InlineExecutor()):
+                with self.captureOnCommitCallbacks(execute=True):
+                    job_id = self.submit().data['id']
+
+        self.assertEqual(ReportJob.objects.get(pk=job_id).status, ReportJob.DONE)
+
+
+class TransactionSearchTests(StatsTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.latte = self.add('Café coffee coffee', Transaction.EXPENSE, '4.50', self.food)
+        self.beans = self.add('coffee beans', Transaction.EXPENSE, '12.00', self.food)
+        self.refund = self.add('Coffee machine refund', Transaction.INCOME, '80.00', None)
+        Transaction.objects.create(owner=self.other, amount=Decimal('3.00'), type=Transaction.EXPENSE, date=datetime.date(2021, 1, 1), description='coffee')
+
+    def add(self, description, type, amount, category):
+        return Transaction.objects.create(
+            owner=self.user, amount=Decimal(amount), type=type, category=category, date=datetime.date(2021, 1, 5), description=description
+        )
+
+    def search(self, q, **params):
+        response = self.client.get('/api/transaction/', {'q': q, **params})
+        self.assertEqual(response.status_code, 200)
+        return [row['id'] for row in response.data['results']]
+
+    def test_results_are_ranked_and_scoped_to_the_owner(self):
+        self.assertEqual(self.search('coffee'), [self.latte.pk, self.beans.pk, self.refund.pk])
+        self.assertEqual(self.search('COFFEE bea'), [self.beans.pk])
+        self.assertEqual(self.search('cafe'), [self.latte.pk])
+        self.assertEqual(self.search('tea'), [])
+
+    def test_search_combines_with_the_other_filters(self):
+        self.assertEqual(self.search('coffee', type='income'), [self.refund.pk])
+        self.assertEqual(self.search('coffee', min_amount='10'), [self.beans.pk, self.refund.pk])
+        self.assertEqual(self.search('coffee', category=self.food.pk, end_date='2021-01-05'), [self.latte.pk, self.beans.pk])
+        self.assertEqual(self.search('coffee', ordering='-amount'), [self.refund.pk, self.beans.pk, self.latte.pk])
+
+        stats = self.client.get('/api/transaction/stats/', {'q': 'coffee', 'type': 'expense'}).data
+        self.assertEqual(stats['transaction_count'], 2)
+        self.assertEqual(stats['total_expense'], Decimal('16.50'))
+
+    def test_index_follows_every_write(self):
+        self.beans.description = 'green tea'
+        self.beans.save()
+        self.refund.delete()
+        Transaction.objects.filter(pk=self.latte.pk).update(description='espresso')
+        Transaction.objects.bulk_create([
+            Transaction(owner=self.user, amount=Decimal('1.00'), type=Transaction.EXPENSE, date=datetime.date(2021, 1, 6), description='iced tea')
+        ])
+
+        self.assertEqual(self.search('coffee'), [])
+        self.assertEqual(self.search('espresso'), [self.latte.pk])
+        self.assertEqual(len(self.search('tea')), 2)
+
+    def test_operators_in_the_input_are_literal(self):
+        for q in ('"coffee', 'coffee OR', 'NOT coffee', 'coffee*)', 'beans:(x'):
+            self.assertEqual(self.client.get('/api/transaction/', {'q': q}).status_code, 200)
+        self.assertEqual(self.search('()'), [])
+
+    def test_cursor_pages_follow_the_ranking(self):
+        for i in range(7):
+            self.add(f'coffee {"coffee " * i}', Transaction.EXPENSE, '1.00', None)
+
+        expected = self.search('coffee', page_size=100)
+        seen = []
+        response = self.client.get('/api/transaction/', {'q': 'coffee', 'page_size': 3})
+        while True:
+            seen += [row['id'] for row in response.data['results']]
+            if not response.data['next']:
+                break
+            response = self.client.get(response.data['next'])
+
+        self.assertEqual(len(expected), 10)
+        self.assertEqual(seen, expected)
+
+
+@override_settings(REPORT_JOBS={'RUNNER': 'command', 'WORKERS': 1, 'RESULT_TTL': 60, 'STALE_AFTER': 60})
+@override_settings(EXPENSES_SHARDS=['default', 'shard_1', 'shard_2'])
+class ShardingTests(TestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        stats_cache.cache.clear()
+        shards = get_shards()
+        self.users = [
+            User.objects.create_user(email=f'shard{i}@example.com', username=f'shard{i}', password='password123')
+            for i in range(3)
+        ]
+        self.placement = {user: shards[index % len(shards)] for index, user in enumerate(self.users)}
+        for user, alias in self.placement.items():
+            move_owner(user.pk, alias)
+            self.populate(user)
+
+    def client_for(self, user):
+        client = APIClient()
+        client.force_authenticate(user)
+        return client
+
+    def populate(self, user):
+        lines = [
+            json.dumps({
+                'date': f'2021-01-{i % 28 + 1:02d}', 'amount': f'{user.pk * 10 + i}.25', 'type': 'income' if i % 5 == 0 else 'expense',
+                'category': ['Food', 'Rent', ''][i % 3], 'description': f'{user.username} coffee {i}' if i % 4 == 0 else 'groceries',
+            })
+            for i in range(40)
+        ]
+        response = self.client_for(user).generic(
+            'POST', '/api/transaction/import/', '\n'.join(lines).encode(), content_type='application/x-ndjson'
+        )
+        self.assertEqual(response.data['created'], 40)
+
+        food = next(row['id'] for row in self.client_for(user).get('/api/category/').data if row['name'] == 'Food')
+        self.assertEqual(self.client_for(user).post('/api/budget/', {'category': food, 'amount': '100.00'}).status_code, 201)
+
+    def expected_overview(self, user):
+        with use_shard(user.pk):
+            rows = list(Transaction.objects.filter(owner=user).values_list('type', 'amount'))
+        income = sum(amount for type, amount in rows if type == Transaction.INCOME)
+        expense = sum(amount for type, amount in rows if type == Transaction.EXPENSE)
+        return money(income), money(expense)
+
+    def snapshot(self, client):
+        # Everything a client sees that does not depend on the row ids and sync positions
+        listed = client.get('/api/transaction/', {'page_size': 500}).data['results']
+        export = b''.join(client.get('/api/transaction/export/').streaming_content).decode().splitlines()
+        return {
+            'list': [{key: value for key, value in row.items() if key not in ('id', 'change_seq')} for row in listed],
+            'export': [line.split(',', 1)[1] for line in export],
+            'stats': json.loads(client.get('/api/transaction/stats/').content),
+            'categories': json.loads(client.get('/api/stats/categories/').content),
+            'balance': json.loads(client.get('/api/stats/balance/').content),
+            'search': [row['description'] for row in client.get('/api/transaction/', {'q': 'coffee'}).data['results']],
+            'distribution': [
+                {key: value for key, value in row.items() if key != 'category_id'}
+                for row in client.get('/api/stats/distribution/').data['categories']
+            ],
+            'budgets': [
+                {key: value for key, value in row.items() if key not in ('id', 'category')}
+                for row in client.get('/api/budget/status/', {'month': '2021-01'}).data['results']
+            ],
+        }
+
+    def test_api_serves_each_user_from_their_shard(self):
+        for user in self.users:
+            client = self.client_for(user)
+            overview = client.get('/api/stats/overview/').data
+            self.assertEqual((money(overview['total_income']), money(overview['total_expense'])), self.expected_overview(user))
+
+            listed = client.get('/api/transaction/', {'page_size': 500}).data['results']
+            self.assertEqual(len(listed), 40)
+            self.assertEqual({row['category'] for row in listed}, {'Food', 'Rent', None})
+            self.assertEqual(len(client.get('/api/transaction/', {'q': user.username}).data['results']), 10)
+
+            created = client.post('/api/transaction/', {'amount': '5.00', 'type': 'expense', 'date': '2021-02-01', 'owner': user.pk})
+            self.assertEqual(created.status_code, 201)
+            detail = f"/api/transaction/{created.data['id']}/"
+            self.assertEqual(client.patch(detail, {'amount': '6.00'}).status_code, 200)
+            self.assertEqual(client.get(detail).data['amount'], '6.00')
+
+            pages = client.get('/api/sync/', {'limit': 2000}).data
+            self.assertEqual(len(pages['transactions']), 41)
+            self.assertEqual(client.delete(detail).status_code, 204)
+            self.assertEqual(client.get('/api/sync/', {'cursor': pages['cursor']}).data['deleted']['transactions'], [created.data['id']])
+
+            job = client.post('/api/reports/', {'kind': 'stats-categories'}, format='json').data
+            run_pending()
+            self.assertEqual(
+                json.loads(client.get(f"/api/reports/{job['id']}/result/").content),
+                json.loads(client.get('/api/stats/categories/').content)
+            )
+
+        for alias in set(self.placement.values()):
+            with use_shard(alias=alias):
+                self.assertEqual(verify_rollups(), [])
+                self.assertEqual(verify_balances(), [])
+                self.assertEqual(verify_spend(), [])
+                self.assertEqual(verify_sketches(), [])
+
+    def test_rows_live_on_the_owners_shard(self):
+        for user, alias in self.placement.items():
+            self.assertEqual(ShardAssignment.objects.get(owner=user).shard, alias)
+            for other in get_shards():
+                expected = 40 if other == alias else 0
+                self.assertEqual(Transaction.objects.using(other).filter(owner=user).count(), expected)
+                self.assertEqual(Category.objects.using(other).filter(owner=user).count(), 2 if expected else 0)
+                self.assertEqual(DailyRollup.objects.using(other).filter(owner=user).exists(), bool(expected))
+
+    def test_moving_a_user_keeps_their_data(self):
+        user = self.users[0]
+        source = self.placement[user]
+        target = next(alias for alias in get_shards() if alias != source)
+        client = self.client_for(user)
+
+        before = self.snapshot(client)
+        cursor = client.get('/api/sync/', {'limit': 2000}).data['cursor']
+        created_at = sorted(Transaction.objects.using(source).filter(owner=user).values_list('create_at', flat=True))
+
+        out = StringIO()
+        call_command('rebalance_shards', '--user', user.email, '--to', target, stdout=out)
+        self.assertIn(f'from {source} to {target} (40 transactions)', out.getvalue())
+
+        self.assertEqual(ShardAssignment.objects.get(owner=user).shard, target)
+        self.assertFalse(Transaction.objects.using(source).filter(owner=user).exists())
+        self.assertFalse(Category.objects.using(source).filter(owner=user).exists())
+        self.assertEqual(sorted(Transaction.objects.using(target).filter(owner=user).values_list('create_at', flat=True)), created_at)
+        self.assertEqual(self.snapshot(client), before)
+
+        # The rows have new ids, so sync clients are told to start over
+        self.assertEqual(client.get('/api/sync/', {'cursor': cursor}).status_code, 410)
+        synced = client.get('/api/sync/', {'limit': 2000}).data
+        self.assertEqual(
+            sorted(row['id'] for row in synced['transactions']),
+            sorted(Transaction.objects.using(target).filter(owner=user).values_list('id', flat=True))
+        )
+
+        # The other users on either shard are untouched
+        for other in self.users[1:]:
+            self.assertEqual(Transaction.objects.using(self.placement[other]).filter(owner=other).count(), 40)
+
+    def test_writes_are_refused_while_a_user_is_moving(self):
+        user = self.users[1]
+        client = self.client_for(user)
+        ShardAssignment.objects.filter(owner=user).update(moving=True)
+
+        self.assertEqual(client.post('/api/category/', {'name': 'Travel'}).status_code, 503)
+        self.assertEqual(client.get('/api/stats/overview/').status_code, 200)
+
+    def test_writes_under_way_when_a_move_starts_are_not_lost(self):
+        user = self.users[0]
+        source = self.placement[user]
+        target = next(alias for alias in get_shards() if alias != source)
+
+        def copy_then_write(owner_id, *args):
+            version = copy_owner(owner_id, *args)
+            # A writer that got past the moving check before the move started
+            with use_shard(user.pk, source), self.assertRaises(OwnerMoving):
+                Transaction.objects.create(owner=user, amount='7.00', type='expense', date='2021-02-01')
+            return version
+
+        with mock.patch('expenses.services.shards.copy_owner', copy_then_write):
+            self.assertEqual(move_owner(user.pk, target), 40)
+        self.assertEqual(Transaction.objects.using(target).filter(owner=user).count(), 40)
+
+        def copy_then_commit(owner_id, *args):
+            version = copy_owner(owner_id, *args)
+            # One that committed on the old shard before the switch
+            ChangeMarker.objects.using(target).filter(owner=user).update(version=F('version') + 1)
+            return version
+
+        with mock.patch('expenses.services.shards.copy_owner', copy_then_commit), self.assertRaises(ShardMoveError):
+            move_owner(user.pk, source)
+        self.assertEqual(ShardAssignment.objects.filter(owner=user).values_list('shard', 'moving').get(), (target, False))
+        self.assertFalse(Transaction.objects.using(source).filter(owner=user).exists())
+        self.assertEqual(Transaction.objects.using(target).filter(owner=user).count(), 40)
+
+    def test_deleting_a_user_clears_their_shard(self):
+        user = self.users[1]
+        owner_id, alias = user.pk, self.placement[user]
+
+        with self.captureOnCommitCallbacks(execute=True):
+            user.delete()
+
+        self.assertFalse(ShardAssignment.objects.filter(owner_id=owner_id).exists())
+        for model in (Transaction, Category, DailyRollup):
+            self.assertFalse(model.objects.using(alias).filter(owner_id=owner_id).exists())
+        self.assertEqual(Transaction.objects.using(self.placement[self.users[2]]).filter(owner=self.users[2]).count(), 40)
+
+    def test_rebalance_plan(self):
+        loads = {'a': {1: 100, 2: 50, 3: 10}, 'b': {}, 'c': {4: 5}}
+        self.assertEqual(plan_rebalance(loads), [(1, 'a', 'b', 100), (3, 'a', 'c', 10)])
+        self.assertEqual(plan_rebalance({'a': {1: 10}, 'b': {2: 9}}), [])
+
+
+@override_settings(DATABASE_LOCK_RETRY={'ATTEMPTS': 3, 'BASE_DELAY': 0, 'MAX_DELAY': 0})
+class LockRetryTests(StatsTestMixin, TransactionTestCase):
+    # Retries need the write to be the outermost transaction
+    def locked_once(self, func):
+        calls = []
+
+        def wrapper(*args, **kwargs):
+            calls.append(args)
+            if len(calls) == 1:
+                raise OperationalError('database is locked')
+            return func(*args, **kwargs)
+        return wrapper
+
+    def test_a_locked_write_is_retried_as_a_whole(self):
+        before = Transaction.objects.filter(owner=self.user).count()
+        version = get_marker(self.user.pk)[0]
+
+        # Fails after the row and its rollups were written
+        with mock.patch('expenses.signals.apply_balance_deltas', self.locked_once(apply_balance_deltas)):
+            response = self.client.post('/api/transaction/', {
+                'owner': self.user.pk, 'amount': '12.00', 'type': 'expense', 'date': '2021-01-02'
+            })
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Transaction.objects.filter(owner=self.user).count(), before + 1)
+        self.assertEqual(verify_rollups(), [])
+        self.assertEqual(verify_balances(), [])
+        self.assertEqual(get_marker(self.user.pk)[0], version + 1)
+
+    def test_a_write_that_stays_locked_leaves_nothing_behind(self):
+        transaction = Transaction.objects.filter(owner=self.user).first()
+        version = get_marker(self.user.pk)[0]
+
+        with mock.patch('expenses.signals.apply_balance_deltas', side_effect=OperationalError('database is locked')) as apply:
+            with self.assertRaises(OperationalError):
+                self.client.patch(f'/api/transaction/{transaction.pk}/', {'amount': '1.00'})
+        self.assertEqual(apply.call_count, 3)
+
+        transaction.refresh_from_db()
+        self.assertNotEqual(transaction.amount, Decimal('1.00'))
+        self.assertEqual(verify_rollups(), [])
+        self.assertEqual(get_marker(self.user.pk)[0], version)
+
+    def test_a_save_commits_with_its_change_seq(self):
+        before = Transaction.objects.filter(owner=self.user).count()
+        version = get_marker(self.user.pk)[0]
+
+        with mock.patch('expenses.signals.apply_balance_deltas', side_effect=RuntimeError('boom')):
+            with self.assertRaises(RuntimeError):
+                Transaction.objects.create(
+                    owner=self.user, amount=Decimal('3.00'), type=Transaction.EXPENSE, date=datetime.date(2021, 1, 3)
+                )
+
+        self.assertEqual(Transaction.objects.filter(owner=self.user).count(), before)
+        self.assertEqual(get_marker(self.user.pk)[0], version)
+
+        row = Transaction.objects.create(
+            owner=self.user, amount=Decimal('3.00'), type=Transaction.EXPENSE, date=datetime.date(2021, 1, 3)
+        )
+        self.assertEqual(row.change_seq, version + 1)
+        self.assertEqual(get_marker(self.user.pk)[0], version + 1)
+
+    def test_writes_inside_an_outer_transaction_are_not_retried(self):
+        row = Transaction.objects.filter(owner=self.user).first()
+
+        with mock.patch('expenses.signals.apply_balance_deltas', side_effect=OperationalError('database is locked')) as apply:
+            with mock.patch('expenses.retry.time.sleep') as sleep, self.assertRaises(OperationalError):
+                with transaction.atomic():
+                    self.client.patch(f'/api/transaction/{row.pk}/', {'amount': '1.00'})
+        self.assertEqual(apply.call_count, 1)
+        sleep.assert_not_called()
+
+        row.refresh_from_db()
+        self.assertNotEqual(row.amount, Decimal('1.00'))
+
+    def test_other_errors_are_not_retried(self):
+        transaction = Transaction.objects.filter(owner=self.user).first()
+
+        with mock.patch('expenses.signals.apply_balance_deltas', side_effect=OperationalError('disk I/O error')) as apply:
+            with self.assertRaises(OperationalError):
+                self.client.delete(f'/api/transaction/{transaction.pk}/')
+        self.assertEqual(apply.call_count, 1)
+        self.assertTrue(Transaction.objects.filter(pk=transaction.pk).exists())
+
+    def test_stress_command(self):
+        out = StringIO()
+        call_command('stress_db', '--threads', '2', '--duration', '0.5', '--users', '1', stdout=out)
+
+        self.assertRegex(out.getvalue(), r'writes: +[\d.]+/s')
+        self.assertRegex(out.getvalue(), r'reads: +[\d.]+/s')
+        self.assertFalse(User.objects.filter(email__startswith='stress-').exists())
+
+
+class BudgetTests(StatsTestMixin, TestCase):
+    def expected_spend(self, category, year, month):
+        return money(sum(
+            Transaction.objects.filter(
+                owner=self.user, category=category, type=Transaction.EXPENSE, date__year=year, date__month=month
+            ).values_list('amount', flat=True)
+        ))
+
+    def budget_status(self, month='2021-01'):
+        response = self.client.get('/api/budget/status/', {'month': month})
+        self.assertEqual(response.status_code, 200)
+        return {row['category']: row for row in response.data['results']}
+
+    def test_status_reads_the_counters(self):
+        self.assertEqual(self.client.post('/api/budget/', {'category': self.food.pk, 'amount': '100.00'}).status_code, 201)
+        self.assertEqual(self.client.post('/api/budget/', {'category': self.rent.pk, 'amount': '5000.00'}).status_code, 201)
+
+        with self.assertNumQueries(1):
+            status = self.budget_status()
+
+        for category, amount in ((self.food, Decimal('100.00')), (self.rent, Decimal('5000.00'))):
+            row = status[category.pk]
+            spent = self.expected_spend(category, 2021, 1)
+            self.assertEqual(money(row['spent']), spent)
+            self.assertEqual(money(row['remaining']), amount - spent)
+            self.assertEqual(row['over_budget'], spent > amount)
+        self.assertTrue(status[self.food.pk]['over_budget'])
+
+        empty = self.budget_status('2019-06')[self.food.pk]
+        self.assertEqual((money(empty['spent']), empty['transactions'], empty['over_budget']), (0, 0, False))
+
+    def test_writes_report_the_budget(self):
+        spent = self.expected_spend(self.food, 2021, 1)
+        Budget.objects.create(owner=self.user, category=self.food, amount=spent + 10)
+
+        def post(amount):
+            response = self.client.post('/api/transaction/', {
+                'amount': amount, 'type': 'expense', 'date': '2021-01-15', 'category_id': self.food.pk, 'owner': self.user.pk,
+            })
+            self.assertEqual(response.status_code, 201)
+            return response.data
+
+        first = post('5.00')
+        self.assertEqual(first['category'], 'Food')
+        self.assertEqual((money(first['budget']['remaining']), first['budget']['over_budget']), (Decimal('5.00'), False))
+        second = post('6.00')
+        self.assertEqual((money(second['budget']['spent']), second['budget']['over_budget']), (spent + 11, True))
+
+        moved = self.client.patch(f"/api/transaction/{second['id']}/", {'category_id': self.rent.pk}).data
+        self.assertIsNone(moved['budget'])
+        self.assertFalse(self.budget_status()[self.food.pk]['over_budget'])
+
+        self.assertEqual(self.client.delete(f"/api/transaction/{first['id']}/").status_code, 204)
+        self.assertEqual(money(self.budget_status()[self.food.pk]['spent']), spent)
+        self.assertEqual(verify_spend(), [])
+
+        other = Category.objects.get(owner=self.other)
+        response = self.client.post('/api/transaction/', {
+            'amount': '1.00', 'type': 'expense', 'date': '2021-01-15', 'category_id': other.pk, 'owner': self.user.pk,
+        })
+        self.assertEqual(response.status_code, 400)
+
+    def test_counters_follow_every_write(self):
+        moved = Transaction.objects.filter(owner=self.user, category=self.food, date__month=1).first()
+        moved.date = datetime.date(2020, 11, 3)
+        moved.save()
+        flipped = Transaction.objects.filter(owner=self.user, category=self.rent).first()
+        flipped.type = Transaction.INCOME if flipped.type == Transaction.EXPENSE else Transaction.EXPENSE
+        flipped.save()
+        Transaction.objects.filter(owner=self.user, category=self.food).last().delete()
+
+        upload = SimpleUploadedFile('rows.csv', b'amount,type,date,category\n5.00,expense,2021-03-01,Food\n7.50,expense,2021-03-02,Travel\n')
+        self.client.post('/api/transaction/import/', {'file': upload}, format='multipart')
+        self.assertEqual(verify_spend(), [])
+
+        self.rent.delete()
+        self.assertFalse(CategorySpend.objects.filter(category_id=self.rent.pk).exists())
+        self.assertEqual(verify_spend(), [])
+
+    def test_budget_validation(self):
+        other = Category.objects.get(owner=self.other)
+        Budget.objects.create(owner=self.other, category=other, amount=10)
+
+        self.assertEqual(self.client.post('/api/budget/', {'category': other.pk, 'amount': '10.00'}).status_code, 400)
+        self.assertEqual(self.client.post('/api/budget/', {'category': self.food.pk, 'amount': '0'}).status_code, 400)
+        self.assertEqual(self.client.post('/api/budget/', {'category': self.food.pk, 'amount': '10.00'}).status_code, 201)
+        self.assertEqual(self.client.post('/api/budget/', {'category': self.food.pk, 'amount': '20.00'}).status_code, 400)
+
+        self.assertEqual(list(self.budget_status()), [self.food.pk])
+        self.assertEqual(self.client.get('/api/budget/status/', {'month': '2021-13'}).status_code, 400)
+
+    def test_reconcile_command(self):
+        CategorySpend.objects.filter(category=self.food).update(spent=0)
+        CategorySpend.objects.filter(category=self.rent).first().delete()
+        CategorySpend.objects.create(owner=self.user, category=self.rent, month=datetime.date(2019, 1, 1), spent=1, count=1)
+        drifted = len(verify_spend())
+        self.assertGreater(drifted, 2)
+
+        with self.assertRaises(CommandError):
+            call_command('reconcile_budgets', '--dry-run', stdout=StringIO())
+        self.assertEqual(len(verify_spend()), drifted)
+
+        out = StringIO()
+        call_command('reconcile_budgets', '--user', self.user.email, stdout=out)
+        self.assertIn(f'Repaired {drifted} spend counters', out.getvalue())
+        self.assertEqual(verify_spend(), [])
+
+        out = StringIO()
+        call_command('reconcile_budgets', stdout=out)
+        self.assertIn('up to date', out.getvalue())
+
+
+class SpendDistributionTests(StatsTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        stats_cache.cache.clear()
+        # Log-uniform amounts from 0.50 to about 5000, some of them repeated
+        rng = random.Random(7)
+        lines = [
+            json.dumps({
+                'date': f'2021-0{i % 3 + 1}-{i % 28 + 1:02d}', 'amount': f'{math.exp(rng.uniform(-0.7, 8.5)):.2f}',
+                'type': 'expense', 'category': ['Food', 'Rent', 'Travel', ''][i % 4],
+            })
+            for i in range(600)
+        ]
+        response = self.client.generic('POST', '/api/transaction/import/', '\n'.join(lines).encode(), content_type='application/x-ndjson')
+        self.assertEqual(response.data['created'], 600)
+
+    def exact(self, q, **filters):
+        amounts = sorted(
+            Transaction.objects.filter(owner=self.user, type=Transaction.EXPENSE, **filters).values_list('amount', flat=True)
+        )
+        return len(amounts), float(amounts[int(q * (len(amounts) - 1))])
+
+    def assertWithinBound(self, estimate, exact):
+        # The sketch bound plus rounding to cents
+        self.assertLessEqual(abs(estimate - exact), RELATIVE_ACCURACY * exact + 0.005, (estimate, exact))
+
+    def assertDistributionCorrect(self, params=None, **filters):
+        quantiles = [0, 0.25, 0.5, 0.9, 0.99, 1]
+        data = self.client.get('/api/stats/distribution/', {'quantiles': ','.join(map(str, quantiles)), **(params or {})}).data
+        self.assertEqual(data['relative_accuracy'], RELATIVE_ACCURACY)
+
+        for q in quantiles:
+            label = f'p{q * 100:g}'
+            count, exact = self.exact(q, **filters)
+            self.assertEqual(data['overall']['count'], count)
+            self.assertWithinBound(data['overall'][label], exact)
+
+            for row in data['categories']:
+                count, exact = self.exact(q, category_id=row['category_id'], **filters)
+                self.assertEqual(row['count'], count)
+                self.assertWithinBound(row[label], exact)
+        return data
+
+    def test_percentiles_match_the_exact_ones(self):
+        data = self.assertDistributionCorrect()
+        self.assertEqual([row['category'] for row in data['categories']], ['Food', 'Rent', 'Travel', None])
+        self.assertEqual(list(data['overall']), ['count', 'p0', 'p25', 'p50', 'p90', 'p99', 'p100'])
+
+        self.assertDistributionCorrect({'start_month': '2021-02', 'end_month': '2021-03'}, date__gte=datetime.date(2021, 2, 1))
+        self.assertDistributionCorrect({'categories': f'{self.food.pk},{self.rent.pk}'}, category__in=[self.food, self.rent])
+
+    def test_sketches_follow_writes(self):
+        moved = Transaction.objects.filter(owner=self.user, category=self.food, type=Transaction.EXPENSE).first()
+        moved.amount, moved.date, moved.category = Decimal('1234.56'), datetime.date(2020, 11, 3), self.rent
+        moved.save()
+        flipped = Transaction.objects.filter(owner=self.user, category=self.rent, type=Transaction.INCOME).first()
+        flipped.type = Transaction.EXPENSE
+        flipped.save()
+        Transaction.objects.filter(owner=self.user, type=Transaction.EXPENSE).last().delete()
+        Transaction.objects.create(owner=self.user, amount=0, type=Transaction.EXPENSE, date=datetime.date(2021, 1, 2))
+        self.assertEqual(verify_sketches(), [])
+
+        Category.objects.get(owner=self.user, name='Travel').delete()
+        self.assertEqual(verify_sketches(), [])
+        self.assertDistributionCorrect()
+
+    def test_cost_does_not_depend_on_the_transactions(self):
+        with self.assertNumQueries(2):
+            self.client.get('/api/stats/distribution/')
+
+    def test_invalid_parameters(self):
+        for params in ({'start_month': '2021-13'}, {'quantiles': '0.5,1.5'}, {'quantiles': 'median'}, {'categories': 'food'}):
+            self.assertEqual(self.client.get('/api/stats/distribution/', params).status_code, 400, params)
@@ -1,11 +1,23 @@
+from django.urls import path
 from rest_framework.routers import DefaultRouter
-from .views import CategoryViewSet, TransactionViewSet, StatsViewSet
+from .async_views import CategoryStatsView, TransactionStatsView
+from .views import BudgetViewSet, CategoryViewSet, ReportJobViewSet, SyncViewSet, TransactionViewSet, StatsViewSet
 
 
 router = DefaultRouter()
 router.register(r'category', CategoryViewSet, basename='category')
 router.register(r'transaction', TransactionViewSet, basename='transaction')
+router.register(r'budget', BudgetViewSet, basename='budget')
 router.register(r'stats', StatsViewSet, basename='stats')
+router.register(r'sync', SyncViewSet, basename='sync')
+router.register(r'reports', ReportJobViewSet, basename='report')
 
 
-urlpatterns = router.urls
\ No newline at end of file
+# Async versions of the heaviest stats actions, for ASGI deployments
+async_urlpatterns = [
+    path('async/transaction/stats/', TransactionStatsView.as_view(), name='async-transaction-stats'),
+    path('async/stats/categories/', CategoryStatsView.as_view(), name='async-stats-categories'),
+]
+
+
+urlpatterns = router.urls + async_urlpatterns
@@ -1,22 +1,150 @@
 
-from collections import defaultdict
+import datetime
 import json
 
-from django.db.models import Sum, Case, When, DecimalField, F, Value, Max, Min
+from django.db import router
+from django.db.models import Sum, F, Value, Max, Min
 from django.db.models.functions import TruncDate, Cast, ExtractWeek, ExtractMonth, ExtractYear
-from rest_framework import viewsets
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils import timezone
+from django_filters import utils
+from django_filters.rest_framework import DjangoFilterBackend
+from rest_framework import mixins, viewsets
 from rest_framework.decorators import action
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.exceptions import APIException
+from rest_framework.parsers import MultiPartParser
+from rest_framework.permissions import SAFE_METHODS, IsAuthenticated
+from rest_framework.renderers import BrowsableAPIRenderer
 from rest_framework.response import Response
-from .models import Category, Transaction
-from .serializer import CategorySerializer, TransactionSerializer
-from .filters import TransactionFilter
+from rest_framework.reverse import reverse
+from .models import Budget, Category, DailyRollup, ReportJob, SpendSketch, Tombstone, Transaction
+from .serializer import (
+    BudgetSerializer, BudgetStatusSerializer, CategorySerializer, ReportJobSerializer, SyncTransactionSerializer,
+    TransactionSerializer, TransactionWriteSerializer
+)
+from .filters import DailyRollupFilter, SearchOrderingFilter, TransactionFilter
+from .cache import cached_stats
+from .conditional import conditional_get
+from .pagination import KeysetPagination
+from .renderers import CSVRenderer, FastJSONRenderer, NDJSONRenderer
+from .retry import run_with_retry
+from .routers import OwnerMoving, activate_shard, deactivate_shard, get_assignment, in_shard, lock_owner_shard
+from .services.balances import (
+    BALANCE_PERIODS, activity_range, balance_series, bucket_count, limited_balance_series, month_start
+)
+from .services.budgets import with_spend
+from .services.exporter import export_rows, stream_csv, stream_ndjson
+from .services.importer import IMPORT_FORMATS, TransactionImporter, iter_csv_rows, iter_ndjson_rows
+from .services.listing import RowSerializer
+from .services.reports import REPORT_KINDS, clean_params, submit
+from .services.sketches import DEFAULT_QUANTILES, spend_distribution
+from .services.sync import START, CursorExpired, decode_cursor, encode_cursor, get_changes
 
 
-from expenses.services.stats import get_time_stats, PERIOD_CONFIG, get_time_extreme_stats
+from expenses.services.stats import (
+    PERIOD_CONFIG, build_category_stats, build_cube, build_extremes, compute_stats, get_days, get_time_stats,
+    limit_stats, resample
+)
 
 
-class CategoryViewSet(viewsets.ModelViewSet):
+transaction_rows = RowSerializer(TransactionSerializer, lookups={'category': 'category__name'})
+
+
+def get_max_points(request):
+    # ?max_points= for the time-series endpoints: None when absent, ValueError
+    # unless it is an integer of at least 2
+    value = request.query_params.get('max_points')
+    if not value:
+        return None
+
+    max_points = int(value)
+    if max_points < 2:
+        raise ValueError('max_points must be at least 2')
+    return max_points
+
+
+def filter_rollups(request, queryset):
+    # Applies the TransactionFilter parameters that daily rollups can answer
+    filterset = DailyRollupFilter(request.query_params, queryset=queryset, request=request)
+    if not filterset.is_valid():
+        raise utils.translate_validation(filterset.errors)
+
+    return filterset.qs
+
+
+def filter_transactions(request, queryset):
+    filterset = TransactionFilter(request.query_params, queryset=queryset, request=request)
+    if not filterset.is_valid():
+        raise utils.translate_validation(filterset.errors)
+
+    return filterset.qs
+
+
+class ShardMoving(APIException):
+    status_code = 503
+    default_detail = 'Your data is being moved to another database, try again shortly.'
+    default_code = 'shard_moving'
+
+
+class ShardRoutingMixin:
+    # Sends the request's expenses queries to the user's shard (routers.py)
+    shard = None
+
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        alias, moving = get_assignment(request.user.pk)
+        if moving and request.method not in SAFE_METHODS:
+            raise ShardMoving()
+
+        self.shard = (request.user.pk, alias)
+        activate_shard(*self.shard)
+
+
+    def handle_exception(self, exc):
+        # A write that was under way when a move of the user started
+        if isinstance(exc, OwnerMoving):
+            exc = ShardMoving()
+        return super().handle_exception(exc)
+
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        if self.shard is not None:
+            if response.streaming:
+                response.streaming_content = in_shard(response.streaming_content, *self.shard)
+            deactivate_shard()
+        return response
+
+
+class LockRetryMixin:
+    # Each create, update and delete is a single transaction on the user's
+    # shard, run again when SQLite reports the database locked (retry.py)
+    def create(self, request, *args, **kwargs):
+        return self.write(super().create, request, *args, **kwargs)
+
+
+    def update(self, request, *args, **kwargs):
+        return self.write(super().update, request, *args, **kwargs)
+
+
+    def destroy(self, request, *args, **kwargs):
+        return self.write(super().destroy, request, *args, **kwargs)
+
+
+    def write(self, func, *args, **kwargs):
+        using = router.db_for_write(self.get_queryset().model)
+
+        def locked(*args, **kwargs):
+            # Holds the user's write lock on the shard, so a move either waits
+            # for this write or has already switched the user away (routers.py)
+            lock_owner_shard(self.request.user.pk, using)
+            return func(*args, **kwargs)
+
+        return run_with_retry(locked, *args, using=using, **kwargs)
+
+
+class CategoryViewSet(ShardRoutingMixin, LockRetryMixin, viewsets.ModelViewSet):
     serializer_class = CategorySerializer
     permission_classes = [IsAuthenticated]
 
@@ -29,128 +157,180 @@ class CategoryViewSet(viewsets.ModelViewSet):
         serializer.save(owner=self.request.user)
 
 
-class TransactionViewSet(viewsets.ModelViewSet):
+class TransactionViewSet(ShardRoutingMixin, LockRetryMixin, viewsets.ModelViewSet):
     serializer_class = TransactionSerializer
     permission_classes = [IsAuthenticated]
+    filter_backends = [DjangoFilterBackend, SearchOrderingFilter]
     filterset_class = TransactionFilter
+    pagination_class = KeysetPagination
     ordering_fields = ['amount', 'date']
     ordering = ['-date']
+    renderer_classes = [FastJSONRenderer, BrowsableAPIRenderer]
 
 
     def get_queryset(self):
         return Transaction.objects.filter(owner=self.request.user)
+
+
+    def get_serializer_class(self):
+        # The budget check is read inside the write's transaction
+        if self.action in ('create', 'update', 'partial_update'):
+            return TransactionWriteSerializer
+        return super().get_serializer_class()
     
 
     def perform_create(self, serializer):
         serializer.save(owner=self.request.user)
 
 
-    @action(detail=False, methods=['get'])
-    def stats(self, request):
-        qs = self.filter_queryset(self.get_queryset()).filter(date__isnull=False)
-
-        income = qs.filter(type=Transaction.INCOME)
-        expense = qs.filter(type=Transaction.EXPENSE)
-
-        income_total = income.aggregate(total=Sum('amount'))['total'] or 0
-        expense_total = expense.aggregate(total=Sum('amount'))['total'] or 0
-
-        # By categories stats
-        by_category = defaultdict(list)
-
-        for category in Category.objects.all().order_by('name'):
-            if Transaction.objects.filter(category=category):
-                by_category[category.name] = {
-                    category.name: {
-                        'yearly': get_time_stats(qs, 'year', category),
-                        'monthly': get_time_stats(qs, 'month', category),
-                        'weekly': get_time_stats(qs, 'week', category),
-                    }
-                }
-                
-
-        # Daily stats
-        daily_qs = (
-            qs.values('date').annotate(
-                income = Sum(Case(When(type=Transaction.INCOME, then='amount'), default=0, output_field=DecimalField())),
-                expense = Sum(Case(When(type=Transaction.EXPENSE, then='amount'), default=0, output_field=DecimalField()))
-            ).order_by('date')
-        )
-        
+    @conditional_get('transaction-list')
+    def list(self, request, *args, **kwargs):
+        # Joined values() rows instead of model instances: one query per page
+        # and no per-field serializer overhead, with the serializer's output
+        queryset = transaction_rows.rows(self.filter_queryset(self.get_queryset()))
+        page = self.paginate_queryset(queryset)
+        return self.get_paginated_response(transaction_rows.serialize(page))
 
-        daily = [
-            {
-            'date': item['date'],
-            'income': item['income'],
-            'expense': item['expense'],
-            'net': item['income'] - item['expense']
-            }
-            for item in daily_qs
-        ]
-        
-        # Weekly stats
-        weekly = get_time_stats(qs, 'week')
 
-        # Monthly stats
-        monthly = get_time_stats(qs, 'month')
+    def get_rollups(self):
+        return filter_rollups(self.request, DailyRollup.objects.filter(owner=self.request.user))
 
-        #yearly stats
-        yearly = get_time_stats(qs, 'year')
 
+    @action(detail=False, methods=['post'], url_path='import', parser_classes=[MultiPartParser])
+    def import_transactions(self, request):
+        # Either a multipart upload in the "file" field, or the raw CSV/NDJSON
+        # request body; both are read line by line and never held in memory
+        content_type = request.content_type.split(';')[0].strip()
 
-        # All time stats
-        all_time_income = qs.filter(type=Transaction.INCOME).aggregate(Sum('amount'))['amount__sum']
-        all_time_expense = qs.filter(type=Transaction.EXPENSE).aggregate(Sum('amount'))['amount__sum']
+        if content_type == 'multipart/form-data':
+            source = request.FILES.get('file')
+            if source is None:
+                return Response({"error": "No file was uploaded"}, status=400)
+            file_format = request.data.get('format') or source.name.rsplit('.', 1)[-1].lower()
+        else:
+            source = request.stream
+            file_format = {
+                'text/csv': 'csv',
+                'application/x-ndjson': 'ndjson',
+                'application/ndjson': 'ndjson',
+            }.get(content_type)
 
+        if file_format not in IMPORT_FORMATS or source is None:
+            return Response({"error": f"Unsupported import format: {file_format}"}, status=400)
 
-        # The most expensive day
-        cheapest_expensive_day = qs.filter(type=Transaction.EXPENSE).values('date').annotate(total=Sum('amount')).order_by('total')
-        cheapest_day = cheapest_expensive_day.first()
-        expensive_day = cheapest_expensive_day.order_by('-total').first()
+        rows = iter_csv_rows(source) if file_format == 'csv' else iter_ndjson_rows(source)
+        report = TransactionImporter(request.user).run(rows)
 
+        return Response(report, status=400 if report['failed'] and not report['created'] else 201)
 
-        # Balance stats
-        balance = all_time_income - all_time_expense
-        
 
-        data = {
-            'transaction_count': qs.count(),
-            'balance': balance,
-            'total_income': all_time_income,
-            'total_expense': all_time_expense,
-            'cheapest_day': cheapest_day,
-            'expensive_day': expensive_day,
-            'by_category': list(by_category.values()),
-            'daily': daily,
-            'weekly': weekly,
-            'monthly': monthly,
-            'yearly': yearly
-        }
+    @action(detail=False, methods=['get'], renderer_classes=[CSVRenderer, NDJSONRenderer])
+    def export(self, request):
+        qs = self.filter_queryset(self.get_queryset())
+        # Same row order as paging through the list, including the id tie-breaker
+        rows = export_rows(qs.order_by(*self.paginator.get_ordering(qs, self)))
+
+        if request.accepted_renderer.format == 'ndjson':
+            response = StreamingHttpResponse(stream_ndjson(rows), content_type='application/x-ndjson; charset=utf-8')
+        else:
+            response = StreamingHttpResponse(stream_csv(rows), content_type='text/csv; charset=utf-8')
+
+        response['Content-Disposition'] = f'attachment; filename="transactions.{request.accepted_renderer.format}"'
+        return response
+
+
+    @action(detail=False, methods=['get'])
+    @conditional_get('transaction-stats')
+    @cached_stats('transaction-stats', params=('max_points',), filtered=True)
+    def stats(self, request):
+        try:
+            max_points = get_max_points(request)
+        except ValueError:
+            return Response({"error": "max_points must be an integer of at least 2"}, status=400)
+
+        # Amount filters need the raw rows, everything else is served by the daily rollups
+        if DailyRollupFilter.supports(request.query_params):
+            qs = self.get_rollups()
+        else:
+            qs = self.filter_queryset(self.get_queryset())
+
+        data = compute_stats(qs)
+        if max_points is not None:
+            data = limit_stats(data, max_points)
 
         return Response(data)
     
 
-class StatsViewSet(viewsets.GenericViewSet):
+class BudgetViewSet(ShardRoutingMixin, LockRetryMixin, viewsets.ModelViewSet):
+    serializer_class = BudgetSerializer
+    permission_classes = [IsAuthenticated]
+
+
+    def get_queryset(self):
+        return Budget.objects.filter(owner=self.request.user).select_related('category').order_by('category__name', 'pk')
+
+
+    def perform_create(self, serializer):
+        serializer.save(owner=self.request.user)
+
+
+    @action(detail=False, methods=['get'])
+    def status(self, request):
+        # Every budget against the spend of ?month=YYYY-MM (default: the
+        # current month), read from the CategorySpend counters
+        month = month_start(timezone.localdate())
+        if request.query_params.get('month'):
+            try:
+                month = datetime.date.fromisoformat(f"{request.query_params['month']}-01")
+            except ValueError:
+                return Response({"error": "month must be a YYYY-MM month"}, status=400)
+
+        budgets = with_spend(self.get_queryset(), month)
+        return Response({'month': month, 'results': BudgetStatusSerializer(budgets, many=True).data})
+
+
+class StatsViewSet(ShardRoutingMixin, viewsets.GenericViewSet):
     queryset = Transaction.objects.all()
     permission_classes = [IsAuthenticated]
     serializer_class = TransactionSerializer
+    max_extremes = 100
+    # Points a balance series may have, ten years of days
+    max_balance_points = 3660
+
+
+    def get_queryset(self):
+        return super().get_queryset().filter(owner=self.request.user)
+
+
+    def get_rollups(self):
+        return DailyRollup.objects.filter(owner=self.request.user)
+
+
+    def get_filtered(self):
+        # The filter parameters applied to the daily rollups, or to the raw
+        # transactions when amount filters or a search need them
+        if DailyRollupFilter.supports(self.request.query_params):
+            return filter_rollups(self.request, self.get_rollups())
+        return filter_transactions(self.request, self.get_queryset())
 
 
     @action(detail=False, methods=['get'])
+    @conditional_get('stats-overview')
+    @cached_stats('stats-overview')
     def overview(self, request):
-        qs = self.get_queryset()
-
-        income = qs.filter(type=Transaction.INCOME)
-        expense = qs.filter(type=Transaction.EXPENSE)
+        totals = {
+            row['type']: row
+            for row in self.get_rollups().values('type').annotate(total=Sum('amount'), transactions=Sum('count')).order_by()
+        }
 
-        income_total = income.aggregate(total=Sum('amount'))['total'] or 0
-        expense_total = expense.aggregate(total=Sum('amount'))['total'] or 0
+        income_total = totals.get(Transaction.INCOME, {}).get('total') or 0
+        expense_total = totals.get(Transaction.EXPENSE, {}).get('total') or 0
 
         # Balance stats
         balance = income_total - expense_total
 
         data = {
-            'transaction_count': qs.count(),
+            'transaction_count': sum(row['transactions'] for row in totals.values()),
             'balance': balance,
             'total_income': income_total,
             'total_expense': expense_total,
@@ -160,42 +340,55 @@ class StatsViewSet(viewsets.GenericViewSet):
     
 
     @action(detail=False, methods=['get'])
+    @conditional_get('stats-categories')
+    @cached_stats('stats-categories')
     def categories(self, request):
-        
-        categories = Category.objects.all().order_by('name')
-
-        by_category = defaultdict(list)
-
-        for category in categories:
-            income = self.get_queryset().filter(category=category, type=Transaction.INCOME).aggregate(Sum('amount'))['amount__sum'] or 0
-            expense = self.get_queryset().filter(category=category, type=Transaction.EXPENSE).aggregate(Sum('amount'))['amount__sum'] or 0
-
-            if Transaction.objects.filter(category=category):
-                by_category[category.name].append({
-                    'income': income,
-                    'expense': expense,
-                    'net': income - expense,
-                    'daily': get_time_stats(self.get_queryset(), 'day', category), 
-                    'weekly': get_time_stats(self.get_queryset(), 'week', category), 
-                    'monthly': get_time_stats(self.get_queryset(), 'month', category), 
-                    'yearly': get_time_stats(self.get_queryset(), 'year', category) 
-                })
-        
-        
-        return Response(by_category)
+        return Response(build_category_stats(self.get_rollups()))
+
+
+    @action(detail=False, methods=['get'])
+    @conditional_get('stats-cube')
+    @cached_stats('stats-cube', params=('categories', 'periods'), filtered=True)
+    def cube(self, request):
+        periods = [period.strip().lower() for period in request.query_params.get('periods', '').split(',') if period.strip()]
+        periods = list(dict.fromkeys(periods)) or list(PERIOD_CONFIG)
+
+        invalid = [period for period in periods if period not in PERIOD_CONFIG]
+        if invalid:
+            return Response({"error": f"Invalid period: {', '.join(invalid)}"}, status=400)
+
+        categories = None
+        if request.query_params.get('categories'):
+            try:
+                categories = [int(category) for category in request.query_params['categories'].split(',')]
+            except ValueError:
+                return Response({"error": "categories must be a comma separated list of ids"}, status=400)
+
+        return Response(build_cube(self.get_filtered(), periods, categories))
     
 
     @action(detail=False, methods=['get'])
+    @conditional_get('stats-time')
+    @cached_stats('stats-time', params=('period', 'max_points'))
     def time(self, request):
         period = request.query_params.get('period')
         if period is not None:
             period = period.lower()
 
-        if period not in PERIOD_CONFIG and period is None:
+        if period not in PERIOD_CONFIG:
             return Response({"error": f"Invalid period: {period}"}, status=400)
+
+        try:
+            max_points = get_max_points(request)
+        except ValueError:
+            return Response({"error": "max_points must be an integer of at least 2"}, status=400)
+
+        if max_points is not None:
+            # Keyed by the resolution that fits, which may be coarser than asked for
+            resolution, series = resample(get_days(self.get_rollups()), period, max_points)
+            return Response({'period': resolution, resolution: series})
         
-        qs = self.get_queryset()
-        time_stats = get_time_stats(qs, period)
+        time_stats = get_time_stats(self.get_rollups(), period)
 
         data = {
             period: time_stats
@@ -205,24 +398,238 @@ class StatsViewSet(viewsets.GenericViewSet):
     
 
     @action(detail=False, methods=['get'])
+    @conditional_get('stats-extreme-day')
+    @cached_stats('stats-extreme-day', params=('period',))
     def extreme_day(self, request):
         # period = request.query_params.get('period', 'day').lower()
         period = request.query_params.get('period')
         
-        if period not in PERIOD_CONFIG and period is None:
+        if period not in PERIOD_CONFIG:
             return Response({"error": f"Invalid period: {period}"}, status=400)
 
-        qs = self.get_queryset().filter(type=Transaction.EXPENSE)
-        data = get_time_extreme_stats(qs, period)
-
-        cheapest = data.first()
-        expensive = data.order_by('-total').first()
+        qs = self.get_rollups().filter(type=Transaction.EXPENSE)
+        extremes = build_extremes(qs, [period], n=1)['results'][period]
 
         data = {
             period: {
-                'cheapest': cheapest,
-                'expensive': expensive
+                'cheapest': extremes['bottom'][0] if extremes['bottom'] else None,
+                'expensive': extremes['top'][0] if extremes['top'] else None
             }
         }
 
-        return Response(data)
\ No newline at end of file
+        return Response(data)
+
+
+    @action(detail=False, methods=['get'])
+    @conditional_get('stats-extremes')
+    @cached_stats('stats-extremes', params=('periods', 'n', 'by_category'), filtered=True)
+    def extremes(self, request):
+        # Top-N and bottom-N buckets of several periods, optionally per category
+        periods = [period.strip().lower() for period in request.query_params.get('periods', '').split(',') if period.strip()]
+        periods = list(dict.fromkeys(periods)) or list(PERIOD_CONFIG)
+
+        invalid = [period for period in periods if period not in PERIOD_CONFIG]
+        if invalid:
+            return Response({"error": f"Invalid period: {', '.join(invalid)}"}, status=400)
+
+        try:
+            n = int(request.query_params.get('n', 5))
+        except ValueError:
+            return Response({"error": "n must be a number"}, status=400)
+        if not 1 <= n <= self.max_extremes:
+            return Response({"error": f"n must be between 1 and {self.max_extremes}"}, status=400)
+
+        by_category = request.query_params.get('by_category', '').lower() in ('1', 'true', 'yes')
+
+        # Spending unless ?type= asks for the income side
+        qs = self.get_filtered()
+        if not request.query_params.get('type'):
+            qs = qs.filter(type=Transaction.EXPENSE)
+
+        return Response({'n': n, **build_extremes(qs, periods, n, by_category)})
+
+
+    @action(detail=False, methods=['get'])
+    @conditional_get('stats-balance')
+    @cached_stats('stats-balance', params=('period', 'start_date', 'end_date', 'max_points'))
+    def balance(self, request):
+        period = request.query_params.get('period', 'day').lower()
+        if period not in BALANCE_PERIODS:
+            return Response({"error": f"Invalid period: {period}"}, status=400)
+
+        try:
+            max_points = get_max_points(request)
+        except ValueError:
+            return Response({"error": "max_points must be an integer of at least 2"}, status=400)
+
+        try:
+            start, end = [
+                datetime.date.fromisoformat(request.query_params[name]) if request.query_params.get(name) else None
+                for name in ('start_date', 'end_date')
+            ]
+        except ValueError:
+            return Response({"error": "start_date and end_date must be YYYY-MM-DD dates"}, status=400)
+
+        # The range defaults to the user's first and last transaction dates
+        if start is None or end is None:
+            first, last = activity_range(request.user)
+            start, end = start or first, end or last
+
+        if start is None or end is None:
+            return Response({'period': period, 'start_date': start, 'end_date': end, 'results': []})
+
+        if start > end:
+            return Response({"error": "start_date must not be after end_date"}, status=400)
+
+        # The series is built point by point, so its size bounds the work
+        if max_points is not None and max_points > self.max_balance_points:
+            return Response({"error": f"max_points must be at most {self.max_balance_points}"}, status=400)
+        if max_points is None and bucket_count(start, end, period) > self.max_balance_points:
+            return Response({
+                "error": f"The range has more than {self.max_balance_points} {period} points, pass max_points or a coarser period"
+            }, status=400)
+
+        if max_points is None:
+            results = balance_series(request.user, start, end, period)
+        else:
+            period, results = limited_balance_series(request.user, start, end, period, max_points)
+
+        return Response({
+            'period': period,
+            'start_date': start,
+            'end_date': end,
+            'results': results,
+        })
+
+
+    @action(detail=False, methods=['get'])
+    @conditional_get('stats-distribution')
+    @cached_stats('stats-distribution', params=('start_month', 'end_month', 'categories', 'quantiles'))
+    def distribution(self, request):
+        # Percentiles of the expense amounts, overall and per category, from
+        # the monthly spend sketches; every value is within relative_accuracy
+        # of the exact percentile. The range is whole months.
+        try:
+            start, end = [
+                datetime.date.fromisoformat(f'{request.query_params[name]}-01') if request.query_params.get(name) else None
+                for name in ('start_month', 'end_month')
+            ]
+        except ValueError:
+            return Response({"error": "start_month and end_month must be YYYY-MM months"}, status=400)
+
+        quantiles = DEFAULT_QUANTILES
+        if request.query_params.get('quantiles'):
+            try:
+                quantiles = [float(q) for q in request.query_params['quantiles'].split(',')]
+            except ValueError:
+                quantiles = None
+            if not quantiles or not all(0 <= q <= 1 for q in quantiles):
+                return Response({"error": "quantiles must be a comma separated list of numbers between 0 and 1"}, status=400)
+
+        sketches = SpendSketch.objects.filter(owner=request.user)
+        if start is not None:
+            sketches = sketches.filter(month__gte=start)
+        if end is not None:
+            sketches = sketches.filter(month__lte=end)
+        if request.query_params.get('categories'):
+            try:
+                sketches = sketches.filter(category__in=[int(category) for category in request.query_params['categories'].split(',')])
+            except ValueError:
+                return Response({"error": "categories must be a comma separated list of ids"}, status=400)
+
+        return Response({'start_month': start, 'end_month': end, **spend_distribution(sketches, quantiles)})
+
+
+class SyncViewSet(ShardRoutingMixin, viewsets.GenericViewSet):
+    permission_classes = [IsAuthenticated]
+    page_size = 500
+    max_page_size = 2000
+
+
+    def list(self, request):
+        # Everything created, updated or deleted after ?cursor=, oldest first.
+        # Clients keep the returned cursor and call again while has_more is true.
+        position = START
+        if request.query_params.get('cursor'):
+            try:
+                position = decode_cursor(request.query_params['cursor'])
+            except ValueError:
+                return Response({"error": "Invalid cursor"}, status=400)
+
+        try:
+            limit = min(int(request.query_params.get('limit', self.page_size)), self.max_page_size)
+        except ValueError:
+            return Response({"error": "limit must be a number"}, status=400)
+        if limit <= 0:
+            return Response({"error": "limit must be positive"}, status=400)
+
+        try:
+            changes, position, has_more = get_changes(request.user, position, limit)
+        except CursorExpired:
+            # Deletions older than the cursor were pruned; the client has to start over
+            return Response({"error": "Cursor expired, a full sync is required", "reset": True}, status=410)
+
+        grouped = {'category': [], 'transaction': [], 'tombstone': []}
+        for kind, row in changes:
+            grouped[kind].append(row)
+
+        data = {
+            'categories': CategorySerializer(grouped['category'], many=True).data,
+            'transactions': SyncTransactionSerializer(grouped['transaction'], many=True).data,
+            'deleted': {
+                'categories': [row.object_id for row in grouped['tombstone'] if row.model == Tombstone.CATEGORY],
+                'transactions': [row.object_id for row in grouped['tombstone'] if row.model == Tombstone.TRANSACTION],
+            },
+        }
+        data['cursor'] = encode_cursor(position)
+        data['has_more'] = has_more
+
+        return Response(data)
+
+
+class ReportJobViewSet(ShardRoutingMixin, mixins.ListModelMixin, mixins.RetrieveModelMixin, mixins.DestroyModelMixin, viewsets.GenericViewSet):
+    # Stats payloads too slow to compute inside a request. POST the same
+    # parameters the stats endpoint takes, then poll the job and fetch its result.
+    permission_classes = [IsAuthenticated]
+    serializer_class = ReportJobSerializer
+    queryset = ReportJob.objects.all()
+
+
+    def get_queryset(self):
+        return super().get_queryset().filter(owner=self.request.user).defer('result').order_by('-created_at', '-pk')
+
+
+    def create(self, request):
+        # Parameters come from the query string, the body, or both
+        params = request.query_params.copy()
+        if hasattr(request.data, 'items'):
+            for name, value in request.data.items():
+                params[name] = str(value)
+
+        kind = params.pop('kind', ['transaction-stats'])[-1]
+        if kind not in REPORT_KINDS:
+            return Response({"error": f"Invalid kind: {kind}"}, status=400)
+
+        try:
+            params = clean_params(kind, params)
+        except ValueError:
+            return Response({"error": "max_points must be an integer of at least 2"}, status=400)
+
+        job, created = submit(request.user, kind, params)
+        headers = {'Location': reverse('report-detail', args=[job.pk], request=request)}
+        return Response(self.get_serializer(job).data, status=202 if job.status != ReportJob.DONE else 200, headers=headers)
+
+
+    @action(detail=True, methods=['get'])
+    def result(self, request, pk=None):
+        job = self.get_object()
+        if job.status in (ReportJob.PENDING, ReportJob.RUNNING):
+            return Response(self.get_serializer(job).data, status=202)
+        if job.status == ReportJob.FAILED:
+            return Response({"error": f"The report failed: {job.error}"}, status=409)
+        if job.expires_at <= timezone.now():
+            return Response({"error": "The report expired, submit it again"}, status=410)
+
+        # Stored rendered, so large payloads are not decoded and encoded again
+        result = ReportJob.objects.filter(pk=job.pk).values_list('result', flat=True).get()
+        return HttpResponse(bytes(result), content_type='application/json')
@@ -0,0 +1,204 @@
+"""
+Opt-in per-request profiling.
+
+ProfilingMiddleware records SQL time and query count through connection
+execute wrappers, and times authentication, the view and response
+rendering. Each sampled request gets a Server-Timing header and is added to
+the in-process ``registry`` of per-endpoint histograms.
+
+Configure it with the PROFILING setting; when ENABLED is false the
+middleware removes itself at startup and costs nothing.
+"""
+
+import bisect
+import random
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+
+PROFILING_DEFAULTS = {
+    'ENABLED': False,
+    # Fraction of requests to profile; the rest skip all bookkeeping
+    'SAMPLE_RATE': 1.0,
+    'SERVER_TIMING': True,
+}
+
+# Upper bounds in milliseconds; the last bucket catches everything slower
+HISTOGRAM_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, float('inf'))
+
+SPANS = ('auth', 'db', 'view', 'render', 'total')
+
+# Registry entry of the requests that resolve to no view
+UNMATCHED = '<unmatched>'
+
+
+_current_profile = ContextVar('current_profile', default=None)
+
+
+def get_config():
+    return {**PROFILING_DEFAULTS, **getattr(settings, 'PROFILING', {})}
+
+
+class Profile:
+    def __init__(self):
+        self.durations = dict.fromkeys(SPANS, 0.0)
+        self.queries = 0
+        self.view_started = None
+
+
+    def add(self, name, seconds):
+        self.durations[name] += seconds * 1000
+
+
+    def record_query(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.add('db', time.perf_counter() - start)
+            self.queries += 1
+
+
+    def server_timing(self):
+        parts = []
+        for name in SPANS:
+            entry = f'{name};dur={self.durations[name]:.2f}'
+            if name == 'db':
+                entry += f';desc="{self.queries} queries"'
+            parts.append(entry)
+        return ', '.join(parts)
+
+
+@contextmanager
+def timed(name):
+    # Adds the block's duration to the active profile; a no-op when the
+    # request is not being profiled
+    profile = _current_profile.get()
+    if profile is None:
+        yield
+        return
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile.add(name, time.perf_counter() - start)
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * len(HISTOGRAM_BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(HISTOGRAM_BUCKETS, value)] += 1
+        self.count += 1
+        self.sum += value
+
+
+    def snapshot(self):
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'buckets': {('+Inf' if bound == float('inf') else bound): count for bound, count in zip(HISTOGRAM_BUCKETS, self.counts)},
+        }
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._endpoints = {}
+
+
+    def observe(self, endpoint, profile):
+        with self._lock:
+            metrics = self._endpoints.setdefault(endpoint, {
+                **{name: Histogram() for name in SPANS},
+                'queries': Histogram(),
+            })
+            for name in SPANS:
+                metrics[name].observe(profile.durations[name])
+            metrics['queries'].observe(profile.queries)
+
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                endpoint: {name: histogram.snapshot() for name, histogram in metrics.items()}
+                for endpoint, metrics in self._endpoints.items()
+            }
+
+
+    def reset(self):
+        with self._lock:
+            self._endpoints.clear()
+
+
+registry = MetricsRegistry()
+
+
+class ProfilingMiddleware:
+    def __init__(self, get_response):
+        config = get_config()
+        if not config['ENABLED']:
+            raise MiddlewareNotUsed
+
+        self.get_response = get_response
+        self.sample_rate = config['SAMPLE_RATE']
+        self.server_timing = config['SERVER_TIMING']
+
+
+    def __call__(self, request):
+        if self.sample_rate < 1 and random.random() >= self.sample_rate:
+            return self.get_response(request)
+
+        profile = Profile()
+        token = _current_profile.set(profile)
+        start = time.perf_counter()
+
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(profile.record_query))
+                response = self.get_response(request)
+        finally:
+            _current_profile.reset(token)
+
+        end = time.perf_counter()
+        profile.add('total', end - start)
+
+        if profile.view_started is not None:
+            # Without a template response hook the render span stays at zero
+            rendered = getattr(request, '_profile_view_finished', end)
+            profile.add('view', rendered - profile.view_started)
+            profile.add('render', end - rendered)
+
+        if self.server_timing:
+            response['Server-Timing'] = profile.server_timing()
+
+        # Keyed by URL pattern, never by raw path, so the registry stays bounded
+        match = getattr(request, 'resolver_match', None)
+        registry.observe(match.view_name if match else UNMATCHED, profile)
+
+        return response
+
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        profile = _current_profile.get()
+        if profile is not None:
+            profile.view_started = time.perf_counter()
+
+
+    def process_template_response(self, request, response):
+        # Called after the view returned and before the response is rendered
+        if _current_profile.get() is not None:
+            request._profile_view_finished = time.perf_counter()
+        return response
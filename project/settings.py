@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
+import os
 from pathlib import Path
 from datetime import timedelta
 
@@ -45,6 +46,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'project.profiling.ProfilingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -78,13 +80,98 @@ WSGI_APPLICATION = 'project.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
 
+# Connection settings for the SQLite databases. 'concurrent' is meant for
+# serving parallel requests: WAL lets readers run alongside the one writer,
+# IMMEDIATE transactions take the write lock when they begin instead of
+# failing to upgrade a read lock halfway through, and connections are kept
+# between requests. 'baseline' is Django's defaults, for comparison with
+# `manage.py stress_db`. Set EXPENSES_DATABASE_PROFILE to switch.
+SQLITE_PROFILES = {
+    'baseline': {
+        # The journal mode is stored in the database file, so it is set back explicitly
+        'OPTIONS': {'init_command': 'PRAGMA journal_mode=DELETE'},
+        'CONN_MAX_AGE': 0,
+    },
+    'concurrent': {
+        'OPTIONS': {
+            'init_command': ';'.join([
+                'PRAGMA journal_mode=WAL',
+                # Durable at every checkpoint rather than every commit; safe with WAL
+                'PRAGMA synchronous=NORMAL',
+                'PRAGMA cache_size=-32000',
+                'PRAGMA temp_store=MEMORY',
+                'PRAGMA mmap_size=134217728',
+            ]),
+            'transaction_mode': 'IMMEDIATE',
+            # Seconds a connection waits for the write lock before "database is locked"
+            'timeout': 10,
+        },
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
+    },
+}
+
+DATABASE_PROFILE = os.environ.get('EXPENSES_DATABASE_PROFILE', 'concurrent')
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        **SQLITE_PROFILES[DATABASE_PROFILE],
     }
 }
 
+# Spare databases that become shards once listed in EXPENSES_SHARDS (see
+# settings_sharded.py); the sharding tests spread their users over them
+DATABASES['shard_1'] = {**DATABASES['default'], 'NAME': BASE_DIR / 'shard_1.sqlite3'}
+DATABASES['shard_2'] = {**DATABASES['default'], 'NAME': BASE_DIR / 'shard_2.sqlite3'}
+
+# Writes that still hit "database is locked" are retried this many times,
+# waiting a random time of up to BASE_DELAY * 2 ** attempt (at most MAX_DELAY)
+# seconds in between (expenses/retry.py)
+DATABASE_LOCK_RETRY = {
+    'ATTEMPTS': 4,
+    'BASE_DELAY': 0.05,
+    'MAX_DELAY': 1.0,
+}
+
+# Databases holding the users' categories, transactions and derived rows, one
+# shard per user; users, auth and report jobs stay on 'default'. To add a
+# shard, add it to DATABASES and here, run `manage.py migrate --database`
+# for it, then `manage.py rebalance_shards`.
+EXPENSES_SHARDS = ['default']
+
+DATABASE_ROUTERS = ['expenses.routers.ShardRouter']
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.1/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # Per process, which only suits a single worker: with more, use a shared
+    # backend such as RedisCache (manage.py check --deploy, expenses.W001)
+    'stats': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'stats',
+        'TIMEOUT': 300,
+        'OPTIONS': {
+            # Least recently used entries are culled once the limit is reached
+            'MAX_ENTRIES': 2000,
+            'CULL_FREQUENCY': 4,
+        }
+    }
+}
+
+STATS_CACHE = {
+    'ALIAS': 'stats',
+    'TIMEOUT': 300,
+    # Payloads bigger than this (pickled bytes) are not cached
+    'MAX_ENTRY_SIZE': 256 * 1024,
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
@@ -130,7 +217,7 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'accounts.authentication.JWTAuthentication',
     ),
     'DEFAULT_FILTER_BACKENDS': ['django_filters.rest_framework.DjangoFilterBackend',
                                 'rest_framework.filters.OrderingFilter',]
@@ -144,4 +231,48 @@ SIMPLE_JWT = {
 }
 
 
-AUTH_USER_MODEL = 'accounts.User'
\ No newline at end of file
+AUTH_USER_MODEL = 'accounts.User'
+
+
+# In-process cache of the users behind JWTs (accounts/authentication.py), so
+# authenticated requests normally skip the user SELECT. Entries are evicted
+# when the user is saved or deleted; TIMEOUT (seconds) bounds staleness
+# across processes, 0 disables the cache.
+AUTH_USER_CACHE = {
+    'MAX_SIZE': 1024,
+    'TIMEOUT': 60,
+}
+
+
+# Per-request profiling (project/profiling.py): Server-Timing headers and
+# in-process per-endpoint histograms. SAMPLE_RATE < 1 profiles only that
+# fraction of requests.
+PROFILING = {
+    'ENABLED': False,
+    'SAMPLE_RATE': 1.0,
+    'SERVER_TIMING': True,
+}
+
+
+# Implementation behind TransactionViewSet.stats: 'orm' or 'numpy' (requires numpy)
+EXPENSES_STATS_BACKEND = 'orm'
+
+
+# Thread pool behind the async stats views (expenses/async_views.py): WORKERS
+# bounds the concurrent stats queries (and database connections) per process,
+# PARTITIONS is how many date ranges one payload is aggregated in
+STATS_CONCURRENCY = {
+    'WORKERS': 4,
+    'PARTITIONS': 4,
+}
+
+
+# Background report jobs (expenses/services/reports.py). RUNNER 'thread' runs
+# them on an in-process pool of WORKERS threads; 'command' leaves them to
+# `manage.py run_report_worker`. Results are kept for RESULT_TTL seconds.
+REPORT_JOBS = {
+    'RUNNER': 'thread',
+    'WORKERS': 2,
+    'RESULT_TTL': 3600,
+    'STALE_AFTER': 900,
+}
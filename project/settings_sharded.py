@@ -0,0 +1,7 @@
+# Settings with the expenses data split over three SQLite shards, e.g.
+# `manage.py runserver --settings=project.settings_sharded`
+
+from .settings import *  # noqa: F401,F403
+
+
+EXPENSES_SHARDS = ['default', 'shard_1', 'shard_2']